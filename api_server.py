@@ -1,12 +1,16 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
-from ticket import render_ticket
+from render_cache import render_ticket_bytes, display_list_bytes, RENDER_CACHE
+from tiff_writer import tiff_size
+from ticket import OUTPUT_FORMATS, normalize_format, CANVAS_POOL, cache_stats as ticket_cache_stats, load_render_plan, unrenderable_chars, check_render_cost, RenderCostError, \
+    resolve_scale, render_region, encode_image, load_palette, load_base_layer, \
+    export_print, PRINT_FORMATS, PRINT_TILE_HEIGHT, display_asset, DISPLAY_LIST_VERSION
 import os
 import json
 import uuid
 import tempfile
 import base64
-from io import BytesIO
+import math
 import traceback
 
 app = Flask(__name__)
@@ -42,6 +46,90 @@ def validate_user_data(user_data, style):
     
     return True, "数据验证通过"
 
+def check_renderable(user_data, template_json_path):
+    """检查模板字体（含回退链）能否显示用户输入的每个字符，返回 (是否通过, 提示, {字段: 无法显示的字符})"""
+    missing = unrenderable_chars(load_render_plan(template_json_path, TEMPLATE_DIR), user_data)
+    if missing:
+        detail = "；".join(f"{key}: {chars}" for key, chars in missing.items())
+        return False, f"包含字体无法显示的字符（{detail}）", missing
+    return True, "字符检查通过", {}
+
+def check_cost(user_data, template_json_path):
+    """按原始分辨率预估渲染开销（缩小预览只会更省），返回 (是否通过, 提示, 超限明细)"""
+    try:
+        check_render_cost(load_render_plan(template_json_path, TEMPLATE_DIR), user_data)
+    except RenderCostError as e:
+        return False, f"输入超出渲染限制: {e}", e.violations
+    return True, "开销检查通过", []
+
+def parse_render_size(data):
+    """解析预览尺寸参数：scale 为 (0, 1] 的缩放系数，max_width 为输出宽度上限（像素）"""
+    try:
+        scale = float(data.get('scale') or 1.0)
+        max_width = data.get('max_width')
+        max_width = int(max_width) if max_width not in (None, '') else None
+    except (TypeError, ValueError):
+        return False, "scale 必须是数字，max_width 必须是整数", None, None
+    if not 0 < scale <= 1:
+        return False, "scale 取值范围为 (0, 1]", None, None
+    if max_width is not None and max_width <= 0:
+        return False, "max_width 必须大于 0", None, None
+    return True, "参数验证通过", scale, max_width
+
+def check_render_size(template_json_path, scale, max_width):
+    """按模板原宽检查预览尺寸（max_width 不能小于最小缩放档），返回 (是否通过, 提示)"""
+    try:
+        resolve_scale(template_json_path, TEMPLATE_DIR, scale, max_width)
+    except ValueError as e:
+        return False, str(e)
+    return True, "尺寸检查通过"
+
+# Accept 头协商顺序：同等权重时优先无损 PNG
+ACCEPT_IMAGE_TYPES = {'image/png': 'PNG', 'image/webp': 'WEBP', 'image/jpeg': 'JPEG', 'application/pdf': 'PDF'}
+FILE_SUFFIXES = {'image/png': '.png', 'image/webp': '.webp', 'image/jpeg': '.jpg', 'application/pdf': '.pdf'}
+
+def parse_image_format(data, negotiate=False):
+    """解析图片编码参数：image_format 显式指定优先；negotiate 为真（直接返回图片文件）时按 Accept 头协商，
+    否则默认 PNG。base64 放在 JSON 里返回时 Accept 描述的是 JSON 响应本身，不参与协商"""
+    try:
+        image_format = data.get('image_format')
+        if image_format:
+            image_format = normalize_format(image_format)
+        elif not negotiate:
+            image_format = 'PNG'
+        else:
+            best = request.accept_mimetypes.best_match(list(ACCEPT_IMAGE_TYPES))
+            image_format = ACCEPT_IMAGE_TYPES.get(best, 'PNG')
+        quality = data.get('quality')
+        quality = int(quality) if quality not in (None, '') else None
+    except (TypeError, ValueError) as e:
+        return False, f"图片格式参数错误: {e}", None, None
+    if quality is not None and not 1 <= quality <= 100:
+        return False, "quality 取值范围为 1-100", None, None
+    return True, "参数验证通过", image_format, quality
+
+# 打印导出的 DPI 上限；开销预算按打印缩放同比放宽（见 ticket.print_budget），默认车票在此上限内均可导出
+MAX_PRINT_DPI = 2400
+PRINT_MIME_TYPES = {'PNG': 'image/png', 'TIFF': 'image/tiff'}
+
+def parse_print_params(data):
+    """解析打印导出参数：dpi、width_mm（整张画布的打印宽度，毫米）、image_format（PNG / TIFF）"""
+    try:
+        dpi = data.get('dpi')
+        dpi = float(dpi) if dpi not in (None, '') else 300.0
+        width_mm = data.get('width_mm')
+        width_mm = float(width_mm) if width_mm not in (None, '') else None
+        image_format = str(data.get('image_format') or 'PNG').upper()
+    except (TypeError, ValueError):
+        return False, "dpi 与 width_mm 必须是数字", None, None, None
+    if not 0 < dpi <= MAX_PRINT_DPI:
+        return False, f"dpi 取值范围为 (0, {MAX_PRINT_DPI}]", None, None, None
+    if width_mm is not None and not (math.isfinite(width_mm) and width_mm > 0):
+        return False, "width_mm 必须是大于 0 的有限数", None, None, None
+    if image_format not in PRINT_FORMATS:
+        return False, f"打印导出仅支持: {', '.join(PRINT_FORMATS)}", None, None, None
+    return True, "参数验证通过", dpi, width_mm, image_format
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
@@ -118,6 +206,23 @@ def generate_ticket():
         style = data.get('style', 'red15')  # 默认样式
         return_format = data.get('format', 'base64')  # base64 或 file
         
+        # 预览尺寸（默认原始分辨率）
+        is_valid, message, scale, max_width = parse_render_size(data)
+        if not is_valid:
+            return jsonify({
+                "success": False,
+                "error": message
+            }), 400
+        
+        # 图片编码格式
+        is_valid, message, image_format, quality = parse_image_format(data, negotiate=return_format == 'file')
+        if not is_valid:
+            return jsonify({
+                "success": False,
+                "error": message
+            }), 400
+        mime_type = OUTPUT_FORMATS[image_format]
+        
         # 验证样式是否存在
         available_styles = get_available_styles()
         if style not in available_styles:
@@ -142,9 +247,64 @@ def generate_ticket():
                 "error": f"模板文件不存在: {template_json_path}"
             }), 500
         
-        # 渲染车票
+        is_valid, message = check_render_size(template_json_path, scale, max_width)
+        if not is_valid:
+            return jsonify({
+                "success": False,
+                "error": message
+            }), 400
+        
+        # 超长文本、过大的星号个数等会让单次渲染耗时失控，渲染前拒绝
+        is_valid, message, violations = check_cost(user_data, template_json_path)
+        if not is_valid:
+            return jsonify({
+                "success": False,
+                "error": message,
+                "violations": violations
+            }), 413
+        
+        # 字体无法显示的字符会画成方框，渲染前拒绝
+        is_valid, message, missing = check_renderable(user_data, template_json_path)
+        if not is_valid:
+            return jsonify({
+                "success": False,
+                "error": message,
+                "unrenderable": missing
+            }), 400
+        
+        # 局部预览：只渲染正在编辑的字段所在区域，客户端按 region 贴回整张预览
+        focus_field = data.get('focus_field')
+        region = None
+        if focus_field:
+            if image_format == 'PDF':
+                return jsonify({
+                    "success": False,
+                    "error": "局部预览不支持 PDF 输出"
+                }), 400
+            # 客户端手上那张预览所用的数据：区域同时覆盖旧字形，贴回后不留残影
+            previous_user_data = data.get('previous_user_data')
+            if previous_user_data is not None and not isinstance(previous_user_data, dict):
+                return jsonify({
+                    "success": False,
+                    "error": "previous_user_data 必须是字典格式"
+                }), 400
+            try:
+                plan = load_render_plan(template_json_path, TEMPLATE_DIR,
+                                        resolve_scale(template_json_path, TEMPLATE_DIR, scale, max_width))
+                image, region = render_region(plan, user_data, focus_field, previous_user_data=previous_user_data)
+            except ValueError as e:
+                return jsonify({
+                    "success": False,
+                    "error": str(e)
+                }), 400
+            image_bytes = encode_image(image, image_format, quality, load_palette(plan) if image_format == 'PNG8' else None)
+            canvas_size = load_base_layer(plan).size
+        
+        # 渲染车票（相同输入直接命中渲染缓存）
         try:
-            ticket_image = render_ticket(user_data, template_json_path, TEMPLATE_DIR)
+            if region is None:
+                image_bytes = render_ticket_bytes(user_data, template_json_path, TEMPLATE_DIR, image_format,
+                                                  scale=scale, max_width=max_width, quality=quality)
         except Exception as render_error:
             print(f"渲染错误: {render_error}")
             print(f"渲染错误详情: {traceback.format_exc()}")
@@ -155,34 +315,41 @@ def generate_ticket():
         
         if return_format == 'base64':
             # 返回base64编码的图片
-            buffer = BytesIO()
-            ticket_image.save(buffer, format='PNG')
-            buffer.seek(0)
-            image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+            result = {
+                "image_base64": image_base64,
+                "format": image_format,
+                "mime_type": mime_type,
+                "style": style,
+                "user_data": user_data
+            }
+            if region is not None:
+                result["region"] = list(region)
+                result["canvas_size"] = list(canvas_size)
             
             return jsonify({
                 "success": True,
                 "message": "车票生成成功",
-                "data": {
-                    "image_base64": image_base64,
-                    "format": "PNG",
-                    "style": style,
-                    "user_data": user_data
-                }
+                "data": result
             })
         
         else:
             # 返回临时文件
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-            ticket_image.save(temp_file.name, format='PNG')
+            suffix = FILE_SUFFIXES[mime_type]
+            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+            temp_file.write(image_bytes)
             temp_file.close()
             
-            return send_file(
+            response = send_file(
                 temp_file.name,
-                mimetype='image/png',
+                mimetype=mime_type,
                 as_attachment=True,
-                download_name=f'ticket_{style}_{uuid.uuid4().hex[:8]}.png'
+                download_name=f'ticket_{style}_{uuid.uuid4().hex[:8]}{suffix}'
             )
+            if region is not None:
+                response.headers['X-Ticket-Region'] = ','.join(map(str, region))
+                response.headers['X-Ticket-Canvas-Size'] = ','.join(map(str, canvas_size))
+            return response
     
     except Exception as e:
         error_msg = f"生成车票时发生错误: {str(e)}"
@@ -306,6 +473,20 @@ def batch_generate():
         style = data.get('style', 'red15')
         return_format = data.get('format', 'base64')
         
+        is_valid, message, scale, max_width = parse_render_size(data)
+        if not is_valid:
+            return jsonify({
+                "success": False,
+                "error": message
+            }), 400
+        
+        is_valid, message, image_format, quality = parse_image_format(data)
+        if not is_valid:
+            return jsonify({
+                "success": False,
+                "error": message
+            }), 400
+        
         if not isinstance(tickets_data, list) or len(tickets_data) == 0:
             return jsonify({
                 "success": False,
@@ -320,6 +501,12 @@ def batch_generate():
         
         results = []
         template_json_path = get_template_json(style)
+        is_valid, message = check_render_size(template_json_path, scale, max_width)
+        if not is_valid:
+            return jsonify({
+                "success": False,
+                "error": message
+            }), 400
         
         for i, ticket_data in enumerate(tickets_data):
             try:
@@ -333,21 +520,39 @@ def batch_generate():
                     })
                     continue
                 
-                # 生成车票
-                ticket_image = render_ticket(ticket_data, template_json_path, TEMPLATE_DIR)
+                is_valid, message, violations = check_cost(ticket_data, template_json_path)
+                if not is_valid:
+                    results.append({
+                        "index": i,
+                        "success": False,
+                        "error": message,
+                        "violations": violations
+                    })
+                    continue
+                
+                is_valid, message, missing = check_renderable(ticket_data, template_json_path)
+                if not is_valid:
+                    results.append({
+                        "index": i,
+                        "success": False,
+                        "error": message,
+                        "unrenderable": missing
+                    })
+                    continue
                 
                 if return_format == 'base64':
-                    buffer = BytesIO()
-                    ticket_image.save(buffer, format='PNG')
-                    buffer.seek(0)
-                    image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+                    # 生成车票
+                    image_bytes = render_ticket_bytes(ticket_data, template_json_path, TEMPLATE_DIR, image_format,
+                                                      scale=scale, max_width=max_width, quality=quality)
+                    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
                     
                     results.append({
                         "index": i,
                         "success": True,
                         "data": {
                             "image_base64": image_base64,
-                            "format": "PNG",
+                            "format": image_format,
+                            "mime_type": OUTPUT_FORMATS[image_format],
                             "user_data": ticket_data
                         }
                     })
@@ -378,6 +583,161 @@ def batch_generate():
             "error": str(e)
         }), 500
 
+@app.route('/api/print', methods=['POST'])
+def print_ticket():
+    """高分辨率打印导出API：按 DPI 缩放渲染，分块合成并流式返回 PNG / TIFF"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({
+            "success": False,
+            "error": "请求数据不能为空"
+        }), 400
+    
+    user_data = data.get('user_data', {})
+    style = data.get('style', 'red15')
+    if style not in get_available_styles():
+        return jsonify({
+            "success": False,
+            "error": f"不支持的样式: {style}"
+        }), 400
+    
+    is_valid, message = validate_user_data(user_data, style)
+    if not is_valid:
+        return jsonify({
+            "success": False,
+            "error": message
+        }), 400
+    
+    is_valid, message, dpi, width_mm, image_format = parse_print_params(data)
+    if not is_valid:
+        return jsonify({
+            "success": False,
+            "error": message
+        }), 400
+    
+    template_json_path = get_template_json(style)
+    options = {"dpi": dpi, "fmt": image_format}
+    if width_mm is not None:
+        options["width_mm"] = width_mm
+    # 先做缩放上限与开销检查（输出按块惰性生成，此时尚未渲染），再逐字检查字体覆盖
+    try:
+        chunks, (width, height), actual_dpi = export_print(user_data, template_json_path, TEMPLATE_DIR, **options)
+    except RenderCostError as e:
+        return jsonify({
+            "success": False,
+            "error": f"输入超出渲染限制: {e}",
+            "violations": e.violations
+        }), 413
+    
+    is_valid, message, missing = check_renderable(user_data, template_json_path)
+    if not is_valid:
+        return jsonify({
+            "success": False,
+            "error": message,
+            "unrenderable": missing
+        }), 400
+    
+    suffix = '.tif' if image_format == 'TIFF' else '.png'
+    response = Response(stream_with_context(chunks), mimetype=PRINT_MIME_TYPES[image_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=ticket_{style}_{round(actual_dpi)}dpi{suffix}'
+    response.headers['X-Ticket-Size'] = f'{width}x{height}'
+    if image_format == 'TIFF':
+        response.headers['Content-Length'] = str(tiff_size(width, height, 'RGB', PRINT_TILE_HEIGHT))
+    return response
+
+@app.route('/api/layout', methods=['POST'])
+def layout_ticket():
+    """显示列表API：返回排版好的绘制指令（文本、线条、圆圈、二维码模块等），由客户端自行绘制。
+    结果按输入的内容地址缓存，ETag 即内容地址，客户端带 If-None-Match 时未变化返回 304"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({
+            "success": False,
+            "error": "请求数据不能为空"
+        }), 400
+    
+    user_data = data.get('user_data', {})
+    style = data.get('style', 'red15')
+    if style not in get_available_styles():
+        return jsonify({
+            "success": False,
+            "error": f"不支持的样式: {style}"
+        }), 400
+    
+    is_valid, message = validate_user_data(user_data, style)
+    if not is_valid:
+        return jsonify({
+            "success": False,
+            "error": message
+        }), 400
+    
+    is_valid, message, scale, max_width = parse_render_size(data)
+    if not is_valid:
+        return jsonify({
+            "success": False,
+            "error": message
+        }), 400
+    
+    template_json_path = get_template_json(style)
+    is_valid, message = check_render_size(template_json_path, scale, max_width)
+    if not is_valid:
+        return jsonify({
+            "success": False,
+            "error": message
+        }), 400
+    
+    is_valid, message, violations = check_cost(user_data, template_json_path)
+    if not is_valid:
+        return jsonify({
+            "success": False,
+            "error": message,
+            "violations": violations
+        }), 413
+    
+    is_valid, message, missing = check_renderable(user_data, template_json_path)
+    if not is_valid:
+        return jsonify({
+            "success": False,
+            "error": message,
+            "unrenderable": missing
+        }), 400
+    
+    layout_bytes, key = display_list_bytes(user_data, template_json_path, TEMPLATE_DIR, scale=scale, max_width=max_width)
+    if key in request.if_none_match:
+        response = Response(status=304)
+    else:
+        # 缓存中的列表已是 JSON，直接拼进响应，不再解析
+        body = b'{"success":true,"style":%s,"data":%s}' % (json.dumps(style).encode('utf-8'), layout_bytes)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(key)
+    response.headers['X-Display-List-Version'] = str(DISPLAY_LIST_VERSION)
+    return response
+
+@app.route('/api/assets/<asset_id>', methods=['GET'])
+def get_asset(asset_id):
+    """显示列表引用的字体、背景与叠加图；资源 ID 按内容寻址，可永久缓存"""
+    asset = display_asset(asset_id)
+    if asset is None:
+        return jsonify({
+            "success": False,
+            "error": f"资源不存在: {asset_id}"
+        }), 404
+    mime_type, body = asset
+    response = Response(body, mimetype=mime_type)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(asset_id)
+    return response
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """渲染缓存、画布池与字段贴图等内部缓存的统计"""
+    return jsonify({
+        "success": True,
+        "render_cache": RENDER_CACHE.stats(),
+        "canvas_pool": CANVAS_POOL.stats(),
+        "ticket_caches": ticket_cache_stats()
+    })
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
@@ -400,6 +760,8 @@ if __name__ == '__main__':
     print("  POST /api/generate - 生成单张车票")
     print("  GET  /api/template/<style> - 获取模板信息")
     print("  POST /api/batch_generate - 批量生成车票")
+    print("  POST /api/print - 高分辨率打印导出（PNG / TIFF）")
+    print("  GET  /api/cache/stats - 渲染缓存与画布池统计")
     print("\n服务地址: http://localhost:5001")
     print("API文档: 请查看 api_docs.md")
     
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PNG 编码基准：Pillow 默认编码器 vs 多线程 png_writer
+
+用法: python bench_png.py [次数] [线程数...]
+"""
+
+import json
+import os
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+
+import png_writer
+from ticket import render_ticket, load_render_plan, load_palette
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+STYLES = ["red15", "blue15", "red05_longride", "red1997"]
+
+
+def timed(fn, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        data = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, len(data)
+
+
+def pillow_png(image):
+    buf = BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    thread_counts = [int(n) for n in sys.argv[2:]] or sorted({1, png_writer.PNG_WORKERS})
+    print(f"CPU 核数: {os.cpu_count()}，每项取 {rounds} 次中的最快值")
+    print(f"{'样式':<16}{'模式':<6}{'编码器':<14}{'耗时(ms)':>10}{'大小(KB)':>12}")
+    for style in STYLES:
+        template_json = os.path.join(TEMPLATE_DIR, f"ticket_template_{style}.json")
+        user_json = os.path.join(BASE_DIR, "default_templates", f"user_{style}.json")
+        with open(user_json, encoding="utf-8") as f:
+            user_data = json.load(f)
+        image = render_ticket(user_data, template_json, TEMPLATE_DIR)
+        palette = load_palette(load_render_plan(template_json, TEMPLATE_DIR))
+        for mode, img in (("RGB", image), ("P", image.quantize(palette=palette, dither=Image.Dither.NONE))):
+            ms, size = timed(lambda: pillow_png(img), rounds)
+            print(f"{style:<16}{mode:<6}{'pillow':<14}{ms:>10.1f}{size / 1024:>12.1f}")
+            for workers in thread_counts:
+                ms, size = timed(lambda: png_writer.encode_png(img, workers=workers), rounds)
+                print(f"{style:<16}{mode:<6}{f'png_writer x{workers}':<14}{ms:>10.1f}{size / 1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+pytest 公共夹具
+"""
+
+import pytest
+
+import render_cache
+
+
+@pytest.fixture
+def temp_render_cache(tmp_path, monkeypatch):
+    """接口测试使用临时目录下的渲染缓存，不读写真实缓存目录"""
+    cache = render_cache.RenderCache(disk_dir=str(tmp_path))
+    monkeypatch.setattr(render_cache, "RENDER_CACHE", cache)
+    return cache
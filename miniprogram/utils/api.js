@@ -159,6 +159,21 @@ class ApiService {
     }
   }
 
+  // 获取显示列表（客户端自行绘制，见 utils/renderer.js）
+  async getLayout(data) {
+    try {
+      const result = await this.request({
+        url: '/api/layout',
+        method: 'POST',
+        data: data
+      })
+      return result
+    } catch (error) {
+      console.error('获取显示列表失败:', error)
+      throw error
+    }
+  }
+
   // 批量生成车票
   async batchGenerateTickets(data) {
     try {
@@ -297,6 +312,7 @@ module.exports = {
   getStyles: () => apiService.getStyles(),
   getTemplateInfo: (style) => apiService.getTemplateInfo(style),
   generateTicket: (data) => apiService.generateTicket(data),
+  getLayout: (data) => apiService.getLayout(data),
   batchGenerateTickets: (data) => apiService.batchGenerateTickets(data),
 
   // 用户相关方法
@@ -1 +1,233 @@
- 
\ No newline at end of file
+// utils/renderer.js
+// 按服务端显示列表（/api/layout）在 canvas（type="2d"）上绘制车票
+// 字体、背景、叠加图按资源 ID 只下载一次（/api/assets/<id>），之后的预览只请求几 KB 的显示列表
+
+const api = require('./api.js')
+
+// 已加载的字体资源 ID（wx.loadFontFace 全局生效）
+const loadedFonts = new Set()
+// 资源 ID -> canvas 图片对象（按 canvas 缓存，canvas 销毁后随之释放）
+const imageCache = new WeakMap()
+
+function assetUrl(id) {
+  return `${api.getBaseUrl()}/api/assets/${id}`
+}
+
+function fontFamily(id) {
+  return `ticket_${id}`
+}
+
+// 加载字体
+function loadFont(id) {
+  if (loadedFonts.has(id)) {
+    return Promise.resolve()
+  }
+  return new Promise((resolve, reject) => {
+    wx.loadFontFace({
+      global: true,
+      scopes: ['webview', 'native'],
+      family: fontFamily(id),
+      source: `url("${assetUrl(id)}")`,
+      success: () => {
+        loadedFonts.add(id)
+        resolve()
+      },
+      fail: (error) => {
+        console.error('字体加载失败:', id, error)
+        reject(error)
+      }
+    })
+  })
+}
+
+// 加载图片（背景、叠加图）
+function loadImage(canvas, id) {
+  let images = imageCache.get(canvas)
+  if (!images) {
+    images = new Map()
+    imageCache.set(canvas, images)
+  }
+  if (images.has(id)) {
+    return images.get(id)
+  }
+  const pending = new Promise((resolve, reject) => {
+    const image = canvas.createImage()
+    image.onload = () => resolve(image)
+    image.onerror = (error) => {
+      images.delete(id)
+      console.error('图片加载失败:', id, error)
+      reject(error)
+    }
+    image.src = assetUrl(id)
+  })
+  images.set(id, pending)
+  return pending
+}
+
+// 预加载显示列表引用的全部资源，返回 { 资源 ID: 图片 }
+async function loadAssets(canvas, displayList) {
+  const imageIds = [displayList.background]
+  displayList.ops.forEach(op => {
+    if (op.op === 'image') imageIds.push(op.asset)
+  })
+  const fontIds = Object.keys(displayList.fonts)
+  await Promise.all(fontIds.map(loadFont))
+  const images = await Promise.all(imageIds.map(id => loadImage(canvas, id)))
+  const result = {}
+  imageIds.forEach((id, i) => { result[id] = images[i] })
+  return result
+}
+
+// ------------------------------
+// 绘制指令（坐标为画布像素；线条按像素中心对齐，与服务端 Pillow 栅格化位置一致）
+// ------------------------------
+function drawText(ctx, op) {
+  const family = op.font ? `"${fontFamily(op.font)}"` : 'sans-serif'
+  ctx.font = `${op.size}px ${family}`
+  ctx.fillStyle = op.fill
+  ctx.textBaseline = 'alphabetic'
+  ctx.textAlign = 'left'
+  ctx.save()
+  ctx.translate(op.x, op.baseline)
+  ctx.scale(op.scale_x, 1)
+  // 逐字按服务端笔位绘制，不依赖客户端的字宽测量
+  let pen = 0
+  Array.from(op.text).forEach((ch, i) => {
+    ctx.fillText(ch, pen, 0)
+    pen += op.advances[i]
+  })
+  ctx.restore()
+}
+
+function strokeSegment(ctx, x0, y0, x1, y1) {
+  ctx.beginPath()
+  ctx.moveTo(x0 + 0.5, y0 + 0.5)
+  ctx.lineTo(x1 + 0.5, y1 + 0.5)
+  ctx.stroke()
+}
+
+function drawLine(ctx, op) {
+  ctx.strokeStyle = op.stroke
+  ctx.lineWidth = Math.max(op.width, 1)
+  ctx.lineCap = 'butt'
+  const [[x0, y0], [x1, y1]] = op.points
+  strokeSegment(ctx, x0, y0, x1, y1)
+}
+
+function drawDashedRect(ctx, op) {
+  const [x0, y0, x1, y1] = op.rect
+  const dash = op.dash
+  ctx.strokeStyle = op.stroke
+  ctx.lineWidth = Math.max(op.width, 1)
+  ctx.lineCap = 'butt'
+  for (let x = x0; x < x1; x += 2 * dash) {
+    const end = Math.min(x + dash, x1)
+    strokeSegment(ctx, x, y0, end, y0)
+    strokeSegment(ctx, x, y1, end, y1)
+  }
+  for (let y = y0; y < y1; y += 2 * dash) {
+    const end = Math.min(y + dash, y1)
+    strokeSegment(ctx, x0, y, x0, end)
+    strokeSegment(ctx, x1, y, x1, end)
+  }
+}
+
+function drawPolygon(ctx, op) {
+  ctx.fillStyle = op.fill
+  ctx.beginPath()
+  op.points.forEach(([x, y], i) => {
+    if (i === 0) ctx.moveTo(x + 0.5, y + 0.5)
+    else ctx.lineTo(x + 0.5, y + 0.5)
+  })
+  ctx.closePath()
+  ctx.fill()
+}
+
+function drawCircle(ctx, op) {
+  // 与 Pillow 的 ellipse 一致：外框含端点像素，描边画在圆以内
+  const cx = op.cx + 0.5
+  const cy = op.cy + 0.5
+  const r = op.r + 0.5
+  if (op.fill) {
+    ctx.fillStyle = op.fill
+    ctx.beginPath()
+    ctx.arc(cx, cy, r, 0, 2 * Math.PI)
+    ctx.fill()
+  }
+  if (op.stroke && op.width > 0) {
+    ctx.strokeStyle = op.stroke
+    ctx.lineWidth = op.width
+    ctx.beginPath()
+    ctx.arc(cx, cy, r - op.width / 2, 0, 2 * Math.PI)
+    ctx.stroke()
+  }
+}
+
+function drawQr(ctx, op) {
+  const n = op.modules.length
+  // 模块边界与服务端最近邻放大一致
+  const edges = []
+  for (let j = 0; j < n; j++) edges.push(Math.max(0, Math.ceil(j * op.size / n - 0.5)))
+  edges.push(op.size)
+  ctx.fillStyle = '#000000'
+  op.modules.forEach((row, j) => {
+    let i = 0
+    while (i < n) {
+      if (row[i] !== '1') { i++; continue }
+      let k = i
+      while (k < n && row[k] === '1') k++
+      ctx.fillRect(op.x + edges[i], op.y + edges[j], edges[k] - edges[i], edges[j + 1] - edges[j])
+      i = k
+    }
+  })
+}
+
+function drawBars(ctx, op) {
+  ctx.fillStyle = '#000000'
+  op.bars.forEach(([x, w]) => ctx.fillRect(x, op.y, w, op.height))
+}
+
+const painters = {
+  text: drawText,
+  line: drawLine,
+  dashed_rect: drawDashedRect,
+  polygon: drawPolygon,
+  circle: drawCircle,
+  qr: drawQr,
+  bars: drawBars
+}
+
+// 绘制显示列表；canvas 的像素尺寸由调用方设置，列表按比例缩放铺满画布宽度
+async function drawDisplayList(canvas, displayList) {
+  const images = await loadAssets(canvas, displayList)
+  const ctx = canvas.getContext('2d')
+  const k = canvas.width / displayList.width
+  ctx.setTransform(k, 0, 0, k, 0, 0)
+  ctx.clearRect(0, 0, displayList.width, displayList.height)
+  ctx.drawImage(images[displayList.background], 0, 0, displayList.width, displayList.height)
+  displayList.ops.forEach(op => {
+    if (op.op === 'image') {
+      ctx.drawImage(images[op.asset], op.x, op.y, op.width, op.height)
+      return
+    }
+    const paint = painters[op.op]
+    if (paint) paint(ctx, op)
+    else console.warn('未知的绘制指令:', op.op)
+  })
+}
+
+// 请求显示列表并绘制；data 与 /api/generate 相同（style、user_data、scale、max_width）
+async function renderTicket(canvas, data) {
+  const result = await api.getLayout(data)
+  if (!result.success) {
+    throw new Error(result.error || '获取显示列表失败')
+  }
+  await drawDisplayList(canvas, result.data)
+  return result.data
+}
+
+module.exports = {
+  loadAssets,
+  drawDisplayList,
+  renderTicket
+}
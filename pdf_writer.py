@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+单页矢量 PDF 输出
+
+坐标与 Pillow 画布一致（像素、左上角为原点、y 向下），整页由一次 cm 变换映射到以点为单位的页面。
+绘图接口（line / polygon / ellipse）与 ImageDraw 同名同参，现有的绘制函数可直接画到 PDF 上；
+文本按 TrueType 字形编号写为 Identity-H 编码的 CID 字体，字体按文档子集化嵌入，附 ToUnicode 以便复制和检索。
+"""
+
+import hashlib
+import zlib
+from io import BytesIO
+
+from PIL import ImageColor
+
+
+def _num(v):
+    """紧凑的数字写法（最多 3 位小数）"""
+    s = ("%.3f" % v).rstrip("0").rstrip(".")
+    return "0" if s in ("", "-0") else s
+
+
+def _rgb(fill):
+    if isinstance(fill, str):
+        fill = ImageColor.getrgb(fill)
+    if isinstance(fill, int):
+        fill = (fill, fill, fill)
+    return " ".join(_num(c / 255) for c in fill[:3])
+
+
+class _FontUse:
+    """文档内一个字体的使用记录：原字形编号 -> CID（即子集中的新编号，从 1 开始）"""
+
+    def __init__(self, font, name):
+        self.font = font
+        self.name = name
+        self.cids = {0: 0}
+        self.unicodes = {}
+
+    def cid(self, gid, ch):
+        cid = self.cids.get(gid)
+        if cid is None:
+            cid = self.cids[gid] = len(self.cids)
+            self.unicodes[cid] = ch
+        return cid
+
+
+class PdfDocument:
+    """单页 PDF；width/height 为画布像素，page_width 为页面宽度（点），高度按比例"""
+
+    def __init__(self, width, height, page_width):
+        self.width, self.height = width, height
+        self.k = page_width / width
+        self.ops = ["%s 0 0 %s 0 %s cm" % (_num(self.k), _num(-self.k), _num(height * self.k))]
+        self.fonts = {}
+        self.images = []
+
+    # ------------------------------
+    # 与 ImageDraw 兼容的绘图接口（像素坐标以像素中心为准，和 Pillow 的栅格化位置对齐）
+    # ------------------------------
+    @staticmethod
+    def _points(xy):
+        if xy and not isinstance(xy[0], (tuple, list)):
+            xy = list(zip(xy[0::2], xy[1::2]))
+        return [(x + 0.5, y + 0.5) for x, y in xy]
+
+    def _path(self, points):
+        head, rest = points[0], points[1:]
+        return " ".join(["%s %s m" % (_num(head[0]), _num(head[1]))] + ["%s %s l" % (_num(x), _num(y)) for x, y in rest])
+
+    def line(self, xy, fill=None, width=0, joint=None):
+        self.ops.append("%s RG %s w 0 J %s S" % (_rgb(fill), _num(max(width, 1)), self._path(self._points(xy))))
+
+    def polygon(self, xy, fill=None, outline=None, width=1):
+        path = self._path(self._points(xy)) + " h"
+        if fill is not None and outline is not None:
+            self.ops.append("%s rg %s RG %s w %s B" % (_rgb(fill), _rgb(outline), _num(width), path))
+        elif fill is not None:
+            self.ops.append("%s rg %s f" % (_rgb(fill), path))
+        elif outline is not None:
+            self.ops.append("%s RG %s w %s S" % (_rgb(outline), _num(width), path))
+
+    def ellipse(self, xy, fill=None, outline=None, width=1):
+        """与 Pillow 一致：外框 [x0, x1] 含端点像素，描边画在外框以内"""
+        x0, y0, x1, y1 = xy
+        cx, cy = (x0 + x1 + 1) / 2, (y0 + y1 + 1) / 2
+        rx, ry = (x1 - x0 + 1) / 2, (y1 - y0 + 1) / 2
+        if fill is not None:
+            self.ops.append("%s rg %s f" % (_rgb(fill), self._ellipse_path(cx, cy, rx, ry)))
+        if outline is not None and width > 0:
+            half = width / 2
+            self.ops.append("%s RG %s w %s S" % (_rgb(outline), _num(width), self._ellipse_path(cx, cy, rx - half, ry - half)))
+
+    @staticmethod
+    def _ellipse_path(cx, cy, rx, ry):
+        c = 0.5523
+        pts = [(cx + rx, cy), (cx + rx, cy + ry * c), (cx + rx * c, cy + ry), (cx, cy + ry),
+               (cx - rx * c, cy + ry), (cx - rx, cy + ry * c), (cx - rx, cy),
+               (cx - rx, cy - ry * c), (cx - rx * c, cy - ry), (cx, cy - ry),
+               (cx + rx * c, cy - ry), (cx + rx, cy - ry * c), (cx + rx, cy)]
+        out = ["%s %s m" % (_num(pts[0][0]), _num(pts[0][1]))]
+        for i in range(1, 13, 3):
+            out.append(" ".join("%s %s" % (_num(x), _num(y)) for x, y in pts[i:i + 3]) + " c")
+        return " ".join(out) + " h"
+
+    def rectangles(self, boxes, fill):
+        """批量填充矩形 [(x0, y0, x1, y1), ...]（像素边界坐标，不做中心偏移）"""
+        if boxes:
+            self.ops.append("%s rg %s f" % (_rgb(fill), " ".join(
+                "%s %s %s %s re" % (_num(x0), _num(y0), _num(x1 - x0), _num(y1 - y0)) for x0, y0, x1, y1 in boxes)))
+
+    # ------------------------------
+    # 图片
+    # ------------------------------
+    def image(self, image, xy, quality=None):
+        """放置一张图：quality 不为空时 RGB 图按 JPEG 嵌入，否则无损 Flate；RGBA 图的透明通道作为 SMask"""
+        if quality is not None and image.mode in ("RGB", "L"):
+            buf = BytesIO()
+            image.save(buf, format="JPEG", quality=quality)
+            return self.jpeg(buf.getvalue(), image.size, image.mode, xy)
+        alpha = image.getchannel("A") if image.mode == "RGBA" else None
+        base = image if image.mode in ("RGB", "L") else image.convert("RGB")
+        self._place(("raw", base, alpha), image.size, xy)
+
+    def jpeg(self, data, size, mode, xy):
+        """放置已编码的 JPEG（同一背景可跨文档复用编码结果）"""
+        self._place(("jpeg", data, size, mode), size, xy)
+
+    def _place(self, entry, size, xy):
+        name = "Im%d" % (len(self.images) + 1)
+        self.images.append((name, entry))
+        x, y = xy
+        w, h = size
+        self.ops.append("q %s 0 0 %s %s %s cm /%s Do Q" % (_num(w), _num(-h), _num(x), _num(y + h), name))
+
+    def mask(self, mask, xy, fill):
+        """按 L 掩码（255 为不透明）填充纯色，用于无法写成文本的字形"""
+        color = ImageColor.getrgb(fill) if isinstance(fill, str) else tuple(fill[:3])
+        solid = mask.convert("RGB")
+        solid.paste(color, (0, 0, mask.width, mask.height))
+        solid.putalpha(mask)
+        self.image(solid, xy)
+
+    # ------------------------------
+    # 文本
+    # ------------------------------
+    def text(self, font, size, x, baseline, text, advances, fill, scale_x=1.0):
+        """以字号 size（像素）在 (x, baseline) 写一串字；advances 为每个字之后笔位的前进量（未压缩的像素），
+        与 PDF 按字体度量计算的前进量之差写入 TJ 调整，保证每个字与栅格排版位置一致"""
+        use = self.fonts.get(id(font))
+        if use is None:
+            use = self.fonts[id(font)] = _FontUse(font, "F%d" % (len(self.fonts) + 1))
+        parts = []
+        upem = font.units_per_em
+        for ch, advance in zip(text, advances):
+            gid = font.cmap.get(ord(ch), 0)
+            parts.append("<%04X>" % use.cid(gid, ch))
+            adjust = font.advance(gid) * 1000 / upem - advance * 1000 / size
+            if abs(adjust) > 0.0005:
+                parts.append(_num(adjust))
+        # 横向缩放（Tz）属于图形状态，跨 BT/ET 保留，每段都要显式设置
+        self.ops.append("BT %s rg /%s %s Tf %s Tz 1 0 0 -1 %s %s Tm [%s] TJ ET" % (
+            _rgb(fill), use.name, _num(size), _num(scale_x * 100), _num(x), _num(baseline), " ".join(parts)))
+
+    # ------------------------------
+    # 输出
+    # ------------------------------
+    def tobytes(self):
+        objects = []
+
+        def add(body):
+            objects.append(body)
+            return len(objects)
+
+        def stream(head, data, compress=True):
+            if compress:
+                data = zlib.compress(data, 6)
+                head += b" /Filter /FlateDecode"
+            return add(b"<<" + head + b" /Length %d >>\nstream\n" % len(data) + data + b"\nendstream")
+
+        catalog = add(None)
+        pages = add(None)
+        font_refs = [(use.name, self._font_objects(use, add, stream)) for use in self.fonts.values()]
+        image_refs = [(name, self._image_object(entry, stream)) for name, entry in self.images]
+        content = stream(b"", "\n".join(self.ops).encode("latin-1"))
+        resources = b"<< /Font << %s >> /XObject << %s >> >>" % (
+            b" ".join(b"/%s %d 0 R" % (name.encode(), ref) for name, ref in font_refs),
+            b" ".join(b"/%s %d 0 R" % (name.encode(), ref) for name, ref in image_refs))
+        page = add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] /Resources %s /Contents %d 0 R >>" % (
+            pages, _num(self.width * self.k).encode(), _num(self.height * self.k).encode(), resources, content))
+        objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages
+        objects[pages - 1] = b"<< /Type /Pages /Kids [%d 0 R] /Count 1 >>" % page
+
+        out = BytesIO()
+        out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for i, body in enumerate(objects, 1):
+            offsets.append(out.tell())
+            out.write(b"%d 0 obj\n" % i + body + b"\nendobj\n")
+        xref = out.tell()
+        out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        out.write(b"".join(b"%010d 00000 n \n" % off for off in offsets))
+        out.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref))
+        return out.getvalue()
+
+    @staticmethod
+    def _image_object(entry, stream):
+        head = b" /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8"
+        if entry[0] == "jpeg":
+            _, data, (w, h), mode = entry
+            space = b"/DeviceRGB" if mode == "RGB" else b"/DeviceGray"
+            return stream(head % (w, h, space) + b" /Filter /DCTDecode", data, compress=False)
+        _, base, alpha = entry
+        smask = b""
+        if alpha is not None:
+            smask = b" /SMask %d 0 R" % stream(head % (alpha.width, alpha.height, b"/DeviceGray"), alpha.tobytes())
+        space = b"/DeviceRGB" if base.mode == "RGB" else b"/DeviceGray"
+        return stream(head % (base.width, base.height, space) + smask, base.tobytes())
+
+    def _font_objects(self, use, add, stream):
+        font = use.font
+        order = sorted(use.cids, key=use.cids.get)
+        data, _ = font.subset(order, use.unicodes)
+        scale = 1000 / font.units_per_em
+        tag = "".join(chr(65 + b % 26) for b in hashlib.sha1(data).digest()[:6])
+        base_name = ("%s+%s" % (tag, font.postscript_name or use.name)).encode()
+        file_ref = stream(b" /Length1 %d" % len(data), data)
+        bbox = " ".join(_num(v * scale) for v in font.bbox).encode()
+        descriptor = add(b"<< /Type /FontDescriptor /FontName /%s /Flags 4 /FontBBox [%s] /ItalicAngle 0 /Ascent %s "
+                         b"/Descent %s /CapHeight %s /StemV 80 /FontFile2 %d 0 R >>" % (
+                             base_name, bbox, _num(font.ascender * scale).encode(), _num(font.descender * scale).encode(),
+                             _num(font.ascender * scale).encode(), file_ref))
+        widths = " ".join(_num(font.advance(gid) * scale) for gid in order)
+        cid_font = add(b"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s /CIDSystemInfo << /Registry (Adobe) "
+                       b"/Ordering (Identity) /Supplement 0 >> /FontDescriptor %d 0 R /W [0 [%s]] /CIDToGIDMap /Identity >>"
+                       % (base_name, descriptor, widths.encode()))
+        to_unicode = stream(b"", _to_unicode(use.unicodes))
+        return add(b"<< /Type /Font /Subtype /Type0 /BaseFont /%s /Encoding /Identity-H /DescendantFonts [%d 0 R] "
+                   b"/ToUnicode %d 0 R >>" % (base_name, cid_font, to_unicode))
+
+
+def _to_unicode(unicodes):
+    lines = ["/CIDInit /ProcSet findresource begin", "12 dict begin", "begincmap",
+             "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+             "/CMapName /Adobe-Identity-UCS def", "/CMapType 2 def",
+             "1 begincodespacerange", "<0000> <FFFF>", "endcodespacerange"]
+    items = sorted(unicodes.items())
+    for i in range(0, len(items), 100):
+        chunk = items[i:i + 100]
+        lines.append("%d beginbfchar" % len(chunk))
+        lines.extend("<%04X> <%s>" % (cid, ch.encode("utf-16-be").hex().upper()) for cid, ch in chunk)
+        lines.append("endbfchar")
+    lines += ["endcmap", "CMapName currentdict /CMap defineresource pop", "end", "end"]
+    return "\n".join(lines).encode("ascii")
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+多线程 PNG 编码
+
+仿 pigz：把扫描线按行切块，各块在线程池中独立 deflate（以前一块末尾 32KB 作为预置字典），
+块间用 Z_SYNC_FLUSH 对齐到字节边界，拼接为一条标准 zlib 流写入 IDAT。
+zlib 压缩时释放 GIL，多核机器上各块真正并行；输出可被任何 PNG 解码器读取。
+iter_png 为流式版本：按分块逐块压缩产出，用于不在内存中持有整张原始图的打印导出。
+"""
+
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageChops
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 每块未压缩数据的目标大小；块越小并行度越高，但块间字典重置会略微增大体积
+PNG_CHUNK_BYTES = 512 * 1024
+PNG_WORKERS = os.cpu_count() or 1
+PNG_LEVEL = 6
+DEFLATE_WINDOW = 32 * 1024
+# 试压缩选择滤波器时每块取样的行数
+FILTER_SAMPLE_ROWS = 16
+
+# 模式 -> (PNG 颜色类型, 每像素字节数)
+_COLOR_TYPES = {"L": (0, 1), "RGB": (2, 3), "RGBA": (6, 4), "P": (3, 1)}
+FILTER_NONE, FILTER_UP = 0, 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PNG_WORKERS, thread_name_prefix="png")
+        return _executor
+
+
+def _chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(tag)))
+
+
+def _with_filter_bytes(data, stride, filter_type):
+    head = bytes((filter_type,))
+    return b"".join(head + data[i:i + stride] for i in range(0, len(data), stride))
+
+
+def _pick_filter(data, up, stride):
+    """在 None / Up 中按试压缩结果择优，返回带滤波字节的扫描线"""
+    sample = stride * FILTER_SAMPLE_ROWS
+    if len(zlib.compress(up[:sample], 1)) < len(zlib.compress(data[:sample], 1)):
+        return _with_filter_bytes(up, stride, FILTER_UP)
+    return _with_filter_bytes(data, stride, FILTER_NONE)
+
+
+def _filter_rows(raw, stride, y0, y1, adaptive):
+    """返回 [y0, y1) 行带滤波字节的扫描线；adaptive 时在 None / Up 中按试压缩结果择优"""
+    rows = raw.crop((0, y0, stride, y1))
+    data = rows.tobytes()
+    if not adaptive:
+        return _with_filter_bytes(data, stride, FILTER_NONE)
+    # 越界部分由 crop 补 0，正好是首行 Up 滤波约定的“上一行”
+    up = ImageChops.subtract_modulo(rows, raw.crop((0, y0 - 1, stride, y1 - 1))).tobytes()
+    return _pick_filter(data, up, stride)
+
+
+def _deflate(data, zdict, level, last):
+    """原始 deflate 一块；非末块以 Z_SYNC_FLUSH 结束以便直接拼接"""
+    if zdict:
+        comp = zlib.compressobj(level, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        comp = zlib.compressobj(level, zlib.DEFLATED, -15, 9)
+    return comp.compress(data) + comp.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _zlib_header(level):
+    flevel = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    cmf, flg = 0x78, flevel << 6
+    flg += (31 - (cmf * 256 + flg) % 31) % 31
+    return bytes((cmf, flg))
+
+
+def encode_png(image, level=PNG_LEVEL, workers=None, chunk_bytes=PNG_CHUNK_BYTES):
+    """把图片编码为 PNG 字节；workers <= 1 时在当前线程完成，否则各块提交到共享线程池。
+    不支持的模式或带透明色信息的图片交给 Pillow 编码"""
+    if image.mode not in _COLOR_TYPES or "transparency" in image.info:
+        buf = BytesIO()
+        image.save(buf, format="PNG")
+        return buf.getvalue()
+    color_type, bpp = _COLOR_TYPES[image.mode]
+    width, height = image.size
+    stride = width * bpp
+    # 按字节视为单通道图，滤波可直接用逐字节的 ImageChops 运算
+    raw = Image.frombytes("L", (stride, height), image.tobytes())
+    rows_per_chunk = max(1, chunk_bytes // (stride + 1))
+    spans = [(y, min(y + rows_per_chunk, height)) for y in range(0, height, rows_per_chunk)]
+    # 调色板/灰度图几乎总是不滤波更小，仅对真彩图做自适应选择
+    adaptive = image.mode in ("RGB", "RGBA")
+    workers = PNG_WORKERS if workers is None else workers
+    if workers > 1 and len(spans) > 1:
+        run = _get_executor().map
+    else:
+        run = map
+
+    blocks = list(run(lambda span: _filter_rows(raw, stride, span[0], span[1], adaptive), spans))
+    last = len(blocks) - 1
+    zdicts = [None] + [block[-DEFLATE_WINDOW:] for block in blocks[:-1]]
+    compressed = list(run(lambda i: _deflate(blocks[i], zdicts[i], level, i == last), range(len(blocks))))
+
+    adler = 1
+    for block in blocks:
+        adler = zlib.adler32(block, adler)
+    idat = b"".join([_zlib_header(level)] + compressed + [struct.pack(">I", adler)])
+
+    out = [PNG_SIGNATURE, _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))]
+    if image.mode == "P":
+        palette = image.getpalette() or []
+        out.append(_chunk(b"PLTE", bytes(palette[:768])))
+    out.append(_chunk(b"IDAT", idat))
+    out.append(_chunk(b"IEND", b""))
+    return b"".join(out)
+
+
+def _phys_chunk(dpi):
+    ppm = max(round(dpi / 0.0254), 1)
+    return _chunk(b"pHYs", struct.pack(">IIB", ppm, ppm, 1))
+
+
+def iter_png(width, height, mode, tiles, level=PNG_LEVEL, dpi=None):
+    """流式 PNG 编码：tiles 依次产出宽为 width、自上而下拼满 height 行的分块图，
+    每块压缩后立即产出 IDAT，任意时刻只持有一块原始数据；dpi 写入 pHYs"""
+    color_type, bpp = _COLOR_TYPES[mode]
+    stride = width * bpp
+    yield PNG_SIGNATURE + _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+    if dpi:
+        yield _phys_chunk(dpi)
+    comp = zlib.compressobj(level)
+    adaptive = mode in ("RGB", "RGBA")
+    prev = bytes(stride)
+    rows = 0
+    for tile in tiles:
+        data = tile.tobytes()
+        n = len(data) // stride
+        rows += n
+        if adaptive:
+            # Up 滤波的“上一行”跨块衔接：本块首行对上一块末行
+            above = Image.frombytes("L", (stride, n), prev + data[:-stride])
+            up = ImageChops.subtract_modulo(Image.frombytes("L", (stride, n), data), above).tobytes()
+            block = _pick_filter(data, up, stride)
+        else:
+            block = _with_filter_bytes(data, stride, FILTER_NONE)
+        prev = data[-stride:]
+        out = comp.compress(block)
+        if out:
+            yield _chunk(b"IDAT", out)
+    if rows != height:
+        raise ValueError(f"分块总行数 {rows} 与图片高度 {height} 不一致")
+    yield _chunk(b"IDAT", comp.flush()) + _chunk(b"IEND", b"")
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+车票渲染结果缓存
+
+按 (模板内容哈希, 背景/叠加图/字体文件, 规范化后的用户数据, 输出选项) 计算内容地址，
+缓存编码后的图片字节：进程内有界 LRU + 磁盘层（容量上限、原子写入、按访问时间淘汰）。
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from ticket import (load_render_plan, render_plan, render_pdf, encode_image, flatten_user_data, resolve_scale,
+                    load_palette, normalize_format, display_list, plan_assets, plan_files, CANVAS_POOL)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 缓存配置
+RENDER_CACHE_DIR = os.path.join(BASE_DIR, "cache", "renders")
+RENDER_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+RENDER_CACHE_DISK_BYTES = 512 * 1024 * 1024
+# 渲染逻辑变化时递增，使旧缓存全部失效
+RENDER_CACHE_VERSION = 5
+
+
+class RenderCache:
+    """内存 + 磁盘两级的字节缓存"""
+
+    def __init__(self, memory_bytes=RENDER_CACHE_MEMORY_BYTES, disk_dir=RENDER_CACHE_DIR,
+                 disk_bytes=RENDER_CACHE_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None  # 首次写入时扫描目录得到
+        self._lock = threading.Lock()
+
+    # ---------- 内存层 ----------
+    def _memory_get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            return data
+
+    def _memory_put(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_size -= len(old)
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    # ---------- 磁盘层 ----------
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _disk_get(self, key):
+        if not self.disk_dir or not self.disk_bytes:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # 记录访问时间，淘汰时按 mtime 排序
+            return data
+        except OSError:
+            return None
+
+    def _disk_put(self, key, data):
+        if not self.disk_dir or not self.disk_bytes or len(data) > self.disk_bytes:
+            return
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            return
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = sum(size for _, size, _ in self._scan_disk())
+            else:
+                self._disk_size += len(data)
+            over = self._disk_size > self.disk_bytes
+        if over:
+            self._evict_disk()
+
+    def _scan_disk(self):
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict_disk(self):
+        """删除最久未访问的文件，直到降到上限的 90%"""
+        entries = sorted(self._scan_disk())
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self._disk_size = total
+
+    # ---------- 对外接口 ----------
+    def get(self, key):
+        data = self._memory_get(key)
+        if data is not None:
+            with self._lock:
+                self.memory_hits += 1
+            return data
+        data = self._disk_get(key)
+        if data is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._memory_put(key, data)
+            return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, data):
+        self._memory_put(key, data)
+        self._disk_put(key, data)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            self.memory_hits = self.disk_hits = self.misses = 0
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for _, _, path in self._scan_disk():
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            with self._lock:
+                self._disk_size = 0
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "memory_items": len(self._memory),
+            "memory_bytes": self._memory_size,
+            "disk_bytes": self._disk_size,
+        }
+
+
+RENDER_CACHE = RenderCache()
+
+
+def normalize_user_data(user_data):
+    """扁平化并把取值统一为字符串；禁用字段被丢弃，结果与渲染时看到的数据一一对应"""
+    flat = flatten_user_data(user_data)
+    return sorted((str(k), "" if v is None else str(v)) for k, v in flat.items())
+
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+    except OSError:
+        return None
+
+
+def render_key(plan, user_data, options):
+    """缓存键：模板 JSON 之外的依赖文件（背景、叠加图、字体）以 (mtime_ns, size) 计入，替换任一文件即换键"""
+    files = [[path, _file_stamp(path)] for path in plan_files(plan)]
+    payload = [RENDER_CACHE_VERSION, plan.content_hash, files, normalize_user_data(user_data), options]
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def render_ticket_bytes(user_data, template_json_path, template_dir, fmt="PNG", cache=None,
+                        scale=1.0, max_width=None, quality=None):
+    """渲染并编码车票；相同输入直接返回缓存中的编码结果。
+    scale/max_width 用于低分辨率预览；fmt 见 ticket.OUTPUT_FORMATS，quality 仅对 WEBP/JPEG（PDF 为背景的 JPEG 质量）有效"""
+    cache = RENDER_CACHE if cache is None else cache
+    fmt = normalize_format(fmt)
+    quality = None if fmt in ("PNG", "PNG8") or quality is None else int(quality)
+    scale = resolve_scale(template_json_path, template_dir, scale, max_width)
+    plan = load_render_plan(template_json_path, template_dir, scale)
+    key = render_key(plan, user_data, {"format": fmt, "scale": scale, "quality": quality})
+    data = cache.get(key)
+    if data is None and fmt == "PDF":
+        data = render_pdf(plan, user_data, quality=quality)
+        cache.put(key, data)
+    if data is None:
+        palette = load_palette(plan) if fmt == "PNG8" else None
+        # 画布只在编码前后使用，编码完即归还画布池
+        image = render_plan(plan, user_data, pool=CANVAS_POOL)
+        try:
+            data = encode_image(image, fmt, quality, palette)
+        finally:
+            CANVAS_POOL.release(image)
+        cache.put(key, data)
+    return data
+
+
+def display_list_bytes(user_data, template_json_path, template_dir, cache=None, scale=1.0, max_width=None):
+    """排版结果的显示列表（JSON 字节）及其内容地址；与 render_ticket_bytes 共用缓存与缓存键规则。
+    命中缓存时仍登记模板的字体/背景资源，保证列表中引用的资源 ID 在本进程可取"""
+    cache = RENDER_CACHE if cache is None else cache
+    scale = resolve_scale(template_json_path, template_dir, scale, max_width)
+    plan = load_render_plan(template_json_path, template_dir, scale)
+    key = render_key(plan, user_data, {"format": "display_list", "scale": scale})
+    data = cache.get(key)
+    if data is None:
+        data = json.dumps(display_list(plan, user_data), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        cache.put(key, data)
+    else:
+        plan_assets(plan)
+    return data, key
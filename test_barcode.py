@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+条码测试：图案只由数据决定，跨进程稳定
+"""
+
+import os
+import subprocess
+import sys
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def barcode_digest_in_subprocess(hash_seed):
+    code = ("import hashlib, ticket;"
+            "print(hashlib.md5(ticket.make_barcode_placeholder('E049575', 600, 120).tobytes()).hexdigest())")
+    env = dict(os.environ, PYTHONHASHSEED=str(hash_seed))
+    return subprocess.check_output([sys.executable, "-c", code], cwd=BASE_DIR, env=env).strip()
+
+
+def test_stable_across_processes():
+    assert barcode_digest_in_subprocess(1) == barcode_digest_in_subprocess(2)
+
+
+def test_stripes_full_height_and_memoized():
+    ticket._BARCODES.clear()
+    mask = ticket.barcode_mask("demo", 300, 80)
+    assert ticket.barcode_mask("demo", 300, 80) is mask
+    top = mask.crop((0, 0, 300, 1)).tobytes()
+    assert mask.crop((0, 79, 300, 80)).tobytes() == top
+    assert set(top) == {0, 255}
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+画布池测试：复用画布复位后与新分配的渲染结果一致、容量上限、统计接口
+"""
+
+import os
+
+from PIL import Image
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+
+
+def test_reused_canvas_is_reset():
+    pool = ticket.CanvasPool()
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+    first = ticket.render_plan(plan, {"姓名": "张三", "车次号": "G1"}, pool=pool)
+    first_id = id(first)
+    pool.release(first)
+    second = ticket.render_plan(plan, {"姓名": "李四", "车次号": "D2"}, pool=pool)
+    assert id(second) == first_id
+    assert second.tobytes() == ticket.render_plan(plan, {"姓名": "李四", "车次号": "D2"}).tobytes()
+    stats = pool.stats()
+    assert stats["acquired"] == 2 and stats["reused"] == 1 and stats["allocated"] == 1
+    print("✅ 复用画布复位正确")
+
+
+def test_pool_is_bounded():
+    pool = ticket.CanvasPool(per_shape=2, max_shapes=2)
+    for size in ((10, 10), (20, 20), (30, 30)):
+        for _ in range(3):
+            pool.release(Image.new("RGB", size))
+    stats = pool.stats()
+    assert stats["idle"] == 4 and stats["dropped"] == 5
+    assert stats["idle_bytes"] == 2 * (20 * 20 * 3) + 2 * (30 * 30 * 3)
+    print("✅ 画布池容量有界")
+
+
+def test_api_exposes_pool_stats():
+    import api_server
+    client = api_server.app.test_client()
+    stats = client.get("/api/cache/stats").get_json()
+    assert "canvas_pool" in stats and "reuse_rate" in stats["canvas_pool"]
+    print("✅ 统计接口包含画布池")
+
+
+if __name__ == "__main__":
+    test_reused_canvas_is_reset()
+    test_pool_is_bounded()
+    test_api_exposes_pool_stats()
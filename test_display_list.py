@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+显示列表测试：文本起点/基线与栅格排版一致、二维码模块与条码可还原为服务端位图、资源可取、接口按内容地址缓存
+"""
+
+import json
+import math
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+
+from PIL import Image
+
+import ticket
+from render_cache import RenderCache, display_list_bytes
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+STYLES = ("red15", "blue15", "red05_longride", "red05_shortride", "red1997")
+
+
+def load(style):
+    plan = ticket.load_render_plan(os.path.join(TEMPLATE_DIR, f"ticket_template_{style}.json"), TEMPLATE_DIR)
+    with open(os.path.join(BASE_DIR, "default_templates", f"user_{style}.json"), "r", encoding="utf-8") as f:
+        return plan, json.load(f)
+
+
+def test_display_list_matches_layout():
+    for style in STYLES:
+        plan, user_data = load(style)
+        dl = json.loads(json.dumps(ticket.display_list(plan, user_data), ensure_ascii=False))
+        assert (dl["width"], dl["height"]) == ticket.load_background(plan.background).size
+        texts = [op for op in dl["ops"] if op["op"] == "text"]
+        assert all(op["font"] in dl["fonts"] for op in texts)
+        assert all(len(op["advances"]) == len(op["text"]) for op in texts)
+        for layout in ticket.layout_ticket(plan, user_data):
+            for run in layout.runs:
+                if not run.text:
+                    continue
+                x, baseline, advances = ticket.run_geometry(run)
+                assert any(op["text"] == run.text and abs(op["x"] - x) < 0.01 and abs(op["baseline"] - baseline) < 0.01
+                           for op in texts), (style, layout.key, run.text)
+    print("✅ 文本起点、基线与栅格排版一致")
+
+
+def test_qr_and_barcode_rebuild():
+    checked = set()
+    for style in STYLES:
+        plan, user_data = load(style)
+        values = ticket.UserValues(user_data)
+        dl = ticket.display_list(plan, user_data)
+        for op, item in zip([op for op in plan.ops if isinstance(op, ticket.QrOp)], [o for o in dl["ops"] if o["op"] == "qr"]):
+            n, size = len(item["modules"]), item["size"]
+            edges = [max(0, math.ceil(j * size / n - 0.5)) for j in range(n)] + [size]
+            rebuilt = Image.new("L", (size, size), 0)
+            for j, row in enumerate(item["modules"]):
+                for i, v in enumerate(row):
+                    if v == "1":
+                        rebuilt.paste(255, (edges[i], edges[j], edges[i + 1], edges[j + 1]))
+            assert rebuilt.tobytes() == ticket.qr_mask(ticket.encode_ticket_data(values.fmt_map), op.size).tobytes()
+            # 显示列表同时报告所选版本与编码分段
+            assert n == 17 + 4 * item["version"]
+            assert sum(count for _, count in item["segments"]) == len(ticket.encode_ticket_data(values.fmt_map))
+            checked.add("qr")
+        for op, item in zip([op for op in plan.ops if isinstance(op, ticket.BarcodeOp)], [o for o in dl["ops"] if o["op"] == "bars"]):
+            row = bytearray(op.width)
+            for x, w in item["bars"]:
+                row[x - op.x:x - op.x + w] = b"\xff" * w
+            mask = ticket.barcode_mask(str(values.fmt_map.get("条码数据", "demo")), op.width, op.height)
+            assert bytes(row) * op.height == mask.tobytes()
+            checked.add("barcode")
+    assert checked == {"qr", "barcode"}
+    print("✅ 二维码模块矩阵与条码可还原为服务端位图")
+
+
+def test_assets_survive_cache_hit(tmp_path):
+    plan, user_data = load("red15")
+    template = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+    cache = RenderCache(disk_dir=str(tmp_path))
+    data, key = display_list_bytes(user_data, template, TEMPLATE_DIR, cache=cache, scale=0.5)
+    # 模拟进程重启：资源登记清空，缓存命中时应重新登记
+    for registry in (ticket._ASSETS, ticket._FONT_ASSETS, ticket._IMAGE_ASSETS, ticket._IMAGE_DATA):
+        registry.clear()
+    again, again_key = display_list_bytes(user_data, template, TEMPLATE_DIR, cache=cache, scale=0.5)
+    assert again == data and again_key == key and cache.stats()["hits"] == 1
+    dl = json.loads(data)
+    assert ticket.display_asset(dl["background"])[0] == "image/png"
+    assert all(ticket.display_asset(fid)[0].startswith("font/") for fid in dl["fonts"])
+    print("✅ 缓存命中时资源仍可取")
+
+
+def test_image_assets_bounded(monkeypatch):
+    """图片资源按来源寻址、条目数有上限：背景母版被淘汰重新解码后不新增条目，也不持有旧母版"""
+    monkeypatch.setattr(ticket, "_IMAGE_ASSETS", ticket.LRUCache(4))
+    monkeypatch.setattr(ticket, "_IMAGE_DATA", ticket.LRUCache(4))
+    template = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+    plan = ticket.load_render_plan(template, TEMPLATE_DIR, 0.5)
+    background, _ = ticket.plan_assets(plan)
+    ticket._BACKGROUNDS.clear()
+    assert ticket.plan_assets(plan)[0] == background and len(ticket._IMAGE_DATA) == 1
+    for step in range(1, 11):
+        ticket.plan_assets(ticket.load_render_plan(template, TEMPLATE_DIR, step / 10))
+    assert len(ticket._IMAGE_ASSETS) == 4 and len(ticket._IMAGE_DATA) == 4
+    assert ticket.display_asset(ticket.plan_assets(plan)[0])[0] == "image/png"
+    print("✅ 图片资源有上限")
+
+
+def test_assets_after_restart(tmp_path):
+    """新进程从磁盘缓存命中显示列表，背景、字体与叠加图（箭头等）都应可取"""
+    plan, user_data = load("red05_longride")
+    template = os.path.join(TEMPLATE_DIR, "ticket_template_red05_longride.json")
+    display_list_bytes(user_data, template, TEMPLATE_DIR, cache=RenderCache(disk_dir=str(tmp_path)))
+    code = ("import json, sys, ticket; from render_cache import RenderCache, display_list_bytes;"
+            "cache = RenderCache(disk_dir=sys.argv[1]);"
+            "dl = json.loads(display_list_bytes(json.loads(sys.argv[2]), sys.argv[3], sys.argv[4], cache=cache)[0]);"
+            "ids = [dl['background']] + list(dl['fonts']) + [op['asset'] for op in dl['ops'] if op['op'] == 'image'];"
+            "print(cache.stats()['hits'], sum(op['op'] == 'image' for op in dl['ops']), all(ticket.display_asset(i) for i in ids))")
+    out = subprocess.check_output([sys.executable, "-c", code, str(tmp_path), json.dumps(user_data), template, TEMPLATE_DIR],
+                                  cwd=BASE_DIR).split()
+    assert out[0] == b"1" and int(out[1]) > 0 and out[2] == b"True", out
+    print("✅ 重启后命中缓存，叠加图资源仍可取")
+
+
+def test_api_layout(temp_render_cache):
+    import api_server
+    plan, user_data = load("red15")
+    client = api_server.app.test_client()
+    payload = {"style": "red15", "user_data": user_data, "scale": 0.5}
+    resp = client.post("/api/layout", json=payload)
+    result = resp.get_json()
+    assert resp.status_code == 200 and result["success"] and resp.headers["ETag"]
+    assert client.post("/api/layout", json=payload, headers={"If-None-Match": resp.headers["ETag"]}).status_code == 304
+    changed = client.post("/api/layout", json=dict(payload, user_data=dict(user_data, 姓名="李四")))
+    assert changed.headers["ETag"] != resp.headers["ETag"]
+    background = client.get(f"/api/assets/{result['data']['background']}")
+    assert background.status_code == 200 and background.mimetype == "image/png"
+    assert "immutable" in background.headers["Cache-Control"]
+    assert client.get("/api/assets/0000000000000000").status_code == 404
+    print("✅ 显示列表接口")
+
+
+if __name__ == "__main__":
+    test_display_list_matches_layout()
+    test_qr_and_barcode_rebuild()
+    test_assets_survive_cache_hit(pathlib.Path(tempfile.mkdtemp()))
+    test_assets_after_restart(pathlib.Path(tempfile.mkdtemp()))
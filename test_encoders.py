@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+输出编码测试：调色板 PNG / WebP / JPEG、调色板按模板只计算一次、接口格式协商
+"""
+
+import base64
+import os
+from io import BytesIO
+
+from PIL import Image
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+USER_DATA = {"出发站": "北京南", "到达站": "上海虹桥", "车次号": "G1", "姓名": "张三"}
+
+
+def test_formats_roundtrip():
+    image = ticket.render_ticket(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR)
+    palette = ticket.load_palette(ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR))
+    png = ticket.encode_image(image)
+    for fmt, quality, kind in (("PNG8", None, "PNG"), ("WEBP", None, "WEBP"), ("WEBP", 80, "WEBP"), ("jpg", 85, "JPEG")):
+        data = ticket.encode_image(image, fmt, quality, palette)
+        decoded = Image.open(BytesIO(data))
+        assert decoded.format == kind and decoded.size == image.size
+        assert len(data) < len(png)
+    # 无损 WebP 与原图逐像素一致
+    assert Image.open(BytesIO(ticket.encode_image(image, "WEBP"))).convert("RGB").tobytes() == image.tobytes()
+    try:
+        ticket.encode_image(image, "BMP")
+        assert False, "应拒绝不支持的格式"
+    except ValueError:
+        pass
+    print("✅ 各编码格式正确")
+
+
+def test_palette_cached_and_keeps_text_colors():
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+    palette = ticket.load_palette(plan)
+    assert ticket.load_palette(plan) is palette
+    colors = set(zip(*[iter(palette.getpalette())] * 3))
+    assert (0, 0, 0) in colors
+    print("✅ 调色板按模板缓存")
+
+
+def test_api_negotiates_format(temp_render_cache):
+    import api_server
+    client = api_server.app.test_client()
+    payload = {"style": "red15", "user_data": USER_DATA, "format": "file"}
+    resp = client.post("/api/generate", json=payload, headers={"Accept": "image/webp"})
+    assert resp.mimetype == "image/webp" and Image.open(BytesIO(resp.data)).format == "WEBP"
+    resp = client.post("/api/generate", json=payload)
+    assert resp.mimetype == "image/png"
+    # base64 放在 JSON 里返回，Accept 头不改变默认的 PNG
+    result = client.post("/api/generate", json=dict(payload, format="base64"),
+                         headers={"Accept": "image/webp,image/*,*/*;q=0.8"}).get_json()
+    assert result["data"]["format"] == "PNG" and result["data"]["mime_type"] == "image/png"
+    result = client.post("/api/generate", json={"style": "red15", "user_data": USER_DATA, "image_format": "jpeg",
+                                                "quality": 70}).get_json()
+    assert result["data"]["format"] == "JPEG" and result["data"]["mime_type"] == "image/jpeg"
+    assert Image.open(BytesIO(base64.b64decode(result["data"]["image_base64"]))).format == "JPEG"
+    resp = client.post("/api/generate", json={"style": "red15", "user_data": USER_DATA, "image_format": "gif"})
+    assert resp.status_code == 400
+    print("✅ 接口格式协商正确")
+
+
+if __name__ == "__main__":
+    test_formats_roundtrip()
+    test_palette_cached_and_keeps_text_colors()
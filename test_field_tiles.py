@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+字段贴图缓存测试：圆圈票种贴图与直接绘制逐像素一致、跨用户命中、LRU 按条数与字节有界、打印导出不占共享缓存、统计接口、负坐标字形串回退到直接绘制
+"""
+
+import os
+
+from PIL import Image, ImageDraw
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+
+
+def test_circle_stamps_match_direct_drawing():
+    font = ticket.load_font(None, 50)
+    for anchor, x, circle_fill in (("la", 300, None), ("ma", 301.5, "#ffffff"), ("ra", 333.25, (255, 0, 0))):
+        op = ticket.CircleTextOp("票种", font, "#000000", circle_fill, 7.5, None, 2, x, 200.5, anchor, None)
+        expected = Image.new("RGB", (700, 400), (240, 200, 210))
+        ticket.draw_multi_circle_text(ImageDraw.Draw(expected), (x, 200.5), "学残", font, "#000000", 7.5, None,
+                                      circle_fill, 2, anchor)
+        actual = Image.new("RGB", (700, 400), (240, 200, 210))
+        for stamp in ticket.field_stamps(op, ticket.UserValues({"票种": "学残"})):
+            actual.paste(*stamp)
+        assert actual.tobytes() == expected.tobytes(), anchor
+    print("✅ 圆圈票种贴图与直接绘制一致")
+
+
+def test_tiles_shared_across_users():
+    ticket.clear_field_tile_cache()
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+    first = ticket.render_plan(plan, {"出发站": "北京南", "姓名": "张三"})
+    misses = ticket.cache_stats()["field_tiles"]["misses"]
+    second = ticket.render_plan(plan, {"出发站": "北京南", "姓名": "李四"})
+    stats = ticket.cache_stats()["field_tiles"]
+    # 只有姓名字段需要重新生成
+    assert stats["misses"] == misses + 1 and stats["hits"] > 0
+    assert first.tobytes() != second.tobytes()
+    print("✅ 相同字段文本跨用户复用")
+
+
+def test_unstampable_field_is_remembered():
+    font = ticket.load_font(None, 30)
+    op = ticket.TextOp("姓名", font, -20, 10, "#000000", "la", 0)
+    values = ticket.UserValues({"姓名": "张三"})
+    assert ticket.field_stamps(op, values) is None
+    assert ticket.field_stamps(op, values) is None
+    canvas = Image.new("RGB", (100, 60), "white")
+    ticket._PAINTERS[ticket.TextOp](canvas, ImageDraw.Draw(canvas), op, values)
+    assert canvas.getbbox() is not None
+    print("✅ 负坐标字段回退到直接绘制")
+
+
+def test_lru_bound():
+    cache = ticket.LRUCache(2)
+    for i in range(3):
+        cache.put(i, i)
+    assert len(cache) == 2 and cache.get(0) is None and cache.get(2) == 2
+    cache = ticket.LRUCache(100, maxbytes=1000, sizeof=len)
+    for i in range(5):
+        cache.put(i, b"x" * 300)
+    assert len(cache) == 3 and cache.bytes == 900 and cache.get(1) is None and cache.get(4) is not None
+    cache.put(4, b"x" * 50)
+    assert cache.bytes == 650 and cache.stats()["bytes"] == 650
+    cache.put("big", b"x" * 2000)
+    assert cache.get("big") is None and cache.bytes <= 1000
+    print("✅ LRU 有界")
+
+
+def test_tile_cache_byte_budget():
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+    ticket.clear_field_tile_cache()
+    ticket.render_plan(plan, {"出发站": "北京南", "姓名": "张三"})
+    stats = ticket.cache_stats()["field_tiles"]
+    assert 0 < stats["bytes"] <= stats["maxbytes"] == ticket.FIELD_TILE_CACHE_BYTES
+    expected = sum(ticket._stamps_bytes(v) for v in ticket._FIELD_TILES._data.values())
+    assert stats["bytes"] == expected
+    # 打印导出的放大贴图不进共享缓存
+    ticket.clear_field_tile_cache()
+    chunks, _, _ = ticket.export_print({"出发站": "北京南", "姓名": "张三"}, TEMPLATE_JSON, TEMPLATE_DIR, dpi=600)
+    for _ in chunks:
+        pass
+    assert len(ticket._FIELD_TILES) == 0
+    ticket.glyph_mask(ticket.load_font(None, 50), "票")
+    assert ticket._GLYPHS.stats()["maxbytes"] == ticket.GLYPH_CACHE_BYTES
+    print("✅ 贴图缓存按字节预算，打印导出不占用")
+
+
+def test_unstampable_run_falls_back():
+    font = ticket.load_font(None, 30)
+    run = ticket.GlyphRun("AB", font, (0, 0, 0), -5, 10, 0, 1.0, 40)
+    assert ticket.run_stamps(run) is None
+    run = run._replace(x=5)
+    stamps = ticket.run_stamps(run)
+    assert len(stamps) == 2 and all(isinstance(s, ticket.Stamp) for s in stamps)
+    print("✅ 负坐标字形串回退到直接绘制")
+
+
+if __name__ == "__main__":
+    test_circle_stamps_match_direct_drawing()
+    test_tiles_shared_across_users()
+    test_unstampable_field_is_remembered()
+    test_lru_bound()
+    test_tile_cache_byte_budget()
+    test_unstampable_run_falls_back()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+字段限宽测试：max_width 选出能放下的最大字号、测量阶段不光栅化、未超宽时结果不变
+"""
+
+import ticket
+
+LONG_NAME = "乌鲁木齐南中转换乘站"
+
+
+def test_fit_font_picks_largest_size():
+    font = ticket.load_font("fonts/方正黑体简体.ttf", 90)
+    fitted = ticket.fit_font(font, LONG_NAME, 400, 2)
+    assert fitted.size < font.size
+    assert ticket.run_width(fitted, LONG_NAME, 2) <= 400
+    assert ticket.run_width(ticket.font_variant(fitted, fitted.size + 1), LONG_NAME, 2) > 400
+    assert ticket.fit_font(font, "北京", 400, 2) is font
+    print("✅ 选出能放下的最大字号")
+
+
+
+def test_fit_font_exact_boundary():
+    """max_width 恰好等于某一字号的宽度时选中该字号（或更大的可放下字号），估算偏小时也不停在更小的字号"""
+    for path in ("fonts/方正黑体简体.ttf", "fonts/TrainTicketFont2.ttf", "fonts/simsun.ttc"):
+        font = ticket.load_font(path, 90)
+        for size in range(20, 90):
+            width = ticket.run_width(ticket.font_variant(font, size), LONG_NAME, 2)
+            fitted = ticket.fit_font(font, LONG_NAME, width, 2)
+            assert fitted.size >= size and ticket.run_width(fitted, LONG_NAME, 2) <= width, (path, size, fitted.size)
+            larger = ticket.font_variant(fitted, fitted.size + 1)
+            assert larger.size == font.size or ticket.run_width(larger, LONG_NAME, 2) > width, (path, size)
+    print("✅ 边界宽度选中最大可放下字号")
+
+def test_fitting_does_not_rasterize(monkeypatch):
+    font = ticket.load_font("fonts/方正黑体简体.ttf", 88)
+    def fail(*args, **kwargs):
+        raise AssertionError("测量阶段不应光栅化")
+    monkeypatch.setattr(ticket, "glyph_mask", fail)
+    monkeypatch.setattr(ticket.ImageDraw.ImageDraw, "text", fail)
+    assert ticket.fit_font(font, LONG_NAME + "东", 300).size < 88
+    print("✅ 测量阶段不光栅化")
+
+
+def test_text_field_keeps_baseline():
+    font = ticket.load_font("fonts/方正黑体简体.ttf", 90)
+    op = ticket.TextOp("出发站", font, 315, 200, "#000000", "ma", 2, 400)
+    run, = ticket.layout_text(op, ticket.UserValues({"出发站": LONG_NAME})).runs
+    assert run.width <= 400 and abs(run.x + run.width / 2 - 315) < 1e-6
+    assert run.y + run.font.getmetrics()[0] == 200 + font.getmetrics()[0]
+    short, = ticket.layout_text(op, ticket.UserValues({"出发站": "北京"})).runs
+    assert short.font is font and short.y == 200
+    print("✅ 缩小字号后基线不变")
+
+
+def test_segments_field_fits_total_width():
+    cfg = {"canvas": {"width": 1440, "height": 999, "background": "template_ticket.png"}, "fields": {
+        "出发站": {"x": 315, "y": 200, "anchor": "ma", "max_width": 500, "segments": [
+            {"text": "{出发站}", "font_path": "fonts/方正黑体简体.ttf", "size": 90, "letter_spacing": 2},
+            {"text": "站", "font_path": "fonts/simsun.ttc", "size": 60, "letter_spacing": 2, "y_offset": 15}]},
+        "注释1": {"x": 90, "y": 505, "segments": [
+            {"text": "{注释1}", "font_path": "fonts/simsun.ttc", "size": 50, "max_width": 300}]}}}
+    plan = ticket.compile_template(cfg, "templates")
+    layouts = {l.key: l for l in ticket.layout_ticket(plan, {"出发站": LONG_NAME, "注释1": "仅供报销使用" * 3})}
+    assert sum(run.width for run in layouts["出发站"].runs) <= 500
+    assert layouts["注释1"].runs[0].width <= 300
+    scaled = ticket.scale_template(cfg, 0.5)
+    assert scaled["fields"]["出发站"]["max_width"] == 250 and scaled["fields"]["注释1"]["segments"][0]["max_width"] == 150
+    print("✅ 整段与单段限宽")
+
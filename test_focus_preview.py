@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+局部预览测试：focus_field 区域图与整张渲染的对应区域逐像素一致、区域覆盖字段、贴回旧预览后与重新渲染一致、接口返回区域坐标
+"""
+
+import base64
+import json
+import os
+from io import BytesIO
+
+from PIL import Image
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+
+
+def load(style):
+    plan = ticket.load_render_plan(os.path.join(TEMPLATE_DIR, f"ticket_template_{style}.json"), TEMPLATE_DIR)
+    with open(os.path.join(BASE_DIR, "default_templates", f"user_{style}.json"), "r", encoding="utf-8") as f:
+        return plan, json.load(f)
+
+
+def test_region_matches_full_render():
+    for style in ("red15", "red1997"):
+        plan, user_data = load(style)
+        full = ticket.render_plan(plan, user_data)
+        keys = {op.key for op in plan.ops}
+        for key in keys:
+            image, region = ticket.render_region(plan, user_data, key)
+            assert image.size == (region[2] - region[0], region[3] - region[1])
+            assert image.tobytes() == full.crop(region).tobytes(), (style, key)
+    print("✅ 区域图与整张渲染一致")
+
+
+def test_region_covers_field():
+    plan, user_data = load("red15")
+    image, region = ticket.render_region(plan, user_data, "姓名")
+    layout = {l.key: l for l in ticket.layout_ticket(plan, user_data)}["姓名"]
+    x0, y0, x1, y1 = layout.bbox
+    assert region[0] <= x0 and region[1] <= y0 and region[2] >= x1 and region[3] >= y1
+    canvas = ticket.load_base_layer(plan)
+    blocks = ticket.render_regions(plan, user_data, "姓名", previous_user_data=user_data)
+    assert sum(image.width * image.height for image, _ in blocks) < 0.1 * canvas.width * canvas.height
+    # 空字段也返回锚点附近的区域
+    empty, _ = ticket.render_region(plan, dict(user_data, 姓名=""), "姓名")
+    assert empty.width > 0 and empty.height > 0
+    try:
+        ticket.render_region(plan, user_data, "不存在的字段")
+        assert False, "应拒绝未知字段"
+    except ValueError:
+        pass
+    print("✅ 区域覆盖编辑中的字段")
+
+
+def stitch(stale, blocks):
+    image = stale.copy()
+    for block, region in blocks:
+        image.paste(block, region[:2])
+    return image
+
+
+def test_region_stitches_over_stale_render():
+    plan, user_data = load("red15")
+    # 姓名变短：区域须覆盖旧字形；姓名进入二维码内容，二维码也须重绘
+    old, new = dict(user_data, 姓名="陈文杰"), dict(user_data, 姓名="陈")
+    stale, fresh = ticket.render_plan(plan, old), ticket.render_plan(plan, new)
+    for previous in (old, None):
+        blocks = ticket.render_regions(plan, new, "姓名", previous_user_data=previous)
+        assert stitch(stale, blocks).tobytes() == fresh.tobytes(), previous is not None
+        image, region = ticket.render_region(plan, new, "姓名", previous_user_data=previous)
+        assert stitch(stale, [(image, region)]).tobytes() == fresh.tobytes()
+    qr = next(op for op in plan.ops if isinstance(op, ticket.QrOp))
+    assert any(ticket._boxes_meet(ticket._op_coarse_box(qr), r) for _, r in ticket.render_regions(plan, new, "姓名", previous_user_data=old))
+    # 模板字段名同样带上二维码；不进入二维码的字段不重绘二维码
+    old, new = dict(user_data, 身份证号1="1234567890"), dict(user_data, 身份证号1="1")
+    stale, fresh = ticket.render_plan(plan, old), ticket.render_plan(plan, new)
+    assert stitch(stale, ticket.render_regions(plan, new, "身份信息", previous_user_data=old)).tobytes() == fresh.tobytes()
+    old, new = dict(user_data, 出发站="乌鲁木齐南"), dict(user_data, 出发站="京")
+    stale, fresh = ticket.render_plan(plan, old), ticket.render_plan(plan, new)
+    blocks = ticket.render_regions(plan, new, "出发站", previous_user_data=old)
+    assert stitch(stale, blocks).tobytes() == fresh.tobytes() and len(blocks) == 1
+    assert not ticket._boxes_meet(ticket._op_coarse_box(qr), blocks[0][1])
+    print("✅ 区域贴回旧预览后与整张重新渲染一致")
+
+
+def test_api_focus_field():
+    import api_server
+    plan, user_data = load("red15")
+    client = api_server.app.test_client()
+    result = client.post("/api/generate", json={"style": "red15", "user_data": user_data, "focus_field": "姓名"}).get_json()
+    data = result["data"]
+    image = Image.open(BytesIO(base64.b64decode(data["image_base64"])))
+    x0, y0, x1, y1 = data["region"]
+    assert image.size == (x1 - x0, y1 - y0) and data["canvas_size"] == list(ticket.load_base_layer(plan).size)
+    resp = client.post("/api/generate", json={"style": "red15", "user_data": user_data, "focus_field": "未知"})
+    assert resp.status_code == 400
+    resp = client.post("/api/generate", json={"style": "red15", "user_data": dict(user_data, 姓名="陈"), "focus_field": "姓名",
+                                              "previous_user_data": dict(user_data, 姓名="陈文杰")})
+    region = resp.get_json()["data"]["region"]
+    layout = {l.key: l for l in ticket.layout_ticket(plan, dict(user_data, 姓名="陈文杰"))}["姓名"]
+    assert region[0] <= layout.bbox[0] and region[2] >= layout.bbox[2]
+    resp = client.post("/api/generate", json={"style": "red15", "user_data": user_data, "focus_field": "姓名",
+                                              "previous_user_data": "陈文杰"})
+    assert resp.status_code == 400
+    print("✅ 接口返回区域图与坐标")
+
+
+if __name__ == "__main__":
+    test_region_matches_full_render()
+    test_region_covers_field()
+    test_region_stitches_over_stale_render()
+    test_api_focus_field()
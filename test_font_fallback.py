@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐字字体回退测试：cmap 覆盖解析、缺字改用回退字体、无法显示的字符在渲染前报出
+"""
+
+import os
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+USER_DATA = {"出发站": "北京南", "到达站": "上海虹桥", "车次号": "G1", "姓名": "张三"}
+
+
+def test_cmap_coverage():
+    digits = ticket.font_coverage(os.path.join(BASE_DIR, "fonts", "TrainTicketFont2.ttf"))
+    assert ord("1") in digits and ord("站") not in digits
+    hei = ticket.font_coverage(os.path.join(BASE_DIR, "fonts", "方正黑体简体.ttf"))
+    assert ord("站") in hei and ord("A") in hei and ord("😀") not in hei
+    # 每个字体文件只解析一次
+    assert ticket.font_coverage(os.path.join(BASE_DIR, "fonts", "方正黑体简体.ttf")) is hei
+    print("✅ cmap 覆盖解析正确")
+
+
+def test_missing_glyph_uses_fallback():
+    font = ticket.load_font("fonts/TrainTicketFont2.ttf", 50)
+    fallbacks = ticket.resolve_fallbacks(font)
+    assert fallbacks and all(os.path.exists(path) for path, _ in fallbacks)
+    assert ticket.font_for_char(font, fallbacks, "1") is font
+    for ch in ("站", " "):
+        chosen = ticket.font_for_char(font, fallbacks, ch)
+        assert chosen is not None and chosen is not font and chosen.size == font.size
+    assert ticket.font_for_char(font, fallbacks, "") is None
+    # 缺字部分单独成串，宽度按回退字体计算
+    runs = ticket.chain_runs(font, font, fallbacks, "12站", "#000000", 0, 0, 0, 1.0)
+    assert [run.text for run in runs] == ["12", "站"] and runs[1].font is not font
+    print("✅ 缺字改用回退字体")
+
+
+def test_unrenderable_chars():
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+    assert ticket.unrenderable_chars(plan, USER_DATA) == {}
+    assert ticket.unrenderable_chars(plan, dict(USER_DATA, 姓名="张三😀😀")) == {"姓名": "😀"}
+    print("✅ 无法显示的字符可提前检出")
+
+
+def test_api_rejects_unrenderable(temp_render_cache):
+    import api_server
+    client = api_server.app.test_client()
+    resp = client.post("/api/generate", json={"style": "red15", "user_data": dict(USER_DATA, 姓名="张三😀")})
+    result = resp.get_json()
+    assert resp.status_code == 400 and not result["success"] and result["unrenderable"] == {"姓名": "😀"}
+    result = client.post("/api/batch_generate", json={"style": "red15", "tickets": [USER_DATA, {"姓名": "😀"}]}).get_json()
+    assert result["results"][0]["success"] and result["results"][1]["unrenderable"] == {"姓名": "😀"}
+    print("✅ 接口拒绝无法显示的字符")
+
+
+if __name__ == "__main__":
+    test_cmap_coverage()
+    test_missing_glyph_uses_fallback()
+    test_unrenderable_chars()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+字体注册表测试：实例复用、按路径加载不缓存字体字节、回退路径缓存
+"""
+
+import os
+
+import ticket
+
+
+def test_font_instances_shared():
+    """同一 (路径, 字号) 复用同一个字体实例；实例按路径加载，不把字体字节读进内存"""
+    ticket.clear_font_cache()
+    a = ticket.load_font("fonts/TrainTicketFont2.ttf", 50)
+    b = ticket.load_font("fonts/TrainTicketFont2.ttf", 50)
+    c = ticket.load_font("fonts/TrainTicketFont2.ttf", 60)
+    assert a is b
+    assert a is not c
+    assert len(ticket._FONT_BYTES) == 0
+
+
+def test_font_bytes_read_once():
+    """cmap 覆盖等需要原始字节时，字体文件只读一次"""
+    ticket.clear_font_cache()
+    path = os.path.join(os.path.dirname(ticket.__file__), "fonts", "times.ttf")
+    assert ticket._font_bytes(path) is ticket._font_bytes(path)
+    assert len(ticket._FONT_BYTES) == 1
+
+
+def test_fallback_resolved_once(monkeypatch):
+    """缺失字体回退到项目字体，之后查找不再探测文件系统"""
+    ticket.clear_font_cache()
+    font = ticket.load_font("fonts/not_exists.ttf", 40)
+    assert os.path.basename(ticket._FONT_RESOLVED[("fonts/not_exists.ttf", 0)]) == "TrainTicketFont2.ttf"
+
+    def fail_exists(path):
+        raise AssertionError(f"unexpected filesystem probe: {path}")
+    monkeypatch.setattr(ticket.os.path, "exists", fail_exists)
+    assert ticket.load_font("fonts/not_exists.ttf", 40) is font
+    assert ticket.load_font("fonts/not_exists.ttf", 45).size == 45
+
+
+def test_lru_bounded(monkeypatch):
+    """实例缓存有上限"""
+    ticket.clear_font_cache()
+    monkeypatch.setattr(ticket, "FONT_CACHE_SIZE", 4)
+    for size in range(10, 20):
+        ticket.load_font("fonts/times.ttf", size)
+    assert len(ticket._FONT_CACHE) == 4
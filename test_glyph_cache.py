@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+字形缓存测试：缓存贴图与逐字 draw.text 逐像素一致
+"""
+
+from PIL import Image, ImageDraw
+
+import ticket
+
+
+def draw_text_reference(draw, text, x, y, font, fill, letter_spacing=0):
+    """旧实现：逐字 draw.text"""
+    for char in text:
+        draw.text((x, y), char, font=font, fill=fill)
+        x += font.getlength(char) + letter_spacing
+
+
+def test_atlas_matches_draw_text():
+    """数字、站名在各种小数起点下与 draw.text 结果一致"""
+    cases = [
+        ("fonts/TrainTicketFont2.ttf", 50, "20250101", 5),
+        ("fonts/方正黑体简体.ttf", 90, "上海虹桥", 2),
+        ("fonts/仿宋_GB2312.ttf", 65, "Shanghaihongqiao", 3),
+    ]
+    for font_path, size, text, spacing in cases:
+        font = ticket.load_font(font_path, size)
+        for x in (10, 10.25, 10.4921875, 10.5, 10.75, 10.984375):
+            for y in (20, 20.5, 20.515625):
+                expected = Image.new("RGB", (1200, 200), "white")
+                draw_text_reference(ImageDraw.Draw(expected), text, x, y, font, "#FF0000", spacing)
+                actual = Image.new("RGB", (1200, 200), "white")
+                ticket.draw_text(ImageDraw.Draw(actual), text, x, y, font, "#FF0000",
+                                 letter_spacing=spacing, base_image=actual)
+                assert actual.tobytes() == expected.tobytes(), (font_path, text, x, y)
+
+
+def test_glyphs_reused():
+    """同一字符同一落点只光栅化一次"""
+    font = ticket.load_font("fonts/TrainTicketFont2.ttf", 50)
+    ticket._GLYPHS.clear()
+    img = Image.new("RGB", (600, 100), "white")
+    ticket.draw_text(ImageDraw.Draw(img), "1111111111", 0, 0, font, "#000000", base_image=img)
+    assert len(ticket._GLYPHS) <= 2
+
+
+def test_glyphs_shared_across_font_instances(monkeypatch):
+    """同一字体文件、同一字号的不同实例共用字形条目；所有字体共用一份字节预算"""
+    monkeypatch.setattr(ticket, "_GLYPHS", ticket.LRUCache(ticket.GLYPH_CACHE_SIZE, 64 * 1024, lambda e: ticket._mask_bytes(e[0])))
+    font = ticket.load_font("fonts/仿宋_GB2312.ttf", 50)
+    ticket.clear_font_cache()
+    other = ticket.load_font("fonts/仿宋_GB2312.ttf", 50)
+    assert other is not font
+    assert ticket.glyph_mask(font, "票") is ticket.glyph_mask(other, "票")
+    for size in range(40, 60):
+        for ch in "北京南站":
+            ticket.glyph_mask(ticket.load_font("fonts/仿宋_GB2312.ttf", size), ch)
+    assert ticket._GLYPHS.bytes <= 64 * 1024
+
+
+def test_scaled_run_rasterized_once():
+    """横向压缩字形串整串缓存，宽度与排版宽度一致"""
+    font = ticket.load_font("fonts/仿宋_GB2312.ttf", 50)
+    ticket._SCALED_RUNS.clear()
+    text = "Chongqingxi"
+    width = ticket.run_width(font, text, 2, 0.8)
+    for _ in range(3):
+        img = Image.new("RGB", (800, 100), "white")
+        ticket.draw_text(ImageDraw.Draw(img), text, 10.5, 5, font, "#000000",
+                         letter_spacing=2, scale_x=0.8, base_image=img)
+    assert ticket._SCALED_RUNS.misses == 1
+    assert ticket._SCALED_RUNS.hits == 2
+    x0, _, x1, _ = img.convert("L").point(lambda v: 255 if v < 128 else 0).getbbox()
+    assert x0 >= 10 and x1 <= 10 + width + 4
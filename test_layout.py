@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+排版测试：分段字段测量一次、绘制一次，排版结果可独立用于包围盒查询
+"""
+
+import json
+import os
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+
+
+def load_plan(style):
+    return ticket.load_render_plan(os.path.join(TEMPLATE_DIR, f"ticket_template_{style}.json"), TEMPLATE_DIR)
+
+
+def test_layout_centers_on_scaled_width():
+    """居中字段按压缩后的实际宽度居中"""
+    plan = load_plan("red15")
+    layouts = {l.key: l for l in ticket.layout_ticket(plan, {"出发站拼音": "Shanghaihongqiao"})}
+    run = layouts["拼音1"].runs[0]
+    assert run.scale_x == 0.8
+    assert abs((run.x + run.width / 2) - 315) < 1e-6
+    x0, y0, x1, y1 = layouts["拼音1"].bbox
+    assert x0 <= run.x < x1 and y0 == run.y and y1 > y0
+
+
+def test_each_run_painted_once(monkeypatch):
+    """动态字段的每个字形串只绘制一次"""
+    plan = load_plan("red15")
+    with open(os.path.join(BASE_DIR, "default_templates", "user_red15.json"), "r", encoding="utf-8") as f:
+        user_data = json.load(f)
+    ticket.load_base_layer(plan)
+    ticket.clear_field_tile_cache()
+    painted = []
+    original = ticket.run_stamps
+    def counting_run_stamps(run):
+        painted.append(run)
+        return original(run)
+    monkeypatch.setattr(ticket, "run_stamps", counting_run_stamps)
+    ticket.render_plan(plan, user_data)
+    dynamic = ticket.layout_ticket(plan._replace(static_ops=()), user_data)
+    expected = [run for layout in dynamic for run in layout.runs]
+    assert painted == expected
+
+
+def test_empty_field_has_no_bbox():
+    plan = load_plan("red15")
+    layouts = {l.key: l for l in ticket.layout_ticket(plan, {})}
+    assert layouts["姓名"].runs == ()
+    assert layouts["姓名"].bbox is None
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+矢量 PDF 测试：文件结构（xref 偏移）、字体子集只含用到的字形、文本笔位与栅格排版一致、体积小于 PNG、接口返回 PDF
+"""
+
+import json
+import os
+import re
+import zlib
+
+import ticket
+from truetype import TrueTypeFont
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+
+
+def load_user_data():
+    with open(os.path.join(BASE_DIR, "default_templates", "user_red15.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_objects(pdf):
+    """{对象号: (字典部分, 解压后的流或 None)}"""
+    objects = {}
+    for m in re.finditer(rb"(\d+) 0 obj\n(.*?)\nendobj\n", pdf, re.S):
+        body = m.group(2)
+        data = None
+        if b"\nstream\n" in body:
+            head, data = body.split(b"\nstream\n", 1)
+            data = data[:-len(b"\nendstream")]
+            if b"/FlateDecode" in head:
+                data = zlib.decompress(data)
+            body = head
+        objects[int(m.group(1))] = (body, data)
+    return objects
+
+
+def test_pdf_structure():
+    pdf = ticket.render_ticket_pdf(load_user_data(), TEMPLATE_JSON, TEMPLATE_DIR)
+    assert pdf.startswith(b"%PDF-1.7") and pdf.rstrip().endswith(b"%%EOF")
+    startxref = int(pdf.rsplit(b"startxref\n", 1)[1].split()[0])
+    assert pdf[startxref:].startswith(b"xref\n")
+    entries = re.findall(rb"(\d{10}) 00000 n ", pdf[startxref:])
+    for number, offset in enumerate(entries, 1):
+        assert pdf[int(offset):].startswith(b"%d 0 obj\n" % number)
+    objects = parse_objects(pdf)
+    assert len(objects) == len(entries)
+    # 背景只嵌入一次（JPEG），页面尺寸为 87 毫米宽
+    assert sum(b"/DCTDecode" in body for body, _ in objects.values()) == 1
+    page = next(body for body, _ in objects.values() if b"/Type /Page " in body)
+    width = float(re.search(rb"/MediaBox \[0 0 ([\d.]+)", page).group(1))
+    assert abs(width - ticket.PRINT_WIDTH_MM / 25.4 * 72) < 0.01
+    print("✅ PDF 结构与交叉引用表正确")
+
+
+def test_font_subsets():
+    user_data = load_user_data()
+    pdf = ticket.render_ticket_pdf(user_data, TEMPLATE_JSON, TEMPLATE_DIR)
+    objects = parse_objects(pdf)
+    fonts = [data for body, data in objects.values() if b"/Length1" in body]
+    assert fonts
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+    used = {ch for layout in ticket.layout_ticket(plan, user_data) for run in layout.runs for ch in run.text}
+    used |= {ch for value in ticket.flatten_user_data(user_data).values() for ch in str(value)}  # 带圈字不经 layout_ticket
+    for data in fonts:
+        sub = TrueTypeFont(data)
+        # 子集只含 .notdef + 用到的字（组合字形的部件另计），体积远小于原字体
+        assert sub.num_glyphs <= len(used) + 1 + 8 and len(data) < 200_000
+        assert set(map(chr, sub.cmap)) <= used
+    # ToUnicode 覆盖所有写出的字，可复制检索
+    text = "".join(chr(int(u, 16)) for _, data in objects.values() if data and b"beginbfchar" in data
+                   for u in re.findall(rb"<[0-9A-F]{4}> <([0-9A-F]+)>", data))
+    assert {"西", "安", "重", "庆"} <= set(text)
+    print("✅ 字体按文档子集化嵌入")
+
+
+def test_text_positions_match_layout():
+    user_data = load_user_data()
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+    content = next(data for body, data in parse_objects(ticket.render_pdf(plan, user_data)).values()
+                   if data and b" TJ ET" in data).decode("latin-1")
+    shown = [tuple(map(float, m)) for m in re.findall(r"1 0 0 -1 ([\d.]+) ([\d.]+) Tm", content)]
+    for layout in ticket.layout_ticket(plan, user_data):
+        for run in layout.runs:
+            if not run.text or run.scale_x != 1.0:
+                continue
+            baseline = run.y + run.font.getmetrics()[0]
+            assert any(abs(x - run.x) < 0.01 and abs(y - baseline) < 0.01 for x, y in shown), (layout.key, run.text)
+    print("✅ 文本起点与基线和栅格排版一致")
+
+
+def test_pdf_smaller_than_png():
+    user_data = load_user_data()
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+    pdf = ticket.render_pdf(plan, user_data)
+    png = ticket.encode_image(ticket.render_plan(plan, user_data), "PNG")
+    assert len(pdf) < len(png) / 2
+    try:
+        ticket.encode_image(ticket.render_plan(plan, user_data), "PDF")
+        assert False, "PDF 不能由位图编码"
+    except ValueError:
+        pass
+    print(f"✅ PDF {len(pdf)} 字节，PNG {len(png)} 字节")
+
+
+def test_api_pdf(temp_render_cache):
+    import api_server
+    client = api_server.app.test_client()
+    payload = {"style": "red15", "user_data": load_user_data(), "format": "file", "image_format": "pdf"}
+    resp = client.post("/api/generate", json=payload)
+    assert resp.status_code == 200 and resp.mimetype == "application/pdf" and resp.data.startswith(b"%PDF")
+    resp = client.post("/api/generate", json=dict(payload, image_format=None), headers={"Accept": "application/pdf"})
+    assert resp.mimetype == "application/pdf" and resp.data.startswith(b"%PDF")
+    resp = client.post("/api/generate", json=dict(payload, format="base64"))
+    assert resp.get_json()["data"]["mime_type"] == "application/pdf"
+    assert client.post("/api/generate", json=dict(payload, focus_field="姓名")).status_code == 400
+    print("✅ 接口返回 PDF")
+
+
+if __name__ == "__main__":
+    test_pdf_structure()
+    test_font_subsets()
+    test_text_positions_match_layout()
+    test_pdf_smaller_than_png()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多线程 PNG 编码测试：多块拼接的 IDAT 流可被标准解码器读取且与原图逐像素一致
+"""
+
+import os
+import struct
+import zlib
+from io import BytesIO
+
+from PIL import Image
+
+import png_writer
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+USER_DATA = {"出发站": "北京南", "到达站": "上海虹桥", "车次号": "G1", "姓名": "张三"}
+
+
+def read_idat(data):
+    pos, idat = 8, b""
+    while pos < len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        if tag == b"IDAT":
+            idat += data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+    return idat
+
+
+def test_roundtrip_all_modes():
+    image = ticket.render_ticket(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR)
+    palette = ticket.load_palette(ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR))
+    images = [image, image.convert("RGBA"), image.convert("L"), image.quantize(palette=palette, dither=Image.Dither.NONE)]
+    for img in images:
+        # 小块强制多块拼接
+        data = png_writer.encode_png(img, workers=4, chunk_bytes=64 * 1024)
+        decoded = Image.open(BytesIO(data))
+        decoded.load()
+        assert decoded.mode == img.mode and decoded.size == img.size
+        assert decoded.tobytes() == img.tobytes()
+        if img.mode == "P":
+            assert decoded.getpalette() == img.getpalette()
+        # IDAT 是一条完整的 zlib 流（校验 adler32）
+        assert len(zlib.decompress(read_idat(data))) == img.height * (len(img.tobytes()) // img.height + 1)
+    print("✅ 各模式往返一致")
+
+
+def test_output_independent_of_workers():
+    image = ticket.render_ticket(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR)
+    assert png_writer.encode_png(image, workers=1) == png_writer.encode_png(image, workers=4)
+    tiny = Image.new("RGB", (3, 2), (255, 0, 0))
+    assert Image.open(BytesIO(png_writer.encode_png(tiny))).convert("RGB").tobytes() == tiny.tobytes()
+    print("✅ 输出与线程数无关")
+
+
+def test_encode_image_uses_writer():
+    image = ticket.render_ticket(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR)
+    assert ticket.encode_image(image) == png_writer.encode_png(image)
+    buf = BytesIO()
+    image.save(buf, format="PNG")
+    assert len(ticket.encode_image(image)) <= len(buf.getvalue())
+    print("✅ 生成接口使用多线程编码器")
+
+
+if __name__ == "__main__":
+    test_roundtrip_all_modes()
+    test_output_independent_of_workers()
+    test_encode_image_uses_writer()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+低分辨率预览测试：模板几何缩放、max_width 换算、缩小背景缓存、接口参数
+"""
+
+import json
+import os
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+USER_DATA = {"出发站": "北京南", "到达站": "上海虹桥", "车次号": "G1", "姓名": "张三"}
+
+
+def test_scaled_render_size():
+    full = ticket.render_ticket(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR)
+    quarter = ticket.render_ticket(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR, scale=0.25)
+    assert abs(quarter.width - full.width / 4) <= 1 and abs(quarter.height - full.height / 4) <= 1
+    # max_width 只缩小不放大
+    assert ticket.render_ticket(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR, max_width=400).width <= 400
+    assert ticket.render_ticket(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR, max_width=99999).size == full.size
+    # 小于最小缩放档的 max_width、超出 (0, 1] 的 scale 直接拒绝，不静默放大
+    for kwargs in ({"max_width": 10}, {"scale": 4}, {"scale": -1}):
+        try:
+            ticket.resolve_scale(TEMPLATE_JSON, TEMPLATE_DIR, **kwargs)
+            assert False, kwargs
+        except ValueError:
+            pass
+    print("✅ 缩放预览尺寸正确")
+
+
+def test_scale_template_geometry():
+    with open(TEMPLATE_JSON, encoding="utf-8") as f:
+        cfg = json.load(f)
+    scaled = ticket.scale_template(cfg, 0.5)
+    assert ticket.scale_template(cfg, 1.0) is cfg
+    for key, spec in cfg["fields"].items():
+        if "x" in spec:
+            assert scaled["fields"][key]["x"] == round(spec["x"] * 0.5)
+        if "size" in spec:
+            assert scaled["fields"][key]["size"] == max(round(spec["size"] * 0.5), 1)
+    # 原模板不被修改
+    with open(TEMPLATE_JSON, encoding="utf-8") as f:
+        assert json.load(f) == cfg
+    print("✅ 模板几何缩放正确")
+
+
+def test_scaled_background_cached():
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR, 0.5)
+    assert plan.scale == 0.5 and plan is not ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+    small = ticket.load_background(plan.background, 0.5)
+    assert ticket.load_background(plan.background, 0.5) is small
+    assert small.width == round(ticket.load_background(plan.background).width * 0.5)
+    assert ticket.normalize_scale(0.333) == 0.3 and ticket.normalize_scale(0.25) == 0.25
+    print("✅ 缩小背景只计算一次")
+
+
+def test_api_preview_params(temp_render_cache):
+    import api_server
+    import web_app
+    from io import BytesIO
+    from PIL import Image
+    client = api_server.app.test_client()
+    resp = client.post("/api/generate", json={"user_data": USER_DATA, "style": "red15", "max_width": 360, "format": "file"})
+    assert resp.status_code == 200
+    assert Image.open(BytesIO(resp.data)).width <= 360
+    for params in ({"scale": 2}, {"max_width": 10}):
+        resp = client.post("/api/generate", json=dict(params, user_data=USER_DATA, style="red15"))
+        assert resp.status_code == 400 and not resp.get_json()["success"]
+    # 网页内联预览同样只接受 (0, 1] 的 scale
+    resp = web_app.app.test_client().post("/?preview=1", json={"user_data": USER_DATA, "style": "red15", "scale": 4})
+    assert not resp.get_json()["success"]
+    print("✅ 接口预览参数正确")
+
+if __name__ == "__main__":
+    test_scaled_render_size()
+    test_scale_template_geometry()
+    test_scaled_background_cached()
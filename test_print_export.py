@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+打印导出测试：分块合成与整图渲染一致、流式 PNG / TIFF 可被标准解码器读取、接口流式返回
+"""
+
+import json
+import os
+from io import BytesIO
+
+from PIL import Image, ImageChops
+
+import png_writer
+import ticket
+import tiff_writer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+
+
+def load_user_data():
+    with open(os.path.join(BASE_DIR, "default_templates", "user_red15.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def stitch(tiles, size):
+    image, y = Image.new("RGB", size), 0
+    for tile in tiles:
+        assert tile.width == size[0]
+        image.paste(tile, (0, y))
+        y += tile.height
+    assert y == size[1]
+    return image
+
+
+def test_tiles_match_full_render():
+    user_data = load_user_data()
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR, 1.5)
+    full = ticket.render_plan(plan, user_data)
+    assert ticket.print_size(plan) == full.size
+    tiled = stitch(ticket.iter_print_tiles(plan, user_data, 97), full.size)
+    # 背景按块重采样时采样位置有浮点舍入差异，最多相差 1 个色阶；字段与静态元素逐像素一致
+    assert max(hi for _, hi in ImageChops.difference(tiled, full).getextrema()) <= 1
+    print("✅ 分块合成与整图一致")
+
+
+def test_streamed_encoders():
+    user_data = load_user_data()
+    plan = ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR, 0.5)
+    size = ticket.print_size(plan)
+    expected = stitch(ticket.iter_print_tiles(plan, user_data, 64), size)
+    png = b"".join(png_writer.iter_png(size[0], size[1], "RGB", ticket.iter_print_tiles(plan, user_data, 64), dpi=300))
+    tiff = b"".join(tiff_writer.iter_tiff(size[0], size[1], "RGB", ticket.iter_print_tiles(plan, user_data, 64), 64, 300))
+    assert len(tiff) == tiff_writer.tiff_size(size[0], size[1], "RGB", 64)
+    for data, kind in ((png, "PNG"), (tiff, "TIFF")):
+        decoded = Image.open(BytesIO(data))
+        decoded.load()
+        assert decoded.format == kind and decoded.tobytes() == expected.tobytes()
+        assert round(decoded.info["dpi"][0]) == 300
+    print("✅ 流式 PNG / TIFF 解码一致")
+
+
+def test_export_dpi():
+    chunks, size, dpi = ticket.export_print(load_user_data(), TEMPLATE_JSON, TEMPLATE_DIR, dpi=600, fmt="tiff")
+    assert dpi >= 600 and abs(size[0] / (ticket.PRINT_WIDTH_MM / 25.4) - dpi) < 1e-6
+    assert Image.open(BytesIO(b"".join(chunks))).size == size
+    try:
+        ticket.export_print({}, TEMPLATE_JSON, TEMPLATE_DIR, fmt="JPEG")
+        assert False, "应拒绝不支持的格式"
+    except ValueError:
+        pass
+    print("✅ 按 DPI 导出")
+
+
+def test_max_dpi_within_budget():
+    """各样式默认车票在接口 DPI 上限下都能通过开销检查；更大的打印宽度不再放宽预算"""
+    import api_server
+    for style in ("red15", "blue15", "red05_longride", "red05_shortride", "red1997"):
+        path = os.path.join(TEMPLATE_DIR, f"ticket_template_{style}.json")
+        with open(os.path.join(BASE_DIR, "default_templates", f"user_{style}.json"), "r", encoding="utf-8") as f:
+            user_data = json.load(f)
+        plan = ticket.load_render_plan(path, TEMPLATE_DIR, ticket.print_scale(path, TEMPLATE_DIR, api_server.MAX_PRINT_DPI), cache=False)
+        assert plan.scale <= ticket.MAX_PRINT_SCALE
+        ticket.check_render_cost(plan, user_data, ticket.print_budget(plan))
+    # 超出缩放上限的打印宽度在编译放大计划之前拒绝
+    try:
+        ticket.print_scale(TEMPLATE_JSON, TEMPLATE_DIR, api_server.MAX_PRINT_DPI, 10000)
+        assert False, "超出缩放上限的打印宽度应被拒绝"
+    except ticket.RenderCostError as e:
+        assert e.violations[0]["limit"] == "max_print_scale"
+    client = api_server.app.test_client()
+    payload = {"style": "red15", "user_data": load_user_data(), "dpi": api_server.MAX_PRINT_DPI}
+    resp = client.post("/api/print", json=dict(payload, width_mm=10000))
+    assert resp.status_code == 413 and resp.get_json()["violations"][0]["limit"] == "max_print_scale"
+    for width_mm in ("inf", "nan", 1e308):
+        assert client.post("/api/print", json=dict(payload, width_mm=width_mm)).status_code in (400, 413)
+    assert client.post("/api/print", json=dict(payload, width_mm="inf")).status_code == 400
+    # 开销检查先于逐字字体覆盖检查：同时超限且含无法显示的字符时返回 413
+    oversized = dict(payload, width_mm=10000, user_data=dict(load_user_data(), 姓名="\U0001F600"))
+    assert client.post("/api/print", json=oversized).status_code == 413
+    print("✅ DPI 上限内开销检查通过，超出缩放上限被拒绝")
+
+
+def test_api_print(monkeypatch):
+    import api_server
+    client = api_server.app.test_client()
+    payload = {"style": "red15", "user_data": load_user_data(), "dpi": 200}
+    resp = client.post("/api/print", json=payload)
+    assert resp.status_code == 200 and resp.mimetype == "image/png" and resp.is_streamed
+    assert Image.open(BytesIO(resp.data)).size == tuple(map(int, resp.headers["X-Ticket-Size"].split("x")))
+    resp = client.post("/api/print", json=dict(payload, image_format="TIFF"))
+    assert int(resp.headers["Content-Length"]) == len(resp.data)
+    assert client.post("/api/print", json=dict(payload, dpi=0)).status_code == 400
+    monkeypatch.setattr(ticket, "RENDER_BUDGET", ticket.RENDER_BUDGET._replace(max_temp_area=1000))
+    resp = client.post("/api/print", json=payload)
+    assert resp.status_code == 413 and resp.get_json()["violations"][0]["limit"] == "max_temp_area"
+    print("✅ 打印接口流式返回")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+二维码快速路径测试：与逐像素实现结果一致，矩阵按编码串缓存，分段编码不劣于单一模式
+"""
+
+import qrcode
+from PIL import Image
+
+import ticket
+
+
+def make_qr_reference(data_str, size_px):
+    """旧实现：整图 RGBA + 逐像素去白（数据按相同分段写入）"""
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=6, border=0)
+    for mode, text in ticket.qr_data_segments(data_str):
+        qr.add_data(qrcode.util.QRData(text, mode=mode))
+    qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color="white").convert("RGBA")
+    qr_img.putdata([(255, 255, 255, 0) if px[0] > 200 and px[1] > 200 and px[2] > 200 else px for px in qr_img.getdata()])
+    if qr_img.width != size_px or qr_img.height != size_px:
+        qr_img = qr_img.resize((size_px, size_px), resample=Image.NEAREST)
+    return qr_img
+
+
+def test_matches_reference():
+    data = ticket.encode_ticket_data({"票号": "123456", "年": "2025", "月": "01", "日": "01", "姓名": "张三"})
+    for size in (200, 222, 290, 300):
+        assert ticket.make_qr_from_number_string(data, size).tobytes() == make_qr_reference(data, size).tobytes()
+
+
+def test_modules_memoized():
+    ticket._QR_SYMBOLS.clear()
+    ticket.qr_mask("0123456789", 100)
+    ticket.qr_mask("0123456789", 200)
+    assert ticket._QR_SYMBOLS.hits == 1
+    assert ticket._QR_SYMBOLS.misses == 1
+
+
+def test_segments_cover_payload():
+    """分段拼接还原原串，且版本不高于 qrcode 默认编码"""
+    data = ticket.encode_ticket_data({"字母": "E", "票号": "123456", "年": "2025", "月": "10", "日": "18",
+                                      "车次号": "G1234", "身份证号1": "1101011990", "姓名": "张三丰"})
+    segments = ticket.qr_data_segments(data)
+    assert "".join(text for _, text in segments) == data
+    assert len(segments) > 1
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L)
+    qr.add_data(data)
+    qr.make(fit=True)
+    info = ticket.qr_info(data)
+    assert info["version"] <= qr.version
+    assert info["modules"] == 17 + 4 * info["version"]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+渲染缓存测试：内容地址、内存/磁盘两级命中、磁盘容量淘汰、接口接入
+"""
+
+import base64
+import os
+import shutil
+import tempfile
+
+import render_cache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+USER_DATA = {"出发站": "北京南", "到达站": "上海虹桥", "车次号": "G1", "姓名": {"value": "张三", "enabled": True}}
+
+
+def make_cache(**kwargs):
+    tmp_dir = tempfile.mkdtemp()
+    return render_cache.RenderCache(disk_dir=tmp_dir, **kwargs), tmp_dir
+
+
+def test_memory_and_disk_tiers():
+    cache, tmp_dir = make_cache()
+    try:
+        first = render_cache.render_ticket_bytes(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR, cache=cache)
+        assert first.startswith(b"\x89PNG")
+        assert render_cache.render_ticket_bytes(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR, cache=cache) == first
+        assert cache.stats()["memory_hits"] == 1 and cache.stats()["misses"] == 1
+
+        # 新进程只剩磁盘层
+        cold = render_cache.RenderCache(disk_dir=tmp_dir)
+        assert render_cache.render_ticket_bytes(USER_DATA, TEMPLATE_JSON, TEMPLATE_DIR, cache=cold) == first
+        assert cold.stats()["disk_hits"] == 1
+        leftovers = [n for _, _, files in os.walk(tmp_dir) for n in files if n.endswith(".tmp")]
+        assert leftovers == []
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_key_follows_rendered_data():
+    """禁用字段不影响缓存键，取值变化则换键"""
+    plan = render_cache.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+    key = render_cache.render_key(plan, USER_DATA, {"format": "PNG"})
+    with_disabled = dict(USER_DATA, 备注={"value": "x", "enabled": False})
+    assert render_cache.render_key(plan, with_disabled, {"format": "PNG"}) == key
+    assert render_cache.render_key(plan, dict(USER_DATA, 车次号="G2"), {"format": "PNG"}) != key
+    assert render_cache.render_key(plan, USER_DATA, {"format": "JPEG"}) != key
+
+
+
+def test_key_follows_dependency_files(monkeypatch):
+    """叠加图或字体文件被替换（mtime/大小变化）后换键"""
+    template = os.path.join(TEMPLATE_DIR, "ticket_template_red1997.json")
+    plan = render_cache.load_render_plan(template, TEMPLATE_DIR)
+    files = render_cache.plan_files(plan)
+    overlay = os.path.join(TEMPLATE_DIR, "arrow.png")
+    font = next(path for path in files if path.endswith((".ttf", ".ttc")))
+    assert plan.background in files and overlay in files
+    key = render_cache.render_key(plan, USER_DATA, {"format": "PNG"})
+    stamp = render_cache._file_stamp
+    for changed in (overlay, font):
+        monkeypatch.setattr(render_cache, "_file_stamp", lambda path: [0, 0] if path == changed else stamp(path))
+        assert render_cache.render_key(plan, USER_DATA, {"format": "PNG"}) != key
+
+def test_disk_eviction():
+    cache, tmp_dir = make_cache(memory_bytes=0, disk_bytes=1000)
+    try:
+        for i in range(10):
+            cache.put(f"{i:064x}", b"x" * 300)
+        total = sum(os.path.getsize(os.path.join(r, n)) for r, _, files in os.walk(tmp_dir) for n in files)
+        assert total <= 1000
+        assert cache.get(f"{9:064x}") == b"x" * 300
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_api_uses_cache(temp_render_cache):
+    import api_server
+    client = api_server.app.test_client()
+    payload = {"style": "red15", "user_data": USER_DATA}
+    r1 = client.post("/api/generate", json=payload).get_json()
+    r2 = client.post("/api/generate", json=payload).get_json()
+    assert r1["success"] and r1["data"]["image_base64"] == r2["data"]["image_base64"]
+    assert base64.b64decode(r1["data"]["image_base64"]).startswith(b"\x89PNG")
+    assert temp_render_cache.stats()["hits"] == 1
+    assert "render_cache" in client.get("/api/cache/stats").get_json()
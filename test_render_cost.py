@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+渲染开销预估测试：按编译结果估算字形数与临时图面积、超预算拒绝、重复字符截断、接口 413
+"""
+
+import os
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+USER_DATA = {"出发站": "北京南", "到达站": "上海虹桥", "车次号": "G1", "姓名": "张三", "星号": "*"}
+
+
+def load_plan():
+    return ticket.load_render_plan(TEMPLATE_JSON, TEMPLATE_DIR)
+
+
+def test_cost_estimate():
+    plan = load_plan()
+    cost = ticket.check_render_cost(plan, USER_DATA)
+    assert cost.fields["姓名"] == 2 and cost.glyphs >= sum(len(v) for v in USER_DATA.values())
+    longer = ticket.render_cost(plan, dict(USER_DATA, 姓名="张三" * 50))
+    assert longer.glyphs == cost.glyphs + 98 and longer.temp_area > cost.temp_area
+    print("✅ 开销预估正确")
+
+
+def test_over_budget_rejected():
+    plan = load_plan()
+    try:
+        ticket.render_plan(plan, dict(USER_DATA, 星号个数=100000000))
+        assert False, "应拒绝超预算输入"
+    except ticket.RenderCostError as e:
+        assert {"limit": "max_repeat_count", "field": "身份信息", "value": 100000000, "max": 256} in e.violations
+    budget = ticket.RENDER_BUDGET._replace(max_glyphs=10, max_temp_area=1)
+    try:
+        ticket.check_render_cost(plan, USER_DATA, budget)
+        assert False, "应拒绝超预算输入"
+    except ticket.RenderCostError as e:
+        assert {v["limit"] for v in e.violations} == {"max_glyphs", "max_temp_area"}
+    print("✅ 超预算输入被拒绝")
+
+
+def test_repeat_count_clamped():
+    plan = load_plan()
+    seg = next(seg for op in plan.ops if isinstance(op, ticket.SegmentsOp) for seg in op.segments if seg.text == "{星号}")
+    values = ticket.UserValues(dict(USER_DATA, 星号个数=100000000))
+    assert ticket.resolve_segment_text(seg, values.fmt_map) == "*" * ticket.RENDER_BUDGET.max_repeat_count
+    print("✅ 重复字符个数被截断")
+
+
+def test_api_returns_413():
+    import api_server
+    client = api_server.app.test_client()
+    resp = client.post("/api/generate", json={"style": "red15", "user_data": dict(USER_DATA, 姓名="张" * 1000)})
+    result = resp.get_json()
+    assert resp.status_code == 413 and not result["success"]
+    assert result["violations"] == [{"limit": "max_field_chars", "field": "姓名", "value": 1000, "max": 256}]
+    print("✅ 接口返回结构化的 413")
+
+
+if __name__ == "__main__":
+    test_cost_estimate()
+    test_over_budget_rejected()
+    test_repeat_count_clamped()
+    test_api_returns_413()
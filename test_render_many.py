@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量渲染测试：生成器按输入顺序产出，进程池分块结果与单进程一致，模板只编译一次
+"""
+
+import os
+from io import BytesIO
+
+from PIL import Image
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+TEMPLATE_JSON = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+TICKETS = [{"姓名": f"乘客{i}", "车次号": f"G{i}", "出发站": "北京南", "到达站": "上海虹桥"} for i in range(7)]
+
+
+def test_sequential_generator():
+    results = ticket.render_many(TEMPLATE_JSON, TEMPLATE_DIR, iter(TICKETS))
+    assert not isinstance(results, list)
+    for data, image in zip(TICKETS, results):
+        assert image.tobytes() == ticket.render_ticket(data, TEMPLATE_JSON, TEMPLATE_DIR).tobytes()
+    print("✅ 单进程逐张产出")
+
+
+def test_process_pool_preserves_order():
+    sequential = list(ticket.render_many(TEMPLATE_JSON, TEMPLATE_DIR, TICKETS, fmt="PNG"))
+    pooled = list(ticket.render_many(TEMPLATE_JSON, TEMPLATE_DIR, TICKETS, fmt="PNG", processes=2, chunksize=2))
+    assert pooled == sequential
+    assert Image.open(BytesIO(pooled[0])).format == "PNG"
+    print("✅ 进程池结果与输入顺序一致")
+
+
+def test_template_compiled_once():
+    ticket.clear_plan_cache()
+    compiled = []
+    original = ticket.compile_template
+    ticket.compile_template = lambda *args, **kwargs: compiled.append(1) or original(*args, **kwargs)
+    try:
+        list(ticket.render_many(TEMPLATE_JSON, TEMPLATE_DIR, TICKETS, fmt="JPEG", quality=80))
+    finally:
+        ticket.compile_template = original
+    assert len(compiled) == 1
+    print("✅ 模板只编译一次")
+
+
+if __name__ == "__main__":
+    test_sequential_generator()
+    test_process_pool_preserves_order()
+    test_template_compiled_once()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+渲染计划测试：模板编译、进程级缓存与失效
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+import ticket
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+
+
+def load_default_user_data(style):
+    with open(os.path.join(BASE_DIR, "default_templates", f"user_{style}.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_plan_is_cached():
+    """同一模板重复加载返回同一个计划对象"""
+    path = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+    plan = ticket.load_render_plan(path, TEMPLATE_DIR)
+    assert ticket.load_render_plan(path, TEMPLATE_DIR) is plan
+    assert plan.content_hash
+    assert any(isinstance(op, ticket.QrOp) for op in plan.ops)
+
+
+def test_plan_invalidated_on_change():
+    """模板内容变化后重新编译；仅 mtime 变化时沿用旧计划"""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "ticket_template_red15.json")
+        shutil.copy2(os.path.join(TEMPLATE_DIR, "ticket_template_red15.json"), path)
+        plan = ticket.load_render_plan(path, TEMPLATE_DIR)
+
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert ticket.load_render_plan(path, TEMPLATE_DIR) is plan
+
+        with open(path, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+        del cfg["fields"]["直线1"]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(cfg, f, ensure_ascii=False)
+        new_plan = ticket.load_render_plan(path, TEMPLATE_DIR)
+        assert new_plan is not plan
+        assert len(new_plan.static_ops) == len(plan.static_ops) - 1
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+
+def test_plan_cache_bounded(monkeypatch):
+    """按缩放缓存的计划条目数有上限；打印导出的一次性计划不进缓存"""
+    path = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+    monkeypatch.setattr(ticket, "_PLAN_CACHE", ticket.LRUCache(4))
+    for step in range(1, 11):
+        ticket.load_render_plan(path, TEMPLATE_DIR, step / 10)
+    assert len(ticket._PLAN_CACHE) == 4
+    ticket.clear_plan_cache()
+    scale = ticket.print_scale(path, TEMPLATE_DIR, 600)
+    ticket.export_print(load_default_user_data("red15"), path, TEMPLATE_DIR, dpi=600)
+    assert ticket._PLAN_CACHE.get((os.path.abspath(path), os.path.abspath(TEMPLATE_DIR), scale)) is None
+
+
+def test_tokenize_format():
+    """格式串预拆分与 str.format_map 结果一致"""
+    fmt_map = ticket.SafeDict({"出发站": "北京南", "车次号": "G1"})
+    for text in ["{出发站}", "{出发站}站", "{车次号}{缺失}次", "{{转义}}{出发站}", "站"]:
+        seg = ticket.Segment(text, ticket.tokenize_format(text), None, "#000000", 0, 1.0, 0, None, None)
+        assert ticket.format_tokens(seg, fmt_map) == text.format_map(fmt_map)
+    assert ticket.tokenize_format("{a.b}") is None
+
+
+def test_render_all_styles():
+    """所有样式都能按计划渲染出与画布背景同尺寸的图片"""
+    for style in ["red15", "blue15", "red05_longride", "red05_shortride", "red1997"]:
+        path = os.path.join(TEMPLATE_DIR, f"ticket_template_{style}.json")
+        img = ticket.render_ticket(load_default_user_data(style), path, TEMPLATE_DIR)
+        assert img.mode == "RGB"
+        assert img.size[0] > 0 and img.size[1] > 0
+
+
+def test_background_master_not_mutated():
+    """背景母版只解码一次，渲染在副本上进行"""
+    path = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+    plan = ticket.load_render_plan(path, TEMPLATE_DIR)
+    master = ticket.load_background(plan.background)
+    before = master.tobytes()
+    ticket.render_ticket(load_default_user_data("red15"), path, TEMPLATE_DIR)
+    assert ticket.load_background(plan.background) is master
+    assert master.tobytes() == before
+
+
+def test_static_ops_split():
+    """线条、虚线框与纯字面量前缀段归入静态层，含用户字段的部分留在动态层"""
+    path = os.path.join(TEMPLATE_DIR, "ticket_template_red15.json")
+    plan = ticket.load_render_plan(path, TEMPLATE_DIR)
+    static_types = [type(op) for op in plan.static_ops]
+    assert static_types.count(ticket.LineOp) == 2
+    assert ticket.DashedRectOp in static_types
+    assert not any(isinstance(op, (ticket.LineOp, ticket.DashedRectOp)) for op in plan.ops)
+    # “站”后缀随居中的站名移动，不能预合成
+    dynamic_keys = [op.key for op in plan.ops if isinstance(op, ticket.SegmentsOp)]
+    assert "出发站" in dynamic_keys
+    # 票价：字面量 "$" 前缀静态，金额部分动态且起点右移
+    static_price = [op for op in plan.static_ops if getattr(op, "key", None) == "票价"][0]
+    dynamic_price = [op for op in plan.ops if getattr(op, "key", None) == "票价"][0]
+    assert dynamic_price.x > static_price.x
+
+
+if __name__ == "__main__":
+    test_plan_is_cached()
+    test_plan_invalidated_on_change()
+    test_tokenize_format()
+    test_render_all_styles()
+    test_background_master_not_mutated()
+    test_static_ops_split()
+    print("OK 渲染计划测试通过")
@@ -1,17 +1,78 @@
-from PIL import Image, ImageDraw, ImageFont
-import json, os, random, sys, base64
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from collections import namedtuple, OrderedDict
+from io import BytesIO
+import json, os, random, sys, base64, hashlib, math, string, struct, threading, weakref, multiprocessing
 import qrcode
+from png_writer import encode_png, iter_png
+from tiff_writer import iter_tiff
+from truetype import TrueTypeFont, cmap_mapping
+from pdf_writer import PdfDocument
+
+# ------------------------------
+# 有界 LRU 缓存
+# ------------------------------
+class LRUCache:
+    """线程安全的有界 LRU，带命中/未命中计数；给出 maxbytes 与 sizeof（值 -> 字节数）时同时按字节预算淘汰"""
+    def __init__(self,maxsize=256,maxbytes=None,sizeof=None):
+        self.maxsize=maxsize
+        self.maxbytes=maxbytes
+        self.sizeof=sizeof
+        self.bytes=0
+        self.hits=0
+        self.misses=0
+        self._data=OrderedDict()
+        self._lock=threading.Lock()
+    def get(self,key,default=None):
+        with self._lock:
+            value=self._data.get(key,_MISSING)
+            if value is _MISSING:
+                self.misses+=1
+                return default
+            self._data.move_to_end(key)
+            self.hits+=1
+            return value
+    def put(self,key,value):
+        with self._lock:
+            old=self._data.pop(key,_MISSING)
+            if self.sizeof is not None:
+                if old is not _MISSING: self.bytes-=self.sizeof(old)
+                self.bytes+=self.sizeof(value)
+            self._data[key]=value
+            while self._data and (len(self._data)>self.maxsize or (self.maxbytes is not None and self.bytes>self.maxbytes)):
+                _,evicted=self._data.popitem(last=False)
+                if self.sizeof is not None: self.bytes-=self.sizeof(evicted)
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes=0
+            self.hits=self.misses=0
+    def __len__(self): return len(self._data)
+    def stats(self):
+        total=self.hits+self.misses
+        stats={"size":len(self._data),"maxsize":self.maxsize,"hits":self.hits,"misses":self.misses,
+               "hit_rate":round(self.hits/total,4) if total else 0.0}
+        if self.maxbytes is not None: stats.update(bytes=self.bytes,maxbytes=self.maxbytes)
+        return stats
+
+_MISSING=object()
 
 # ------------------------------
 # 字体加载
 # ------------------------------
-def load_font(font_path, size):
+# 字体注册表：FreeTypeFont 实例按 (路径, 字号, index) 放入有界 LRU，按路径加载（FreeType 自行读文件，
+# 不在每个实例里各复制一份字体字节）；每个 font_path 最终命中的候选路径记在 _FONT_RESOLVED，之后不再探测文件系统；
+# 只有 cmap 覆盖、PDF 子集和字体资源需要原始字节，由 _font_bytes 读一次进 _FONT_BYTES
+FONT_CACHE_SIZE=128
+_FONT_BYTES={}
+_FONT_CACHE=OrderedDict()
+_FONT_RESOLVED={}
+_FONT_ORIGIN=weakref.WeakKeyDictionary()  # 字体实例 -> (字体文件, index)，换字号时使用
+_FONT_LOCK=threading.Lock()
+_DEFAULT_FONT=None
+
+def _font_candidates(font_path):
     base_path = getattr(sys, '_MEIPASS', os.path.dirname(__file__))
-    if font_path:
-        full_path = os.path.join(base_path, font_path)
-        if os.path.exists(full_path):
-            try: return ImageFont.truetype(full_path, size)
-            except: pass
+    if font_path: yield os.path.join(base_path, font_path)
     project_fonts = [
         os.path.join(base_path, "fonts", "TrainTicketFont2.ttf"),
         os.path.join(base_path, "fonts", "simsun.ttc"),
@@ -20,37 +81,326 @@ def load_font(font_path, size):
         os.path.join(base_path, "fonts", "timesbd.ttf"),
         os.path.join(base_path, "fonts", "方正黑体简体.ttf")
     ]
-    for p in project_fonts:
-        if os.path.exists(p):
-            try: return ImageFont.truetype(p, size)
-            except: continue
+    for p in project_fonts: yield p
     system_fonts = [r"C:\Windows\Fonts\simhei.ttf", r"C:\Windows\Fonts\times.ttf"]
-    for p in system_fonts:
+    for p in system_fonts: yield p
+
+def _font_bytes(full_path):
+    data=_FONT_BYTES.get(full_path)
+    if data is None:
+        with open(full_path,'rb') as f: data=f.read()
+        _FONT_BYTES[full_path]=data
+    return data
+
+def _truetype(full_path, size, index=0):
+    key=(full_path,size,index)
+    with _FONT_LOCK:
+        font=_FONT_CACHE.get(key)
+        if font is not None:
+            _FONT_CACHE.move_to_end(key)
+            return font
+    font=ImageFont.truetype(full_path, size, index=index)
+    with _FONT_LOCK:
+        _FONT_CACHE[key]=font
+        _FONT_ORIGIN[font]=(full_path,index)
+        while len(_FONT_CACHE)>FONT_CACHE_SIZE: _FONT_CACHE.popitem(last=False)
+    return font
+
+def _default_font():
+    global _DEFAULT_FONT
+    if _DEFAULT_FONT is None: _DEFAULT_FONT=ImageFont.load_default()
+    return _DEFAULT_FONT
+
+def load_font(font_path, size, index=0):
+    resolved=_FONT_RESOLVED.get((font_path,index),False)
+    if resolved is None: return _default_font()
+    if resolved:
+        try: return _truetype(resolved, size, index)
+        except: pass
+    for p in _font_candidates(font_path):
         if os.path.exists(p):
-            try: return ImageFont.truetype(p, size)
+            try: font=_truetype(p, size, index)
             except: continue
-    return ImageFont.load_default()
+            _FONT_RESOLVED[(font_path,index)]=p
+            return font
+    _FONT_RESOLVED[(font_path,index)]=None
+    return _default_font()
+
+def font_variant(font, size):
+    """同一字体文件的另一字号（经字体注册表缓存）；不是由注册表加载的字体原样返回"""
+    origin=_FONT_ORIGIN.get(font)
+    if origin is None or size==font.size: return font
+    return _truetype(origin[0], size, origin[1])
+
+# ------------------------------
+# 字符覆盖（cmap）与逐字回退
+# ------------------------------
+# 主字体缺字时依次尝试：模板段落声明的 fallback_fonts，再到下列默认字体（同字号）
+DEFAULT_FALLBACK_FONTS=("fonts/仿宋_GB2312.ttf","fonts/方正黑体简体.ttf","fonts/STXINWEI.ttf","fonts/arial.ttf","fonts/times.ttf")
+_COVERAGE={}  # (字体文件, index) -> frozenset(码位)，每个字体文件只解析一次
+
+def _cmap_codepoints(data,index=0):
+    """映射到非空字形的 Unicode 码位集合（cmap 解析见 truetype.cmap_mapping，含 TTC）"""
+    return frozenset(cmap_mapping(data,index))
+
+def font_coverage(full_path,index=0):
+    key=(full_path,index)
+    codes=_COVERAGE.get(key)
+    if codes is None:
+        try: codes=_cmap_codepoints(_font_bytes(full_path),index)
+        except (OSError,struct.error): codes=frozenset()
+        _COVERAGE[key]=codes
+    return codes
+
+def font_covers(font,ch):
+    """字体是否含该字符的字形；非注册表字体无法判定，按覆盖处理"""
+    origin=_FONT_ORIGIN.get(font)
+    return origin is None or ord(ch) in font_coverage(*origin)
+
+def resolve_fallbacks(font,font_paths=()):
+    """编译期确定回退链：返回 ((字体文件, index), ...)，去掉找不到的文件和与主字体相同的文件"""
+    primary=_FONT_ORIGIN.get(font)
+    if primary is None: return ()
+    base_path=getattr(sys,'_MEIPASS',os.path.dirname(__file__))
+    out=[]
+    for p in tuple(font_paths)+DEFAULT_FALLBACK_FONTS:
+        full=os.path.join(base_path,p)
+        origin=(full,0)
+        if origin!=primary and origin not in out and os.path.exists(full): out.append(origin)
+    return tuple(out)
+
+_CHAR_FONTS=LRUCache(16384)
+
+def font_for_char(font,fallbacks,ch):
+    """字符应使用的字体：主字体 -> 回退链中第一个覆盖该字符的字体（同字号）；都不覆盖时返回 None"""
+    key=(font,fallbacks,ch)
+    choice=_CHAR_FONTS.get(key,_MISSING)
+    if choice is _MISSING:
+        choice=font if font_covers(font,ch) else None
+        if choice is None:
+            for path,index in fallbacks:
+                if ord(ch) in font_coverage(path,index):
+                    choice=_truetype(path,font.size,index)
+                    break
+        _CHAR_FONTS.put(key,choice)
+    return choice
+
+def clear_font_cache():
+    with _FONT_LOCK:
+        _FONT_CACHE.clear()
+        _FONT_BYTES.clear()
+        _FONT_RESOLVED.clear()
+
+# ------------------------------
+# 字形缓存
+# ------------------------------
+# 字宽按字体实例分表（弱引用，字体被 LRU 淘汰后随之释放）：_ADVANCES[font][ch] -> 字宽
+# 字形掩码全进程共用一张 LRU：_GLYPHS[(字体键, ch, 1/64 像素小数偏移)] -> (L 掩码, 原点偏移)；
+# 注册表字体的字体键为 (字体文件, index, 字号)，同一字体的不同实例（各计划、回退、缩字号）共用条目；
+# 条数与掩码总字节数只有一份预算：打印导出的大字号字形单个可达数十 KB，按字体分表时总量随字体数成倍增长
+GLYPH_CACHE_SIZE=32768
+GLYPH_CACHE_BYTES=64*1024*1024
+_ADVANCES=weakref.WeakKeyDictionary()
+# 同一 FreeType 字体对象不能被多个线程同时使用：缓存未命中时的测宽/光栅化按字体实例加锁，不同字体之间互不等待
+_FONT_LOCKS=weakref.WeakKeyDictionary()
+
+def _font_lock(font):
+    lock=_FONT_LOCKS.get(font)
+    if lock is None:
+        with _FONT_LOCK: lock=_FONT_LOCKS.setdefault(font,threading.Lock())
+    return lock
+
+def _font_table(tables,font):
+    table=tables.get(font)
+    if table is None:
+        table={}
+        tables[font]=table
+    elif len(table)>=GLYPH_CACHE_SIZE:
+        table.clear()
+    return table
+
+def _mask_bytes(mask): return mask.width*mask.height*len(mask.getbands())
+
+_GLYPHS=LRUCache(GLYPH_CACHE_SIZE,GLYPH_CACHE_BYTES,lambda entry:_mask_bytes(entry[0]))
+
+def _font_key(font):
+    """字形缓存中的字体键：注册表字体按 (字体文件, index, 字号)，其余按实例本身"""
+    origin=_FONT_ORIGIN.get(font)
+    return font if origin is None else (origin[0],origin[1],font.size)
+
+def glyph_advance(font,ch):
+    table=_font_table(_ADVANCES,font)
+    w=table.get(ch)
+    if w is None:
+        with _font_lock(font): w=font.getlength(ch)
+        table[ch]=w
+    return w
+
+def glyph_mask(font,ch,fx=0.0,fy=0.0):
+    """字符在小数偏移 (fx, fy) 处的光栅化掩码，与 draw.text 在同一位置绘制的结果逐像素一致；
+    返回 (mask, ox, oy)，贴到 (int(x)-ox, int(y)-oy)"""
+    key=(_font_key(font),ch,int(fx*64+0.5),int(fy*64+0.5))
+    entry=_GLYPHS.get(key)
+    if entry is None:
+        with _font_lock(font):
+            l,t,r,b=font.getbbox(ch)
+            ox=max(0,-l)+1;oy=max(0,-t)+1
+            mask=Image.new('L',(ox+max(r,0)+2,oy+max(b,0)+2),0)
+            ImageDraw.Draw(mask).text((ox+fx,oy+fy),ch,font=font,fill=255)
+        entry=(mask,ox,oy)
+        _GLYPHS.put(key,entry)
+    return entry
+
+# 横向压缩字形串：整串按未压缩坐标光栅化一次、整体缩放一次，按 (字体, 文本, scale_x, 字距) 缓存 L 掩码，按掩码字节数设预算
+SCALED_RUN_CACHE_BYTES=16*1024*1024
+_SCALED_RUNS=LRUCache(1024,SCALED_RUN_CACHE_BYTES,_mask_bytes)
+
+def scaled_run_mask(font,text,scale_x,letter_spacing=0):
+    """压缩后的整串掩码，左上角对齐到字形串的整数起点；字距按压缩后的像素计"""
+    key=(font,text,scale_x,letter_spacing)
+    mask=_SCALED_RUNS.get(key)
+    if mask is None:
+        spacing=letter_spacing/scale_x
+        advances=[glyph_advance(font,c) for c in text]
+        width=sum(advances)+spacing*(len(text)-1)
+        with _font_lock(font):
+            ascent,descent=font.getmetrics()
+            mask=Image.new('L',(int(math.ceil(max(width,0)))+4,max(font.size,ascent+descent)+4),0)
+            dr=ImageDraw.Draw(mask)
+            x=0
+            for c,adv in zip(text,advances):
+                dr.text((x,0),c,font=font,fill=255)
+                x+=adv+spacing
+        mask=mask.resize((max(int(mask.width*scale_x),1),mask.height),resample=Image.BICUBIC)
+        _SCALED_RUNS.put(key,mask)
+    return mask
 
 # ------------------------------
 # 绘制文本
 # ------------------------------
+# 定位后的字形串：左上角 (x, y)，width 为含字距、横向压缩后的总宽
+GlyphRun=namedtuple('GlyphRun','text font fill x y letter_spacing scale_x width')
+_RUN_WIDTHS=LRUCache(8192)
+
+def run_width(font, text, letter_spacing=0, scale_x=1.0):
+    """字形串总宽（按文本与样式缓存）；空串为 -letter_spacing，与历史排版保持一致"""
+    key=(font, text, letter_spacing, scale_x)
+    w=_RUN_WIDTHS.get(key)
+    if w is None:
+        w=sum(glyph_advance(font, c) * scale_x + letter_spacing for c in text) - letter_spacing
+        _RUN_WIDTHS.put(key, w)
+    return w
+
+# 贴图指令：base.paste(fill, xy, mask)，按顺序执行与直接绘制逐像素一致
+Stamp=namedtuple('Stamp','fill xy mask')
+
+def run_stamps(run):
+    """把字形串展开为贴图指令（掩码来自字形缓存）；有字落在负坐标等无法走缓存的情况返回 None"""
+    x, y, font = run.x, run.y, run.font
+    if run.scale_x != 1.0:
+        if not run.text: return []
+        return [Stamp(run.fill, (int(x), int(y)), scaled_run_mask(font, run.text, run.scale_x, run.letter_spacing))]
+    if not isinstance(font, ImageFont.FreeTypeFont): return None
+    stamps = []
+    for char in run.text:
+        if x < 0 or y < 0: return None
+        mask, ox, oy = glyph_mask(font, char, x % 1, y % 1)
+        stamps.append(Stamp(run.fill, (int(x) - ox, int(y) - oy), mask))
+        x += glyph_advance(font, char) + run.letter_spacing
+    return stamps
+
+# ------------------------------
+# 按宽度缩小字号
+# ------------------------------
+# 只用字宽表测量（getlength 不产生位图），结果按 (字体, 文本, 宽度上限, 字距, 横向压缩) 缓存
+FIT_MIN_SIZE=8
+_FITTED=LRUCache(4096)
+
+def fit_font(font, text, max_width, letter_spacing=0, scale_x=1.0, min_size=FIT_MIN_SIZE, fallbacks=()):
+    """字形串宽度超过 max_width 时返回能放下的最大字号（不小于 min_size），否则返回原字体；
+    fallbacks 为回退链（见 resolve_fallbacks），缺字部分按回退字体的字宽计"""
+    if not text or not max_width: return font
+    key=(font, text, max_width, letter_spacing, scale_x, fallbacks)
+    fitted=_FITTED.get(key)
+    if fitted is None:
+        fitted=font
+        width=chain_width(font, fallbacks, text, letter_spacing, scale_x)
+        if width>max_width and font.size>min_size:
+            # 字宽近似与字号成正比，先按比例估算；字形度量随字号并非严格线性，估算可能偏大也可能偏小，
+            # 再逐号校正：能放下就往大试，放不下就往小退（通常 0~1 次）
+            fits=lambda f: chain_width(f, fallbacks, text, letter_spacing, scale_x)<=max_width
+            spacing=letter_spacing*(len(text)-1)
+            glyphs=width-spacing
+            size=font.size-1
+            if glyphs>0: size=min(size, int(font.size*(max_width-spacing)/glyphs))
+            fitted=font_variant(font, max(size, min_size))
+            while fitted.size+1<font.size:
+                larger=font_variant(fitted, fitted.size+1)
+                if larger is fitted or not fits(larger): break
+                fitted=larger
+            while fitted.size>min_size and not fits(fitted):
+                smaller=font_variant(fitted, fitted.size-1)
+                if smaller is fitted: break
+                fitted=smaller
+        _FITTED.put(key, fitted)
+    return fitted
+
+def baseline_shift(font, fitted):
+    """换字号或换回退字体后保持基线不变所需的纵向偏移"""
+    return 0 if fitted is font else font.getmetrics()[0]-fitted.getmetrics()[0]
+
+# ------------------------------
+# 按字体切分字形串（逐字回退）
+# ------------------------------
+_FONT_PARTS=LRUCache(8192)
+
+def font_parts(font, fallbacks, text):
+    """把文本切成 ((字体, 子串), ...)，相邻同字体的字符合并；没有任何字体覆盖的字符留在主字体"""
+    if not fallbacks or not text: return ((font, text),)
+    key=(font, fallbacks, text)
+    parts=_FONT_PARTS.get(key)
+    if parts is None:
+        parts=[]
+        for ch in text:
+            f=font_for_char(font, fallbacks, ch) or font
+            if parts and parts[-1][0] is f: parts[-1][1].append(ch)
+            else: parts.append((f, [ch]))
+        parts=tuple((f, ''.join(chars)) for f, chars in parts)
+        _FONT_PARTS.put(key, parts)
+    return parts
+
+def chain_width(font, fallbacks, text, letter_spacing=0, scale_x=1.0):
+    parts=font_parts(font, fallbacks, text)
+    return sum(run_width(f, t, letter_spacing, scale_x) for f, t in parts)+letter_spacing*(len(parts)-1)
+
+def chain_runs(base_font, font, fallbacks, text, fill, x, y, letter_spacing=0, scale_x=1.0):
+    """按字体切分后的字形串序列；base_font 为模板原字体，用于对齐基线"""
+    runs=[]
+    for f, part in font_parts(font, fallbacks, text):
+        w=run_width(f, part, letter_spacing, scale_x)
+        runs.append(GlyphRun(part, f, fill, x, y+baseline_shift(base_font, f), letter_spacing, scale_x, w))
+        x+=w+letter_spacing
+    return runs
+
+def paint_run(draw, run, base_image=None):
+    # 有底图时从字形缓存贴图，否则逐字交给 draw.text
+    stamps = run_stamps(run) if base_image is not None else None
+    if stamps is not None:
+        for stamp in stamps: base_image.paste(*stamp)
+        return
+    if run.scale_x != 1.0: return
+    x, y = run.x, run.y
+    for char in run.text:
+        draw.text((x, y), char, font=run.font, fill=run.fill)
+        x += glyph_advance(run.font, char) + run.letter_spacing
+
 def draw_text(draw, text, x, y, font, fill, anchor='la', letter_spacing=0, scale_x=1.0, base_image=None):
-    total_width = sum(font.getlength(c) * scale_x + letter_spacing for c in text) - letter_spacing
+    total_width = run_width(font, text, letter_spacing, scale_x)
     if anchor.startswith('r'):
         x -= total_width
     elif anchor.startswith('m'):
         x -= total_width / 2
-    for char in text:
-        w = font.getlength(char) * scale_x
-        if scale_x == 1.0:
-            draw.text((x, y), char, font=font, fill=fill)
-        else:
-            tmp = Image.new('RGBA', (int(font.getlength(char)) + 4, font.size + 4), (0,0,0,0))
-            tmp_draw = ImageDraw.Draw(tmp)
-            tmp_draw.text((0,0), char, font=font, fill=fill)
-            tmp = tmp.resize((max(int(tmp.width*scale_x),1), tmp.height), resample=Image.BICUBIC)
-            if base_image: base_image.paste(tmp, (int(x), int(y)), tmp)
-        x += w + letter_spacing
+    paint_run(draw, GlyphRun(text, font, fill, x, y, letter_spacing, scale_x, total_width), base_image)
     return total_width, font.size
 
 # ------------------------------
@@ -70,13 +420,15 @@ def draw_dashed_rectangle(draw, xy, dash_length=5, fill='black', width=1):
 # ------------------------------
 # 半尖箭头
 # ------------------------------
-def draw_half_arrow(draw, xy, length=20, height=10, direction='right', fill='black'):
+def half_arrow_points(xy, length=20, height=10, direction='right'):
     x,y=xy
-    if direction=='right': points=[(x,y),(x+length,y-height/2),(x+length,y+height/2)]
-    elif direction=='left': points=[(x+length,y),(x,y-height/2),(x,y+height/2)]
-    elif direction=='up': points=[(x,y+length),(x-height/2,y),(x+height/2,y)]
-    elif direction=='down': points=[(x,y),(x-height/2,y+length),(x+height/2,y+length)]
-    draw.polygon(points, fill=fill)
+    if direction=='right': return [(x,y),(x+length,y-height/2),(x+length,y+height/2)]
+    if direction=='left': return [(x+length,y),(x,y-height/2),(x,y+height/2)]
+    if direction=='up': return [(x,y+length),(x-height/2,y),(x+height/2,y)]
+    if direction=='down': return [(x,y),(x-height/2,y+length),(x+height/2,y+length)]
+
+def draw_half_arrow(draw, xy, length=20, height=10, direction='right', fill='black'):
+    draw.polygon(half_arrow_points(xy,length,height,direction), fill=fill)
 
 # ------------------------------
 # 直线
@@ -86,45 +438,67 @@ def draw_line(draw,start,end,fill='black',width=1): draw.line([start,end],fill=f
 # ------------------------------
 # 带圈文字
 # ------------------------------
-def draw_multi_circle_text(draw, xy, text, font, fill="#000000", spacing=10, circle_radius=None, circle_fill=None, width=2):
-    if not text: return
-    x,y=xy
+def circle_text_layout(text, x, y, font, anchor='ma', spacing=10, circle_radius=None, fallbacks=()):
+    """逐字圆圈的排版：返回 [(字, 半径, 圆心 x, 圆心 y, 字体)]，anchor 以 l/m/r 开头决定水平对齐；
+    主字体缺字时按 fallbacks 逐字换字体"""
     char_data=[]
     for ch in text:
-        w=font.getlength(ch)
-        h=font.size
-        r=circle_radius or int(max(w,h)/2+4)
-        char_data.append((ch,r))
-    total_width=sum(2*r+spacing for _,r in char_data)-spacing
-    start_x=x-total_width/2
-    cx=start_x
-    for ch,r in char_data:
-        cx_center=cx+r; cy_center=y
-        draw.ellipse([cx_center-r, cy_center-r, cx_center+r, cy_center+r], outline=fill, fill=circle_fill, width=width)
-        w=font.getlength(ch)
-        draw.text((cx_center-w/2, cy_center-font.size/2), ch, font=font, fill=fill)
-        cx+=2*r+spacing
+        f=font_for_char(font,fallbacks,ch) or font if fallbacks else font
+        r=circle_radius or int(max(glyph_advance(f,ch),f.size)/2+4)
+        char_data.append((ch,r,f))
+    total_width=sum(2*r+spacing for _,r,_ in char_data)-spacing
+    if anchor.startswith("r"): x-=total_width
+    elif anchor.startswith("m"): x-=total_width/2
+    out=[]
+    for ch,r,f in char_data:
+        out.append((ch,r,x+r,y,f))
+        x+=2*r+spacing
+    return out
+
+def draw_multi_circle_text(draw, xy, text, font, fill="#000000", spacing=10, circle_radius=None, circle_fill=None, width=2, anchor='ma', fallbacks=()):
+    if not text: return
+    for ch,r,cx,cy,f in circle_text_layout(text, xy[0], xy[1], font, anchor, spacing, circle_radius, fallbacks):
+        draw.ellipse([cx-r, cy-r, cx+r, cy+r], outline=fill, fill=circle_fill, width=width)
+        draw.text((cx-glyph_advance(f,ch)/2, cy-f.size/2), ch, font=f, fill=fill)
 
 # ------------------------------
 # 条码占位
 # ------------------------------
+# 条码图案只由数据决定（摘要做种子，跨进程/重启稳定），按 (数据, 宽, 高) 缓存 L 掩码（255 为黑条），按掩码字节数设预算
+BARCODE_CACHE_BYTES=16*1024*1024
+_BARCODES=LRUCache(256,BARCODE_CACHE_BYTES,_mask_bytes)
+
+def barcode_mask(data,width,height):
+    key=(data,width,height)
+    mask=_BARCODES.get(key)
+    if mask is None:
+        seed=int.from_bytes(hashlib.sha256(str(data).encode('utf-8')).digest()[:4],'big')
+        rng=random.Random(seed)
+        row=bytearray(width)
+        x=0
+        while x<width:
+            wstripe=rng.randint(2,7)
+            if rng.random()<0.55:
+                row[x:x+wstripe+1]=b'\xff'*len(row[x:x+wstripe+1])
+            x+=wstripe
+        # 单行条纹一次性纵向拉伸到条码高度
+        mask=Image.frombytes('L',(width,1),bytes(row)).resize((width,height),resample=Image.NEAREST)
+        _BARCODES.put(key,mask)
+    return mask
+
 def make_barcode_placeholder(data,width,height):
     # Create transparent background and draw opaque black stripes
+    mask=barcode_mask(data,width,height)
     im=Image.new('RGBA',(width,height),(255,255,255,0))
-    dr=ImageDraw.Draw(im)
-    rng=random.Random(hash(data)&0xffffffff)
-    x=0
-    while x<width:
-        wstripe=rng.randint(2,7)
-        if rng.random()<0.55:
-            dr.rectangle([x,0,x+wstripe,height], fill=(0,0,0,255))
-        # else leave transparent
-        x+=wstripe
+    im.paste((0,0,0,255),(0,0),mask)
     return im
 
 # ------------------------------
 # 二维码
 # ------------------------------
+# 二维码内容读取的用户字段（encode_ticket_data），任一字段变化二维码随之变化
+QR_DATA_KEYS=frozenset(("字母","票号","年","月","日","类型","车次号","车厢号","席位号","普通序号","其它证件标识符","身份证号1","身份证号2","姓名","时","分"))
+
 def encode_ticket_data(user_data: dict) -> str:
     s=""
     letter=user_data.get("字母"," ").ljust(1)
@@ -150,18 +524,91 @@ def encode_ticket_data(user_data: dict) -> str:
     s+=user_data.get("分","").rjust(2)
     return s
 
-def make_qr_from_number_string(data_str:str,size_px:int=280):
-    qr=qrcode.QRCode(version=1,error_correction=qrcode.constants.ERROR_CORRECT_L,box_size=6,border=0)
-    qr.add_data(data_str)
+# ------------------------------
+# 二维码分段编码：数字/字母数字/字节模式按最少比特切分，版本由 qrcode 自动取最小
+# ------------------------------
+_QR_MODES=(qrcode.util.MODE_NUMBER,qrcode.util.MODE_ALPHA_NUM,qrcode.util.MODE_8BIT_BYTE)
+_QR_DIGITS=frozenset("0123456789")
+_QR_ALNUM=frozenset(qrcode.util.ALPHA_NUM.decode('ascii'))
+
+def qr_data_segments(data_str:str,version:int=1):
+    """按给定版本的字符计数位长，求总比特数最少的模式切分，返回 [(mode, text), ...]"""
+    if not data_str: return [(qrcode.util.MODE_8BIT_BYTE,data_str)]
+    INF=float('inf')
+    # 代价以 1/6 比特为单位：数字 10/3、字母数字 11/2、字节 8 比特/字节
+    head=[(4+qrcode.util.length_in_bits(m,version))*6 for m in _QR_MODES]
+    costs=list(head)
+    char_modes=[]
+    for ch in data_str:
+        cur=[INF,INF,costs[2]+48*len(ch.encode('utf-8'))]
+        if ch in _QR_DIGITS: cur[0]=costs[0]+20
+        if ch in _QR_ALNUM: cur[1]=costs[1]+33
+        # 当前字符以 k 模式结尾后，可在下一个字符前切换到 j 模式
+        nxt=list(cur);came=[j if cur[j]<INF else None for j in range(3)]
+        for j in range(3):
+            for k in range(3):
+                if cur[k]==INF: continue
+                c=(cur[k]+5)//6*6+head[j]
+                if c<nxt[j]: nxt[j]=c;came[j]=k
+        char_modes.append(came)
+        costs=nxt
+    mode=min(range(3),key=lambda j:costs[j])
+    per_char=[0]*len(data_str)
+    for i in range(len(data_str)-1,-1,-1):
+        mode=char_modes[i][mode]
+        per_char[i]=mode
+    segments=[]
+    start=0
+    for i in range(1,len(data_str)+1):
+        if i==len(data_str) or per_char[i]!=per_char[start]:
+            segments.append((_QR_MODES[per_char[start]],data_str[start:i]))
+            start=i
+    return segments
+
+def _build_qr(data_str,version_hint):
+    qr=qrcode.QRCode(version=None,error_correction=qrcode.constants.ERROR_CORRECT_L,box_size=1,border=0)
+    for mode,text in qr_data_segments(data_str,version_hint):
+        qr.add_data(qrcode.util.QRData(text,mode=mode))
     qr.make(fit=True)
-    qr_img=qr.make_image(fill_color="black", back_color="white").convert("RGBA")
-    datas=qr_img.getdata()
-    new_data=[]
-    for px in datas:
-        if px[0]>200 and px[1]>200 and px[2]>200: new_data.append((255,255,255,0))
-        else: new_data.append(px)
-    qr_img.putdata(new_data)
-    if qr_img.width!=size_px or qr_img.height!=size_px: qr_img=qr_img.resize((size_px,size_px), resample=Image.NEAREST)
+    return qr
+
+# 二维码符号按编码串缓存；modules 为每模块一个像素的 L 图（255 为黑模块），重复预览跳过纠错编码
+QrSymbol=namedtuple('QrSymbol','modules version module_count segments')
+_QR_SYMBOLS=LRUCache(256)
+
+def qr_symbol(data_str:str):
+    sym=_QR_SYMBOLS.get(data_str)
+    if sym is None:
+        qr=_build_qr(data_str,1)
+        # 字符计数位长随版本分档（1-9/10-26/27-40），跨档时按实际版本重新切分
+        if qrcode.util.mode_sizes_for_version(qr.version) is not qrcode.util.mode_sizes_for_version(1):
+            qr=_build_qr(data_str,qr.version)
+        matrix=qr.get_matrix()
+        n=len(matrix)
+        img=Image.frombytes('L',(n,n),bytes(255 if v else 0 for row in matrix for v in row))
+        segments=tuple((mode,len(text)) for mode,text in qr_data_segments(data_str,qr.version))
+        sym=QrSymbol(img,qr.version,n,segments)
+        _QR_SYMBOLS.put(data_str,sym)
+    return sym
+
+def qr_info(data_str:str):
+    """二维码版本、边长模块数与分段情况"""
+    sym=qr_symbol(data_str)
+    names={qrcode.util.MODE_NUMBER:"numeric",qrcode.util.MODE_ALPHA_NUM:"alphanumeric",qrcode.util.MODE_8BIT_BYTE:"byte"}
+    return {"version":sym.version,"modules":sym.module_count,"segments":[(names[m],n) for m,n in sym.segments]}
+
+def qr_modules(data_str:str):
+    return qr_symbol(data_str).modules
+
+def qr_mask(data_str:str,size_px:int=280):
+    """size_px 见方的二维码掩码（L，255 为黑模块），模块矩阵直接按最近邻放大"""
+    modules=qr_modules(data_str)
+    return modules.resize((size_px,size_px), resample=Image.NEAREST)
+
+def make_qr_from_number_string(data_str:str,size_px:int=280):
+    mask=qr_mask(data_str,size_px)
+    qr_img=Image.new('RGBA',mask.size,(255,255,255,0))
+    qr_img.paste((0,0,0,255),(0,0),mask)
     return qr_img
 
 # ------------------------------
@@ -183,160 +630,1237 @@ def flatten_user_data(user_data):
             flat[k]=v
     return flat
 
+
 # ------------------------------
-# 渲染票
+# 用户取值
 # ------------------------------
-def render_ticket(user_data, template_json_path, template_dir, apply_template=False):
-    flat=flatten_user_data(user_data)
-    normalized={str(k).strip():("" if v is None else str(v)) for k,v in flat.items()}
-    fmt_map=SafeDict(normalized)
-    def get_val(k):
-        if k in flat and flat[k] is not None: return str(flat[k])
-        ks=str(k).strip()
-        return normalized.get(ks,"")
-    with open(template_json_path,'r',encoding='utf-8') as f: cfg=json.load(f)
-    bg_path=os.path.join(template_dir,cfg['canvas']['background'])
-    base=Image.open(bg_path).convert('RGB')
-    dr=ImageDraw.Draw(base)
+class UserValues:
+    """一次渲染的用户数据视图：扁平化、规范化后的取值与格式化映射"""
+    def __init__(self,user_data):
+        self.flat=flatten_user_data(user_data)
+        self.normalized={str(k).strip():("" if v is None else str(v)) for k,v in self.flat.items()}
+        self.fmt_map=SafeDict(self.normalized)
+    def get(self,k):
+        if k in self.flat and self.flat[k] is not None: return str(self.flat[k])
+        return self.normalized.get(str(k).strip(),"")
+
+# ------------------------------
+# 模板缩放（低分辨率预览 / 高分辨率输出）
+# ------------------------------
+SCALE_STEP=0.05
+# 字段/段落上的几何参数及取整方式：int 为取整坐标，size 为至少 1 的整数尺寸，float 保留小数
+_FIELD_GEOMETRY={'x':'int','y':'int','size':'size','width':'size','height':'size','length':'size','dash_length':'size',
+                 'radius':'size','letter_spacing':'float','spacing':'float','max_width':'float'}
+_SEGMENT_GEOMETRY={'size':'size','letter_spacing':'float','y_offset':'float','max_width':'float'}
+
+def _scale_value(v,kind,scale):
+    if not isinstance(v,(int,float)) or isinstance(v,bool): return v
+    if kind=='float': return v*scale
+    if kind=='size': return max(round(v*scale),1) if v>0 else v
+    return round(v*scale)
+
+def scale_template(cfg,scale):
+    """返回几何量按 scale 缩放后的模板副本；scale == 1 时原样返回"""
+    if scale==1.0: return cfg
+    out=dict(cfg)
+    canvas=dict(cfg.get('canvas',{}))
+    for k in ('width','height'):
+        if k in canvas: canvas[k]=_scale_value(canvas[k],'size',scale)
+    out['canvas']=canvas
+    out['apply_$scale']=float(cfg.get('apply_$scale',1.0))*scale
+    out['arrow_scale']=float(cfg.get('arrow_scale',1.0))*scale
+    for k in ('arrow_x','arrow_y'):
+        if k in cfg: out[k]=_scale_value(cfg[k],'int',scale)
+    fields={}
+    for key,spec in cfg.get('fields',{}).items():
+        spec=dict(spec)
+        for k,kind in _FIELD_GEOMETRY.items():
+            if k in spec: spec[k]=_scale_value(spec[k],kind,scale)
+        for k in ('xy','start','end'):
+            if k in spec: spec[k]=[_scale_value(v,'int',scale) for v in spec[k]]
+        if 'segments' in spec:
+            segments=[]
+            for seg in spec['segments']:
+                seg=dict(seg)
+                for k,kind in _SEGMENT_GEOMETRY.items():
+                    if k in seg: seg[k]=_scale_value(seg[k],kind,scale)
+                segments.append(seg)
+            spec['segments']=segments
+        fields[key]=spec
+    out['fields']=fields
+    return out
+
+def normalize_scale(scale):
+    """把缩放系数向下量化到 SCALE_STEP（最小一档），避免任意取值撑大计划/背景缓存"""
+    scale=float(scale)
+    if scale<=0: raise ValueError("scale 必须大于 0")
+    steps=max(math.floor(scale/SCALE_STEP+1e-9),1)
+    return round(steps*SCALE_STEP,4)
+
+# ------------------------------
+# 渲染计划（模板编译结果，不可变）
+# ------------------------------
+RenderPlan=namedtuple('RenderPlan','path content_hash width height background static_ops ops scale')
+LineOp=namedtuple('LineOp','start end fill width')
+DashedRectOp=namedtuple('DashedRectOp','xy dash_length fill width')
+ArrowOp=namedtuple('ArrowOp','xy length height direction fill')
+OverlayOp=namedtuple('OverlayOp','image xy source')  # source: (图片文件, (mtime_ns, size), 缩放)，资源登记按它寻址
+CircleTextOp=namedtuple('CircleTextOp','key font fill circle_fill spacing radius width x y anchor fallback fallbacks',defaults=((),))
+QrOp=namedtuple('QrOp','key x y size')
+BarcodeOp=namedtuple('BarcodeOp','key x y width height')
+TextOp=namedtuple('TextOp','key font x y fill anchor letter_spacing max_width fallbacks',defaults=(None,()))
+SegmentsOp=namedtuple('SegmentsOp','key x y anchor segments max_width',defaults=(None,))
+Segment=namedtuple('Segment','text tokens font fill letter_spacing scale_x y_offset repeat_char repeat_count_key max_width fallbacks',defaults=(None,()))
+
+def tokenize_format(text):
+    """把 '{字段}' 格式串预拆分为 ((字面量, 字段名或None), ...)；遇到无法等价展开的写法返回 None"""
+    tokens=[]
+    try: parsed=list(string.Formatter().parse(text))
+    except ValueError: return None
+    for literal,name,spec,conv in parsed:
+        if literal: tokens.append((literal,None))
+        if name is None: continue
+        if not name or spec or conv or '.' in name or '[' in name: return None
+        tokens.append(("",name))
+    return tuple(tokens)
+
+def format_tokens(seg,fmt_map):
+    if seg.tokens is None: return seg.text.format_map(fmt_map)
+    return ''.join(fmt_map[name] if name is not None else literal for literal,name in seg.tokens)
+
+def _compile_overlay(path,scale,xy):
+    if not os.path.exists(path): return None
+    st=os.stat(path)
+    img=Image.open(path).convert('RGBA')
+    if scale!=1.0:
+        img=img.resize((max(int(img.width*scale),1),max(int(img.height*scale),1)), resample=Image.BICUBIC)
+    return OverlayOp(img,xy,(path,(st.st_mtime_ns,st.st_size),scale))
+
+def _compile_segment(seg):
+    text=seg["text"]
+    font=load_font(seg.get("font_path",None),seg.get("size",24))
+    return Segment(text,tokenize_format(text),font,
+                   seg.get("fill","#000000"),seg.get("letter_spacing",0),seg.get("scale_x",1.0),seg.get("y_offset",0),
+                   seg.get("repeat_char"),seg.get("repeat_count_key"),seg.get("max_width"),resolve_fallbacks(font,seg.get("fallback_fonts",())))
+
+def _compile_field(key,spec):
+    t=spec.get("type")
+    if t=="dashed_rect": return DashedRectOp(tuple(spec["xy"]),spec.get("dash_length",5),spec.get("fill","#000000"),spec.get("width",1))
+    if t=="arrow": return ArrowOp((spec["x"],spec["y"]),spec.get("length",20),spec.get("height",10),spec.get("direction","right"),spec.get("fill","#000000"))
+    if t=="line": return LineOp(tuple(spec["start"]),tuple(spec["end"]),spec.get("fill","#000000"),spec.get("width",1))
+    if t=="circle_text":
+        font=load_font(spec.get("font_path"),spec.get("size",50))
+        return CircleTextOp("票种",font,spec.get("fill","#000000"),spec.get("fill_circle",None),
+                            spec.get("spacing",10),spec.get("radius",None),spec.get("width",3),spec["x"],spec["y"],spec.get("anchor","ma"),None,
+                            resolve_fallbacks(font,spec.get("fallback_fonts",())))
+    if key=='二维码': return QrOp(key,spec["x"],spec["y"],spec.get("size",280))
+    if key=='条码': return BarcodeOp(key,spec["x"],spec["y"],spec["width"],spec["height"])
+    if "segments" in spec:
+        op=SegmentsOp(key,spec["x"],spec["y"],spec.get("anchor","la"),tuple(_compile_segment(s) for s in spec["segments"]),spec.get("max_width"))
+    else:
+        font=load_font(spec.get("font_path"),spec.get("size",24))
+        op=TextOp(key,font,spec["x"],spec["y"],spec.get("fill","#000000"),spec.get("anchor","la"),
+                  spec.get("letter_spacing",0),spec.get("max_width"),resolve_fallbacks(font,spec.get("fallback_fonts",())))
+    # 兼容模板未显式声明 circle_text 的情况：对“车票类型/票种”强制按带圈文字渲染，票种为空时退回普通字段
+    if key in ("车票类型","票种"):
+        font_path=spec.get("font_path")
+        size=spec.get("size")
+        fill_color=spec.get("fill","#000000")
+        spacing=spec.get("spacing")
+        if (not font_path or not size or spacing is None) and "segments" in spec and spec["segments"]:
+            seg0=spec["segments"][0]
+            font_path=font_path or seg0.get("font_path")
+            size=size or seg0.get("size",50)
+            if spacing is None: spacing=seg0.get("letter_spacing",10)
+            if fill_color=="#000000": fill_color=seg0.get("fill","#000000")
+        if spacing is None: spacing=10
+        font=load_font(font_path,size or 50)
+        return CircleTextOp("票种",font,fill_color,spec.get("fill_circle",None),spacing,
+                            spec.get("radius",None),spec.get("width",3),spec["x"],spec["y"],spec.get("anchor","ma"),op,
+                            resolve_fallbacks(font,spec.get("fallback_fonts",())))
+    return op
+
+def _segment_is_static(seg):
+    if seg.tokens is None or (seg.repeat_char is not None and seg.repeat_count_key): return False
+    if any(name is not None for _,name in seg.tokens): return False
+    raw=''.join(literal for literal,_ in seg.tokens)
+    return not (raw and set(raw)=={"*"})
+
+def _segment_font(seg,text):
+    return fit_font(seg.font,text,seg.max_width,seg.letter_spacing,seg.scale_x,fallbacks=seg.fallbacks) if seg.max_width else seg.font
+
+def _segments_width(segs):
+    return sum(chain_width(_segment_font(seg,seg.text),seg.fallbacks,seg.text,seg.letter_spacing,seg.scale_x) for seg in segs)
 
-    apply_template=cfg.get('apply_$',False)
-    if apply_template:
-        t_img_path="templates/1234.png"
-        if os.path.exists(t_img_path):
-            t_img=Image.open(t_img_path).convert("RGBA")
-            scale=float(cfg.get('apply_$scale',1.0))
-            if scale!=1.0:
-                t_img=t_img.resize((max(int(t_img.width*scale),1),max(int(t_img.height*scale),1)), resample=Image.BICUBIC)
-            base.paste(t_img,(90,460),t_img)
+def _split_static(op):
+    """拆出与用户数据无关的部分：(静态 op 或 None, 动态 op 或 None)"""
+    if isinstance(op,(LineOp,DashedRectOp,ArrowOp,OverlayOp)): return op,None
+    if not isinstance(op,SegmentsOp): return None,op
+    n=0
+    while n<len(op.segments) and _segment_is_static(op.segments[n]): n+=1
+    if n==len(op.segments): return op,None
+    # 居中/右对齐或整段限宽时，字面量段的位置/字号取决于动态段，只能整段动态绘制
+    if n==0 or op.anchor.startswith(('r','m')) or op.max_width: return None,op
+    prefix,rest=op.segments[:n],op.segments[n:]
+    return op._replace(segments=prefix),op._replace(x=op.x+_segments_width(prefix),segments=rest)
 
+def compile_template(cfg,template_dir,content_hash=None,path=None,scale=1.0):
+    """把模板 JSON（已解析的 dict）编译为渲染计划：字体、格式串、叠加图与绘制顺序全部预先确定；
+    与用户数据无关的绘制（线条、虚线框、箭头、叠加图、纯字面量文本）归入 static_ops，预先合成到底图。
+    scale != 1 时先把模板几何整体缩放（坐标、字号、字距、二维码/条码尺寸、线宽）"""
+    cfg=scale_template(cfg,scale)
+    ops=[]
+    if cfg.get('apply_$',False):
+        op=_compile_overlay(os.path.join(template_dir,"1234.png"),float(cfg.get('apply_$scale',1.0)),(round(90*scale),round(460*scale)))
+        if op: ops.append(op)
     # 可选渲染箭头图片（保持透明度）
     if cfg.get('apply_arrow', False):
-        arrow_path=os.path.join('templates','arrow.png')
-        if os.path.exists(arrow_path):
-            a_img=Image.open(arrow_path).convert('RGBA')
-            a_scale=float(cfg.get('arrow_scale',1.0))
-            if a_scale!=1.0:
-                a_img=a_img.resize((max(int(a_img.width*a_scale),1),max(int(a_img.height*a_scale),1)), resample=Image.BICUBIC)
-            ax=int(cfg.get('arrow_x',0)); ay=int(cfg.get('arrow_y',0))
-            base.paste(a_img,(ax,ay),a_img)
-
-    for key,spec in cfg['fields'].items():
-        t=spec.get("type")
-        if t=="dashed_rect": draw_dashed_rectangle(dr,spec["xy"],spec.get("dash_length",5),spec.get("fill","#000000"),spec.get("width",1)); continue
-        if t=="arrow": draw_half_arrow(dr,(spec["x"],spec["y"]),spec.get("length",20),spec.get("height",10),spec.get("direction","right"),spec.get("fill","#000000")); continue
-        if t=="line": draw_line(dr,spec["start"],spec["end"],fill=spec.get("fill","#000000"),width=spec.get("width",1)); continue
-        if t=="circle_text":
-            text=get_val("票种")
-            if not text: continue
-            font=load_font(spec.get("font_path"),spec.get("size",50))
-            fill_color=spec.get("fill","#000000")
-            circle_fill=spec.get("fill_circle",None)
-            spacing=spec.get("spacing",10)
-            circle_radius=spec.get("radius",None)
-            width=spec.get("width",3)
-            char_data=[]
-            for ch in text:
-                w=font.getlength(ch);h=font.size
-                r=circle_radius or int(max(w,h)/2+4)
-                char_data.append((ch,r))
-            total_width=sum(2*r+spacing for _,r in char_data)-spacing
-            x0,y0=spec["x"],spec["y"];anchor=spec.get("anchor","ma")
-            if anchor.startswith("r"): x0-=total_width
-            elif anchor.startswith("m"): x0-=total_width/2
-            cx=x0
-            for ch,r in char_data:
-                cx_center=cx+r;cy_center=y0
-                dr.ellipse([cx_center-r,cy_center-r,cx_center+r,cy_center+r],outline=fill_color,fill=circle_fill,width=width)
-                tw=font.getlength(ch);th=font.size
-                dr.text((cx_center-tw/2,cy_center-th/2),ch,font=font,fill=fill_color)
-                cx+=2*r+spacing
-            continue
-        # 兼容模板未显式声明 circle_text 的情况：对“车票类型/票种”强制按带圈文字渲染
-        if key in ("车票类型","票种"):
-            text=get_val("票种")
-            if text:
-                # 从字段或其第一个 segment 继承样式
-                font_path=spec.get("font_path")
-                size=spec.get("size")
-                fill_color=spec.get("fill","#000000")
-                spacing=spec.get("spacing")
-                if (not font_path or not size or spacing is None) and "segments" in spec and spec["segments"]:
-                    seg0=spec["segments"][0]
-                    font_path=font_path or seg0.get("font_path")
-                    size=size or seg0.get("size",50)
-                    if spacing is None: spacing=seg0.get("letter_spacing",10)
-                    if fill_color=="#000000": fill_color=seg0.get("fill","#000000")
-                if spacing is None: spacing=10
-                font=load_font(font_path,size or 50)
-                circle_fill=spec.get("fill_circle",None)
-                circle_radius=spec.get("radius",None)
-                width=spec.get("width",3)
-                # 准备每字半径，宽度随字符自适应
-                char_data=[]
-                for ch in text:
-                    w=font.getlength(ch);h=font.size
-                    r=circle_radius or int(max(w,h)/2+4)
-                    char_data.append((ch,r))
-                total_width=sum(2*r+spacing for _,r in char_data)-spacing
-                x0,y0=spec["x"],spec["y"];anchor=spec.get("anchor","ma")
-                if anchor.startswith("r"): x0-=total_width
-                elif anchor.startswith("m"): x0-=total_width/2
-                cx=x0
-                for ch,r in char_data:
-                    cx_center=cx+r;cy_center=y0
-                    dr.ellipse([cx_center-r,cy_center-r,cx_center+r,cy_center+r],outline=fill_color,fill=circle_fill,width=width)
-                    tw=font.getlength(ch);th=font.size
-                    dr.text((cx_center-tw/2,cy_center-th/2),ch,font=font,fill=fill_color)
-                    cx+=2*r+spacing
-                continue
-        if key=='二维码':
-            data_str=encode_ticket_data(fmt_map)
-            qr_img_rgba=make_qr_from_number_string(data_str,spec.get("size",280))
-            base.paste(qr_img_rgba,(spec["x"]-qr_img_rgba.width//2,spec["y"]-qr_img_rgba.height//2),qr_img_rgba)
-            continue
-        if key=='条码':
-            bc=make_barcode_placeholder(str(fmt_map.get('条码数据','demo')),spec["width"],spec["height"])
-            # preserve transparency by supplying mask
-            base.paste(bc,(spec["x"],spec["y"]),bc)
-            continue
-        text=get_val(key)
-        if "segments" in spec:
-            # 解析段落文本的工具：支持按用户变量重复字符
-            def _resolve_seg_text(seg):
-                raw = seg["text"].format_map(fmt_map)
-                repeat_char = seg.get("repeat_char")
-                repeat_count_key = seg.get("repeat_count_key")
-                if repeat_char is not None and repeat_count_key:
-                    try:
-                        cnt = int(fmt_map.get(repeat_count_key, 0))
-                    except:
-                        cnt = 0
-                    return (repeat_char or "") * max(cnt, 0)
-                # 兼容旧模板：若文本全为“*”，使用用户提供的“星号个数”覆盖长度
-                if raw and set(raw) == {"*"}:
-                    try:
-                        cnt = int(fmt_map.get("星号个数", len(raw)))
-                    except:
-                        cnt = len(raw)
-                    return "*" * max(cnt, 0)
-                return raw
-            x_base=spec["x"];y_base=spec["y"];total_width=0
-            for seg in spec["segments"]:
-                seg_text=_resolve_seg_text(seg)
-                f=load_font(seg.get("font_path",None),seg.get("size",24))
-                seg_width=sum(f.getlength(c)+seg.get("letter_spacing",0) for c in seg_text)-seg.get("letter_spacing",0)
-                total_width+=seg_width
-            if spec.get("anchor","la").startswith('r'): x_base-=total_width
-            elif spec.get("anchor","la").startswith('m'): x_base-=total_width/2
-            for seg in spec["segments"]:
-                seg_text=_resolve_seg_text(seg)
-                f=load_font(seg.get("font_path",None),seg.get("size",24))
-                draw_text(dr,seg_text,x_base,y_base+seg.get("y_offset",0),f,seg.get("fill","#000000"),anchor='la',letter_spacing=seg.get("letter_spacing",0),scale_x=seg.get("scale_x",1.0),base_image=base)
-                w,_=draw_text(dr,seg_text,x_base,y_base+seg.get("y_offset",0),f,seg.get("fill","#000000"),anchor='la',letter_spacing=seg.get("letter_spacing",0),scale_x=seg.get("scale_x",1.0),base_image=base)
-                x_base+=w
-        else:
-            if not text: continue
-            f=load_font(spec.get("font_path"),spec.get("size",24))
-            draw_text(dr,text,spec["x"],spec["y"],f,spec.get("fill","#000000"),spec.get("anchor","la"),letter_spacing=spec.get("letter_spacing",0),base_image=base)
+        op=_compile_overlay(os.path.join(template_dir,'arrow.png'),float(cfg.get('arrow_scale',1.0)),(int(cfg.get('arrow_x',0)),int(cfg.get('arrow_y',0))))
+        if op: ops.append(op)
+    for key,spec in cfg['fields'].items(): ops.append(_compile_field(key,spec))
+    static_ops=[];dynamic_ops=[]
+    for op in ops:
+        static,dynamic=_split_static(op)
+        if static is not None: static_ops.append(static)
+        if dynamic is not None: dynamic_ops.append(dynamic)
+    canvas=cfg['canvas']
+    return RenderPlan(path,content_hash,canvas.get('width'),canvas.get('height'),os.path.join(template_dir,canvas['background']),
+                      tuple(static_ops),tuple(dynamic_ops),scale)
+
+# 按 (模板, 缩放) 缓存的计划、背景母版、底图、调色板的条目数上限；缩放由请求决定（预览档位、打印 DPI），不能不设上限
+BACKGROUND_CACHE_SIZE=16
+
+# 进程级计划缓存：{(模板路径, 模板目录, 缩放): ((mtime_ns, size), plan)}；每份计划持有本缩放下各字号的字体实例及其字形表
+_PLAN_CACHE=LRUCache(BACKGROUND_CACHE_SIZE)
+
+def load_render_plan(template_json_path,template_dir,scale=1.0,cache=True):
+    """取模板的渲染计划；文件 mtime/大小 变化时按内容哈希判定是否需要重新编译。
+    cache=False 时新编译的计划不放入缓存（打印导出等一次性缩放）"""
+    path=os.path.abspath(template_json_path)
+    key=(path,os.path.abspath(template_dir),scale)
+    st=os.stat(path)
+    sig=(st.st_mtime_ns,st.st_size)
+    entry=_PLAN_CACHE.get(key)
+    if entry and entry[0]==sig: return entry[1]
+    with open(path,'rb') as f: raw=f.read()
+    digest=hashlib.sha1(raw).hexdigest()
+    if entry and entry[1].content_hash==digest:
+        if cache: _PLAN_CACHE.put(key,(sig,entry[1]))
+        return entry[1]
+    plan=compile_template(json.loads(raw.decode('utf-8')),template_dir,digest,path,scale)
+    if cache: _PLAN_CACHE.put(key,(sig,plan))
+    return plan
+
+def clear_plan_cache():
+    _PLAN_CACHE.clear()
+
+# ------------------------------
+# 背景图（解码后的 RGB 母版常驻内存，每次渲染只做一次内存拷贝）
+# ------------------------------
+# 背景母版 / 底图 / 调色板均按 (背景, 缩放) 各占一份整图内存，条目数有上限（全尺寸母版约 4 MB）
+_BACKGROUNDS=LRUCache(BACKGROUND_CACHE_SIZE)
+
+def load_background(path,scale=1.0):
+    """返回背景的只读 RGB 母版（scale != 1 时为预先缩放好的母版）；调用方需 copy() 后再绘制"""
+    st=os.stat(path)
+    sig=(st.st_mtime_ns,st.st_size)
+    entry=_BACKGROUNDS.get((path,scale))
+    if entry and entry[0]==sig: return entry[1]
+    if scale==1.0:
+        with Image.open(path) as img: master=img.convert('RGB')
+    else:
+        full=load_background(path)
+        master=full.resize((max(round(full.width*scale),1),max(round(full.height*scale),1)),resample=Image.LANCZOS)
+    _BACKGROUNDS.put((path,scale),(sig,master))
+    return master
+
+def clear_background_cache():
+    _BACKGROUNDS.clear()
+    _BASE_LAYERS.clear()
+    _PALETTES.clear()
+
+# ------------------------------
+# 执行渲染计划
+# ------------------------------
+def _repeat_spec(seg,fmt_map,raw):
+    """重复字符段返回 (字符, 用户请求的个数)，普通段返回 None"""
+    if seg.repeat_char is not None and seg.repeat_count_key:
+        try:
+            cnt=int(fmt_map.get(seg.repeat_count_key,0))
+        except:
+            cnt=0
+        return seg.repeat_char or "",cnt
+    # 兼容旧模板：若文本全为“*”，使用用户提供的“星号个数”覆盖长度
+    if raw and set(raw)=={"*"}:
+        try:
+            cnt=int(fmt_map.get("星号个数",len(raw)))
+        except:
+            cnt=len(raw)
+        return "*",cnt
+    return None
+
+def resolve_segment_text(seg,fmt_map):
+    """解析段落文本：支持按用户变量重复字符（个数截断到 RENDER_BUDGET.max_repeat_count）"""
+    raw=format_tokens(seg,fmt_map)
+    spec=_repeat_spec(seg,fmt_map,raw)
+    if spec is None: return raw
+    ch,cnt=spec
+    return ch*min(max(cnt,0),RENDER_BUDGET.max_repeat_count)
+
+# ------------------------------
+# 排版：文本字段先测量定位成字形串，再统一绘制；结果也可用于包围盒查询
+# ------------------------------
+FieldLayout=namedtuple('FieldLayout','key runs bbox')
+
+def _runs_bbox(runs):
+    if not runs: return None
+    boxes=[]
+    for run in runs:
+        ascent,descent=run.font.getmetrics() if isinstance(run.font,ImageFont.FreeTypeFont) else (run.font.size,0)
+        boxes.append((int(run.x),int(run.y),int(math.ceil(run.x+max(run.width,0))),int(run.y)+max(ascent+descent,run.font.size+4)))
+    return (min(b[0] for b in boxes),min(b[1] for b in boxes),max(b[2] for b in boxes),max(b[3] for b in boxes))
+
+def _fit_segments(op,texts,fonts,widths):
+    """整段限宽：各段字号按同一比例缩小，直到总宽不超过 op.max_width"""
+    ratio=op.max_width/sum(widths)
+    for _ in range(32):
+        sized=[font_variant(f,max(int(f.size*ratio),FIT_MIN_SIZE)) if t else f for f,t in zip(fonts,texts)]
+        sized_widths=[chain_width(f,seg.fallbacks,t,seg.letter_spacing,seg.scale_x) for f,t,seg in zip(sized,texts,op.segments)]
+        if sum(sized_widths)<=op.max_width or all(f.size<=FIT_MIN_SIZE for f,t in zip(sized,texts) if t): break
+        ratio*=0.95
+    return sized,sized_widths
+
+def layout_segments(op,values,texts=None):
+    if texts is None: texts=[resolve_segment_text(seg,values.fmt_map) for seg in op.segments]
+    fonts=[_segment_font(seg,t) for seg,t in zip(op.segments,texts)]
+    widths=[chain_width(f,seg.fallbacks,t,seg.letter_spacing,seg.scale_x) for f,seg,t in zip(fonts,op.segments,texts)]
+    x=op.x;total_width=sum(widths)
+    if op.max_width and total_width>op.max_width:
+        fonts,widths=_fit_segments(op,texts,fonts,widths)
+        total_width=sum(widths)
+    if op.anchor.startswith('r'): x-=total_width
+    elif op.anchor.startswith('m'): x-=total_width/2
+    runs=[]
+    for seg,t,f,w in zip(op.segments,texts,fonts,widths):
+        if t: runs.extend(chain_runs(seg.font,f,seg.fallbacks,t,seg.fill,x,op.y+seg.y_offset,seg.letter_spacing,seg.scale_x))
+        x+=w
+    return FieldLayout(op.key,tuple(runs),_runs_bbox(runs))
+
+def layout_text(op,values):
+    text=values.get(op.key)
+    if not text: return FieldLayout(op.key,(),None)
+    font=fit_font(op.font,text,op.max_width,op.letter_spacing,fallbacks=op.fallbacks) if op.max_width else op.font
+    w=chain_width(font,op.fallbacks,text,op.letter_spacing)
+    x=op.x
+    if op.anchor.startswith('r'): x-=w
+    elif op.anchor.startswith('m'): x-=w/2
+    runs=tuple(chain_runs(op.font,font,op.fallbacks,text,op.fill,x,op.y,op.letter_spacing))
+    return FieldLayout(op.key,runs,_runs_bbox(runs))
+
+_LAYOUTS={SegmentsOp:layout_segments, TextOp:layout_text}
+
+def layout_ticket(plan,user_data):
+    """只排版不绘制：返回各文本字段的 FieldLayout（按绘制顺序）"""
+    values=user_data if isinstance(user_data,UserValues) else UserValues(user_data)
+    out=[]
+    for op in plan.static_ops+plan.ops:
+        if isinstance(op,CircleTextOp) and op.fallback is not None and not values.get(op.key): op=op.fallback
+        fn=_LAYOUTS.get(type(op))
+        if fn: out.append(fn(op,values))
+    return out
+
+# ------------------------------
+# 字符覆盖检查：主字体与回退链都没有字形的字符会画成方框，渲染前先找出来
+# ------------------------------
+def _field_texts(op,values):
+    """字段实际要绘制的 (字体, 回退链, 文本) 列表"""
+    if isinstance(op,CircleTextOp):
+        text=values.get(op.key)
+        if not text: return _field_texts(op.fallback,values) if op.fallback is not None else []
+        return [(op.font,op.fallbacks,text)]
+    if isinstance(op,SegmentsOp):
+        return [(seg.font,seg.fallbacks,resolve_segment_text(seg,values.fmt_map)) for seg in op.segments]
+    if isinstance(op,TextOp): return [(op.font,op.fallbacks,values.get(op.key))]
+    return []
+
+def unrenderable_chars(plan,user_data):
+    """返回 {字段: 无法显示的字符串（去重、保持出现顺序）}；全部可显示时为空字典"""
+    values=user_data if isinstance(user_data,UserValues) else UserValues(user_data)
+    out={}
+    for op in plan.ops:
+        for font,fallbacks,text in _field_texts(op,values):
+            for ch in text or "":
+                if ch not in out.get(op.key,"") and font_for_char(font,fallbacks,ch) is None:
+                    out[op.key]=out.get(op.key,"")+ch
+    return out
 
+# ------------------------------
+# 渲染开销预估：按编译结果和用户输入估算字形数与临时图面积（不排版、不光栅化），超出预算时拒绝
+# ------------------------------
+RenderBudget=namedtuple('RenderBudget','max_glyphs max_field_chars max_temp_area max_repeat_count')
+# 整张票字形数 / 单字段字符数 / 临时掩码图总面积（像素）/ 星号个数等重复字符个数
+RENDER_BUDGET=RenderBudget(2048,256,16_000_000,256)
+RenderCost=namedtuple('RenderCost','glyphs temp_area fields')  # fields: {字段: 字符数}
+
+class RenderCostError(ValueError):
+    """超出渲染预算；violations 为 [{"limit", "field", "value", "max"}, ...]"""
+    def __init__(self,violations):
+        super().__init__("；".join(f"{v['field'] or '整张车票'} 的 {v['limit']} 为 {v['value']}，上限 {v['max']}" for v in violations))
+        self.violations=violations
+
+def _text_area(font,n,letter_spacing=0,scale_x=1.0):
+    """n 个字的临时图面积上界：逐字字形掩码按字号见方计；横向压缩时另有整串掩码及其缩放结果"""
+    size=font.size
+    area=n*size*size
+    if n and scale_x!=1.0:
+        width=n*size+abs(letter_spacing)/max(scale_x,1e-3)*(n-1)+4
+        area+=int(width*(1+scale_x)*(size+4))
+    return area
+
+def _field_cost(op,values,repeats):
+    """字段的 (字符数, 临时图面积)；重复段请求的个数记入 repeats"""
+    if isinstance(op,CircleTextOp):
+        text=values.get(op.key)
+        if not text: return _field_cost(op.fallback,values,repeats) if op.fallback is not None else (0,0)
+        side=2*(op.radius or op.font.size)+12
+        return len(text),_text_area(op.font,len(text))+3*len(text)*side*side
+    if isinstance(op,SegmentsOp):
+        n=area=0
+        for seg in op.segments:
+            spec=_repeat_spec(seg,values.fmt_map,format_tokens(seg,values.fmt_map))
+            if spec is not None: repeats.append((op.key,spec[1]))
+            k=len(resolve_segment_text(seg,values.fmt_map))
+            n+=k;area+=_text_area(seg.font,k,seg.letter_spacing,seg.scale_x)
+        return n,area
+    if isinstance(op,TextOp):
+        n=len(values.get(op.key) or "")
+        return n,_text_area(op.font,n,op.letter_spacing)
+    if isinstance(op,QrOp): return 0,op.size*op.size
+    if isinstance(op,BarcodeOp): return 0,op.width*op.height
+    return 0,0
+
+def render_cost(plan,user_data,repeats=None):
+    """估算一次渲染的开销，返回 RenderCost；传入列表 repeats 时追加 (字段, 请求的重复个数)"""
+    values=user_data if isinstance(user_data,UserValues) else UserValues(user_data)
+    repeats=[] if repeats is None else repeats
+    glyphs=area=0;fields={}
+    for op in plan.ops:
+        n,a=_field_cost(op,values,repeats)
+        glyphs+=n;area+=a
+        if n: fields[op.key]=fields.get(op.key,0)+n
+    return RenderCost(glyphs,area,fields)
+
+def check_render_cost(plan,user_data,budget=None):
+    """超出预算时抛出 RenderCostError，否则返回 RenderCost"""
+    budget=budget or RENDER_BUDGET
+    repeats=[]
+    cost=render_cost(plan,user_data,repeats)
+    violations=[]
+    def over(limit,field,value,maximum):
+        if value>maximum: violations.append({"limit":limit,"field":field,"value":value,"max":maximum})
+    for key,cnt in repeats: over("max_repeat_count",key,cnt,budget.max_repeat_count)
+    for key,n in cost.fields.items(): over("max_field_chars",key,n,budget.max_field_chars)
+    over("max_glyphs",None,cost.glyphs,budget.max_glyphs)
+    over("max_temp_area",None,cost.temp_area,budget.max_temp_area)
+    if violations: raise RenderCostError(violations)
+    return cost
+
+# ------------------------------
+# 字段贴图缓存：{(字段编译结果, 解析后的文本): 贴图指令}，同一模板字段 + 同一文本跨用户直接复用
+# ------------------------------
+# 条数与掩码总字节数双重上限（原始分辨率下每条约 15 KB）；打印导出按打印缩放生成的贴图不进此缓存（见 iter_print_tiles）
+FIELD_TILE_CACHE_SIZE=4096
+FIELD_TILE_CACHE_BYTES=64*1024*1024
+_UNSTAMPABLE=object()  # 占位：记录“该字段只能直接绘制”，避免反复尝试（不能用空元组：空字段的贴图就是空元组）
+
+def _stamps_bytes(stamps):
+    return 0 if stamps is _UNSTAMPABLE else sum(_mask_bytes(st.mask) for st in stamps)
+
+_FIELD_TILES=LRUCache(FIELD_TILE_CACHE_SIZE,FIELD_TILE_CACHE_BYTES,_stamps_bytes)
+
+def _circle_stamps(op,text):
+    """圆圈字：圆圈按索引色（1 填充 / 2 描边）画进 L 图后拆成两张二值掩码，字形取自字形缓存"""
+    stamps=[]
+    for ch,r,cx,cy,font in circle_text_layout(text,op.x,op.y,op.font,op.anchor,op.spacing,op.radius,op.fallbacks):
+        left,top=math.floor(cx-r)-1,math.floor(cy-r)-1
+        tx,ty=cx-glyph_advance(font,ch)/2,cy-font.size/2
+        if left<0 or top<0 or tx<0 or ty<0: return None
+        ring=Image.new('L',(math.ceil(cx+r)-left+2,math.ceil(cy+r)-top+2),0)
+        ImageDraw.Draw(ring).ellipse([cx-r-left,cy-r-top,cx+r-left,cy+r-top],outline=2,fill=None if op.circle_fill is None else 1,width=op.width)
+        if op.circle_fill is not None: stamps.append(Stamp(op.circle_fill,(left,top),ring.point(lambda v:255 if v==1 else 0)))
+        stamps.append(Stamp(op.fill,(left,top),ring.point(lambda v:255 if v==2 else 0)))
+        mask,ox,oy=glyph_mask(font,ch,tx%1,ty%1)
+        stamps.append(Stamp(op.fill,(int(tx)-ox,int(ty)-oy),mask))
+    return stamps
+
+def field_stamps(op,values,cache=_FIELD_TILES):
+    """文本类字段（TextOp / SegmentsOp / CircleTextOp）的贴图指令，经字段贴图缓存（cache 为 None 时不缓存）；
+    无法走贴图时返回 None"""
+    if isinstance(op,CircleTextOp):
+        text=values.get(op.key)
+        if not text: return field_stamps(op.fallback,values,cache) if op.fallback is not None else ()
+    elif isinstance(op,SegmentsOp): text=tuple(resolve_segment_text(seg,values.fmt_map) for seg in op.segments)
+    else: text=values.get(op.key)
+    key=(op,text)
+    stamps=cache.get(key) if cache is not None else None
+    if stamps is None:
+        if isinstance(op,CircleTextOp): stamps=_circle_stamps(op,text)
+        elif isinstance(op,SegmentsOp): stamps=_raster_runs(layout_segments(op,values,text))
+        else: stamps=_raster_runs(layout_text(op,values))
+        stamps=_UNSTAMPABLE if stamps is None else tuple(stamps)
+        if cache is not None: cache.put(key,stamps)
+    return None if stamps is _UNSTAMPABLE else stamps
+
+def clear_field_tile_cache(): _FIELD_TILES.clear()
+
+def cache_stats():
+    """各渲染缓存的命中统计，供调优"""
+    return {"glyphs":_GLYPHS.stats(),"field_tiles":_FIELD_TILES.stats(),"scaled_runs":_SCALED_RUNS.stats(),"run_widths":_RUN_WIDTHS.stats(),
+            "qr_symbols":_QR_SYMBOLS.stats(),"barcodes":_BARCODES.stats()}
+
+def _paint_line(base,dr,op,values): draw_line(dr,op.start,op.end,fill=op.fill,width=op.width)
+
+def _paint_dashed_rect(base,dr,op,values): draw_dashed_rectangle(dr,op.xy,op.dash_length,op.fill,op.width)
+
+def _paint_arrow(base,dr,op,values): draw_half_arrow(dr,op.xy,op.length,op.height,op.direction,op.fill)
+
+def _paint_overlay(base,dr,op,values): base.paste(op.image,op.xy,op.image)
+
+def _paint_stamps(base,stamps):
+    for stamp in stamps: base.paste(*stamp)
+
+def _paint_circle_text(base,dr,op,values):
+    stamps=field_stamps(op,values)
+    if stamps is not None: return _paint_stamps(base,stamps)
+    text=values.get(op.key)
+    if not text:
+        if op.fallback is not None: _PAINTERS[type(op.fallback)](base,dr,op.fallback,values)
+        return
+    draw_multi_circle_text(dr,(op.x,op.y),text,op.font,op.fill,op.spacing,op.radius,op.circle_fill,op.width,op.anchor,op.fallbacks)
+
+def _paint_qr(base,dr,op,values): _paint_stamps(base,_raster_qr(op,values))
+
+def _paint_barcode(base,dr,op,values): _paint_stamps(base,_raster_barcode(op,values))
+
+def _paint_text(base,dr,op,values):
+    stamps=field_stamps(op,values)
+    if stamps is not None: return _paint_stamps(base,stamps)
+    for run in layout_text(op,values).runs: paint_run(dr,run,base)
+
+def _paint_segments(base,dr,op,values):
+    stamps=field_stamps(op,values)
+    if stamps is not None: return _paint_stamps(base,stamps)
+    for run in layout_segments(op,values).runs: paint_run(dr,run,base)
+
+_PAINTERS={
+    LineOp:_paint_line, DashedRectOp:_paint_dashed_rect, ArrowOp:_paint_arrow, OverlayOp:_paint_overlay,
+    CircleTextOp:_paint_circle_text, QrOp:_paint_qr, BarcodeOp:_paint_barcode, TextOp:_paint_text, SegmentsOp:_paint_segments,
+}
+
+# 预合成底图：{(模板路径, 背景路径, 缩放): (plan, 背景母版, 底图)}，计划或背景变化时重建
+_BASE_LAYERS=LRUCache(BACKGROUND_CACHE_SIZE)
+
+def load_base_layer(plan):
+    """背景 + 全部静态绘制，只读；调用方需 copy() 后再绘制"""
+    master=load_background(plan.background,plan.scale)
+    key=(plan.path,plan.background,plan.scale)
+    entry=_BASE_LAYERS.get(key)
+    if entry and entry[0] is plan and entry[1] is master: return entry[2]
+    layer=master.copy()
+    if plan.static_ops:
+        dr=ImageDraw.Draw(layer)
+        values=UserValues({})
+        for op in plan.static_ops: _PAINTERS[type(op)](layer,dr,op,values)
+    _BASE_LAYERS.put(key,(plan,master,layer))
+    return layer
+
+# ------------------------------
+# 画布池：按 (模式, 尺寸) 复用画布，取出时从底图整块拷贝复位，避免每次渲染重新分配数 MB 内存
+# ------------------------------
+CANVAS_POOL_SIZE=4      # 每种尺寸最多保留的空闲画布
+CANVAS_POOL_SHAPES=8    # 最多保留的尺寸种类（不同缩放的预览尺寸各算一种）
+
+class CanvasPool:
+    def __init__(self,per_shape=CANVAS_POOL_SIZE,max_shapes=CANVAS_POOL_SHAPES):
+        self.per_shape=per_shape
+        self.max_shapes=max_shapes
+        self._free=OrderedDict()
+        self._lock=threading.Lock()
+        self.acquired=self.reused=self.released=self.dropped=0
+    def acquire(self,base):
+        """取一块与 base 同模式同尺寸的画布，内容复位为 base"""
+        key=(base.mode,base.size)
+        with self._lock:
+            self.acquired+=1
+            free=self._free.get(key)
+            canvas=free.pop() if free else None
+            if canvas is not None:
+                self.reused+=1
+                self._free.move_to_end(key)
+        if canvas is None: return base.copy()
+        canvas.paste(base,(0,0))
+        return canvas
+    def release(self,canvas):
+        """归还画布；调用方此后不得再使用它"""
+        key=(canvas.mode,canvas.size)
+        with self._lock:
+            self.released+=1
+            free=self._free.get(key)
+            if free is None:
+                if len(self._free)>=self.max_shapes: self.dropped+=len(self._free.popitem(last=False)[1])
+                free=self._free[key]=[]
+            if len(free)>=self.per_shape: self.dropped+=1
+            else: free.append(canvas)
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+            self.acquired=self.reused=self.released=self.dropped=0
+    def stats(self):
+        with self._lock:
+            idle=sum(len(v) for v in self._free.values())
+            idle_bytes=sum(len(v)*w*h*len(mode) for (mode,(w,h)),v in self._free.items())
+            return {"acquired":self.acquired,"reused":self.reused,"allocated":self.acquired-self.reused,
+                    "released":self.released,"dropped":self.dropped,"idle":idle,"idle_bytes":idle_bytes,
+                    "reuse_rate":round(self.reused/self.acquired,4) if self.acquired else 0.0}
+
+CANVAS_POOL=CanvasPool()
+
+# ------------------------------
+# 字段光栅化：生成贴图指令（字段贴图缓存与打印导出使用），合成时按模板顺序贴入
+# ------------------------------
+# 光栅化函数 (op, values) -> [Stamp] 或 None（None 表示该字段只能在合成阶段直接绘制）
+def _raster_qr(op,values):
+    mask=qr_mask(encode_ticket_data(values.fmt_map),op.size)
+    return [Stamp((0,0,0),(op.x-mask.width//2,op.y-mask.height//2),mask)]
+
+def _raster_barcode(op,values):
+    return [Stamp((0,0,0),(op.x,op.y),barcode_mask(str(values.fmt_map.get('条码数据','demo')),op.width,op.height))]
+
+def _raster_runs(layout):
+    stamps=[]
+    for run in layout.runs:
+        run_list=run_stamps(run)
+        if run_list is None: return None
+        stamps.extend(run_list)
+    return stamps
+
+_RASTERIZERS={QrOp:_raster_qr, BarcodeOp:_raster_barcode, TextOp:field_stamps, SegmentsOp:field_stamps, CircleTextOp:field_stamps}
+
+def render_plan(plan,user_data,pool=None):
+    """执行渲染计划：在底图副本上按模板顺序绘制各字段。
+    传入 pool（CanvasPool）时画布从池中取出，用完后由调用方 pool.release() 归还；
+    超出 RENDER_BUDGET 的输入在绘制前抛出 RenderCostError"""
+    values=UserValues(user_data)
+    check_render_cost(plan,values)
+    layer=load_base_layer(plan)
+    base=pool.acquire(layer) if pool is not None else layer.copy()
+    dr=ImageDraw.Draw(base)
+    for op in plan.ops: _PAINTERS[type(op)](base,dr,op,values)
     return base
+
+# ------------------------------
+# 局部预览：只渲染正在编辑的字段所在区域，背景从母版（底图 + 静态元素）裁剪，只贴与区域相交的字段
+# ------------------------------
+ROI_PADDING=8
+
+def _op_user_keys(op):
+    """字段读取的用户字段名（二维码为 encode_ticket_data 读取的全部字段）"""
+    if isinstance(op,QrOp): return {op.key}|QR_DATA_KEYS
+    if isinstance(op,CircleTextOp): return {op.key}|(_op_user_keys(op.fallback) if op.fallback is not None else set())
+    if isinstance(op,BarcodeOp): return {op.key,'条码数据'}
+    if not isinstance(op,SegmentsOp): return {op.key}
+    keys=set()
+    for seg in op.segments:
+        tokens=seg.tokens
+        if tokens is None: tokens=[(lit,name.split('.')[0].split('[')[0] if name else None) for lit,name,_,_ in string.Formatter().parse(seg.text)]
+        keys.update(name for _,name in tokens if name)
+        if seg.repeat_count_key: keys.add(seg.repeat_count_key)
+        if all(set(lit)<={'*'} for lit,name in tokens if name is None): keys.add('星号个数')
+    return keys
+
+def _stamp_box(stamp):
+    x,y=stamp.xy
+    return (x,y,x+stamp.mask.width,y+stamp.mask.height)
+
+def _boxes_meet(a,b): return a[0]<b[2] and b[0]<a[2] and a[1]<b[3] and b[1]<a[3]
+
+def _op_coarse_box(op):
+    """不光栅化即可确定的字段范围（二维码/条码），其余返回 None"""
+    if isinstance(op,QrOp): return (op.x-op.size//2-1,op.y-op.size//2-1,op.x+op.size//2+1,op.y+op.size//2+1)
+    if isinstance(op,BarcodeOp): return (op.x,op.y,op.x+op.width,op.y+op.height)
+    return None
+
+def _op_anchor_box(op):
+    """空字段的占位范围：锚点附近一个字号见方"""
+    font=op.segments[0].font if isinstance(op,SegmentsOp) else getattr(op,'font',None)
+    size=font.size if font is not None else 0
+    return (op.x-size,op.y,op.x+size,op.y+size)
+
+def _op_slot(op,width):
+    """字段取任意值时可能占用的范围：二维码/条码为固定框；文字为整行横条，纵向按锚点上下各留两个字号（覆盖各种锚点、基线偏移与限宽缩字）"""
+    coarse=_op_coarse_box(op)
+    if coarse is not None: return coarse
+    if isinstance(op,SegmentsOp): spans=[(op.y+seg.y_offset,seg.font.size) for seg in op.segments]
+    elif isinstance(op,CircleTextOp): spans=[(op.y,(op.radius or op.font.size)+(op.width or 0))]
+    else: spans=[(op.y,op.font.size)]
+    slot=(0,math.floor(min(y-2*size for y,size in spans)),width,math.ceil(max(y+2*size for y,size in spans)))
+    if isinstance(op,CircleTextOp) and op.fallback is not None:
+        other=_op_slot(op.fallback,width); slot=(0,min(slot[1],other[1]),width,max(slot[3],other[3]))
+    return slot
+
+def _field_boxes(op,values,stamps):
+    """字段实际绘制的范围（贴图外框；无法走贴图时取排版外框）"""
+    if stamps is not None: return [_stamp_box(st) for st in stamps]
+    return [_runs_bbox(_LAYOUTS[type(op)](op,values).runs)] if type(op) in _LAYOUTS else []
+
+def _merge_boxes(boxes):
+    """相交的外框合并为一个，直到两两不相交"""
+    boxes=list(boxes)
+    merged=True
+    while merged:
+        merged=False
+        for i in range(len(boxes)):
+            for j in range(i+1,len(boxes)):
+                if _boxes_meet(boxes[i],boxes[j]):
+                    a,b=boxes[i],boxes.pop(j)
+                    boxes[i]=(min(a[0],b[0]),min(a[1],b[1]),max(a[2],b[2]),max(a[3],b[3])); merged=True
+                    break
+            if merged: break
+    return sorted(boxes,key=lambda b:(b[1],b[0]))
+
+def render_regions(plan,user_data,focus_field,padding=ROI_PADDING,previous_user_data=None,merge=False):
+    """只渲染 focus_field（模板字段名或用户字段名）影响到的区域，返回 [(区域图, (x0, y0, x1, y1))]；
+    每块与整张渲染后裁剪同一区域逐像素一致。依赖该字段的其它字段（如二维码）一并重绘，
+    与编辑中的文字不相邻时单独成块；merge 为真时合并为一块。
+    previous_user_data 为客户端手上那张预览所用的数据：给出时每个字段取新旧两次绘制范围的并集，
+    贴回后旧字形被完整覆盖；未给出时无从得知旧字形的范围，文字字段取所在的整行横条（_op_slot）"""
+    values=UserValues(user_data)
+    check_render_cost(plan,values)
+    focus=[op for op in plan.ops if op.key==focus_field or focus_field in _op_user_keys(op)]
+    if not focus: raise ValueError(f"模板中没有字段: {focus_field}")
+    # 模板字段名（如 身份信息）读取的用户字段进入二维码时，二维码同样要重绘
+    if QR_DATA_KEYS&set().union(*(_op_user_keys(op) for op in focus if not isinstance(op,QrOp))):
+        focus+=[op for op in plan.ops if isinstance(op,QrOp) and op not in focus]
+    previous=None
+    if previous_user_data is not None:
+        previous=UserValues(previous_user_data)
+        check_render_cost(plan,previous)
+    stamps={}
+    for i,op in enumerate(plan.ops):
+        if op in focus: stamps[i]=_RASTERIZERS[type(op)](op,values)
+    layer=load_base_layer(plan)
+    regions=[]
+    for i,op in enumerate(plan.ops):
+        if op not in focus: continue
+        boxes=_field_boxes(op,values,stamps[i])
+        coarse=_op_coarse_box(op)
+        if coarse is not None: boxes.append(coarse)
+        elif previous is not None: boxes+=_field_boxes(op,previous,_RASTERIZERS[type(op)](op,previous))
+        else: boxes.append(_op_slot(op,layer.width))
+        boxes=[b for b in boxes if b is not None] or [_op_anchor_box(op)]
+        box=(max(min(b[0] for b in boxes)-padding,0),max(min(b[1] for b in boxes)-padding,0),
+             min(max(b[2] for b in boxes)+padding,layer.width),min(max(b[3] for b in boxes)+padding,layer.height))
+        if box[0]<box[2] and box[1]<box[3]: regions.append(box)
+    if not regions: regions=[(0,0,layer.width,layer.height)]
+    regions=_merge_boxes(regions)
+    if merge and len(regions)>1:
+        regions=[(min(r[0] for r in regions),min(r[1] for r in regions),max(r[2] for r in regions),max(r[3] for r in regions))]
+    for i,op in enumerate(plan.ops):
+        coarse=_op_coarse_box(op)
+        if i not in stamps and not (coarse is not None and not any(_boxes_meet(coarse,r) for r in regions)):
+            stamps[i]=_RASTERIZERS[type(op)](op,values)
+        if i in stamps and stamps[i] is None:
+            # 个别字段无法走贴图（如字落在负坐标），整张绘制后裁剪
+            full=render_plan(plan,user_data)
+            return [(full.crop(r),r) for r in regions]
+    out=[]
+    for region in regions:
+        x0,y0=region[0],region[1]
+        canvas=layer.crop(region)
+        for i in sorted(stamps):
+            for st in stamps[i]:
+                if _boxes_meet(_stamp_box(st),region): canvas.paste(st.fill,(st.xy[0]-x0,st.xy[1]-y0),st.mask)
+        out.append((canvas,region))
+    return out
+
+def render_region(plan,user_data,focus_field,padding=ROI_PADDING,previous_user_data=None):
+    """render_regions 合并为一块：返回 (区域图, (x0, y0, x1, y1))"""
+    return render_regions(plan,user_data,focus_field,padding,previous_user_data,merge=True)[0]
+
+# ------------------------------
+# 输出编码
+# ------------------------------
+# 输出格式：PNG（真彩无损）、PNG8（自适应调色板）、WEBP（quality 为空时无损）、JPEG、PDF（矢量，见 render_pdf）
+OUTPUT_FORMATS={'PNG':'image/png','PNG8':'image/png','WEBP':'image/webp','JPEG':'image/jpeg','PDF':'application/pdf'}
+DEFAULT_QUALITY={'WEBP':80,'JPEG':85}
+
+def normalize_format(fmt):
+    fmt=str(fmt or 'PNG').upper()
+    fmt={'JPG':'JPEG','PNG-8':'PNG8'}.get(fmt,fmt)
+    if fmt not in OUTPUT_FORMATS: raise ValueError(f"不支持的图片格式: {fmt}")
+    return fmt
+
+def _plan_colors(plan):
+    """动态字段会用到的纯色（文字、圆圈、二维码/条码），需保证进入调色板"""
+    colors={(0,0,0)}
+    for op in plan.ops:
+        fills=[getattr(op,'fill',None),getattr(op,'circle_fill',None)]
+        fills+=[seg.fill for seg in getattr(op,'segments',())]
+        if isinstance(op,CircleTextOp) and op.fallback is not None: fills+=[getattr(op.fallback,'fill',None)]+[seg.fill for seg in getattr(op.fallback,'segments',())]
+        for fill in fills:
+            if fill is None: continue
+            try: colors.add(ImageColor.getrgb(fill)[:3] if isinstance(fill,str) else tuple(fill)[:3])
+            except (ValueError,TypeError): pass
+    return sorted(colors)
+
+# 调色板缓存：{(模板路径, 背景路径, 缩放): (底图, 调色板图)}
+_PALETTES=LRUCache(BACKGROUND_CACHE_SIZE)
+
+def load_palette(plan):
+    """底图量化得到的自适应调色板 + 动态字段颜色；每个模板底图只计算一次"""
+    layer=load_base_layer(plan)
+    key=(plan.path,plan.background,plan.scale)
+    entry=_PALETTES.get(key)
+    if entry and entry[0] is layer: return entry[1]
+    colors=_plan_colors(plan)[:255]
+    quantized=layer.quantize(256-len(colors),method=Image.Quantize.MEDIANCUT)
+    pal=quantized.getpalette()[:3*(256-len(colors))]
+    for c in colors: pal.extend(c)
+    palette=Image.new('P',(1,1))
+    palette.putpalette(pal)
+    _PALETTES.put(key,(layer,palette))
+    return palette
+
+def encode_image(image,fmt='PNG',quality=None,palette=None):
+    """编码为图片字节；PNG8 传入 palette（见 load_palette）时直接映射到固定调色板，不再逐张量化。
+    PNG/PNG8 由多线程 PNG 编码器（png_writer）输出"""
+    fmt=normalize_format(fmt)
+    if fmt=='PDF': raise ValueError("PDF 为矢量输出，需由渲染计划生成（见 render_pdf）")
+    if fmt=='PNG': return encode_png(image)
+    if fmt=='PNG8':
+        if palette is not None: return encode_png(image.quantize(palette=palette,dither=Image.Dither.NONE))
+        return encode_png(image.quantize(256,method=Image.Quantize.MEDIANCUT,dither=Image.Dither.NONE))
+    buf=BytesIO()
+    if fmt=='WEBP':
+        # 无损档 quality 表示压缩力度；method=2 在体积与耗时之间折中
+        if quality is None: image.save(buf,format='WEBP',lossless=True,quality=50,method=2)
+        else: image.save(buf,format='WEBP',quality=int(quality),method=2)
+    else:
+        image.convert('RGB').save(buf,format='JPEG',quality=int(quality or DEFAULT_QUALITY['JPEG']))
+    return buf.getvalue()
+
+# ------------------------------
+# 渲染票
+# ------------------------------
+def resolve_scale(template_json_path, template_dir, scale=1.0, max_width=None):
+    """由 scale（(0, 1]）/ max_width（输出宽度上限，像素）得到量化后的缩放系数；max_width 只缩小不放大。
+    缩放系数向下量化到 SCALE_STEP，输出宽度不超过 max_width；max_width 小于最小档（SCALE_STEP 倍原宽）时拒绝。
+    放大输出走打印导出（export_print），这里不接受 scale > 1，避免按任意缩放生成整图母版"""
+    scale=float(scale or 1.0)
+    if not 0<scale<=1: raise ValueError("scale 取值范围为 (0, 1]")
+    if max_width:
+        max_width=int(max_width)
+        if max_width<=0: raise ValueError("max_width 必须大于 0")
+        plan=load_render_plan(template_json_path,template_dir)
+        width=load_background(plan.background).width
+        if max_width<round(width*SCALE_STEP): raise ValueError(f"max_width 不能小于 {round(width*SCALE_STEP)}")
+        scale=min(scale,float(max_width)/width)
+    return normalize_scale(scale)
+
+def render_ticket(user_data, template_json_path, template_dir, apply_template=False, scale=1.0, max_width=None):
+    scale=resolve_scale(template_json_path,template_dir,scale,max_width)
+    return render_plan(load_render_plan(template_json_path,template_dir,scale),user_data)
+
+# ------------------------------
+# 高分辨率打印导出：按目标 DPI 缩放排版（300 DPI 约为原图 0.75 倍，更高 DPI 为放大），按横向分块逐块合成并流式编码，峰值内存与整图大小无关
+# ------------------------------
+PRINT_WIDTH_MM=87.0      # 整张画布对应的打印宽度（毫米）
+PRINT_TILE_HEIGHT=256    # 每块的行数
+PRINT_FORMATS=('PNG','TIFF')
+MAX_PRINT_SCALE=6.0      # 打印缩放上限（2400 DPI、87 mm 约为 5.75 倍）：超出时在编译放大计划前拒绝，开销预算也最多放宽到此
+
+def print_scale(template_json_path,template_dir,dpi,width_mm=PRINT_WIDTH_MM):
+    """按 DPI 与打印宽度得到缩放系数；向上量化到 SCALE_STEP，保证实际 DPI 不低于要求。
+    dpi / width_mm 须为有限正数，否则抛出 ValueError；缩放超过 MAX_PRINT_SCALE 时抛出 RenderCostError"""
+    dpi,width_mm=float(dpi),float(width_mm)
+    if not (math.isfinite(dpi) and math.isfinite(width_mm) and dpi>0 and width_mm>0):
+        raise ValueError(f"dpi 与 width_mm 须为有限正数: {dpi}, {width_mm}")
+    width=load_background(load_render_plan(template_json_path,template_dir).background).width
+    scale=dpi*width_mm/25.4/width
+    if scale>MAX_PRINT_SCALE:
+        raise RenderCostError([{"limit":"max_print_scale","field":None,"value":round(scale,2),"max":MAX_PRINT_SCALE}])
+    return normalize_scale(math.ceil(scale/SCALE_STEP-1e-9)*SCALE_STEP)
+
+def print_size(plan):
+    """按 plan.scale 缩放后的整图尺寸；与 load_background(…, plan.scale) 的尺寸一致，但不生成缩放母版"""
+    source=load_background(plan.background)
+    return max(round(source.width*plan.scale),1),max(round(source.height*plan.scale),1)
+
+def _shift_y(op,dy):
+    """把需直接绘制的 op 纵向平移 dy（分块内坐标）"""
+    if isinstance(op,LineOp): return op._replace(start=(op.start[0],op.start[1]+dy),end=(op.end[0],op.end[1]+dy))
+    if isinstance(op,DashedRectOp): return op._replace(xy=(op.xy[0],op.xy[1]+dy,op.xy[2],op.xy[3]+dy))
+    if isinstance(op,(ArrowOp,OverlayOp)): return op._replace(xy=(op.xy[0],op.xy[1]+dy))
+    if isinstance(op,CircleTextOp) and op.fallback is not None: return op._replace(y=op.y+dy,fallback=_shift_y(op.fallback,dy))
+    return op._replace(y=op.y+dy)
+
+def _print_stamps(op,values):
+    """打印缩放下的贴图只用于本次导出，不进共享的字段贴图缓存"""
+    rasterize=_RASTERIZERS[type(op)]
+    return field_stamps(op,values,None) if rasterize is field_stamps else rasterize(op,values)
+
+def print_budget(plan,budget=None):
+    """打印缩放下的渲染预算：RENDER_BUDGET 按原始分辨率设定，临时图面积随缩放的平方增长，max_temp_area 同比放宽（缩放最多计到 MAX_PRINT_SCALE）；
+    字形数、字符数、重复个数与缩放无关，保持不变"""
+    budget=budget or RENDER_BUDGET
+    return budget._replace(max_temp_area=int(budget.max_temp_area*min(max(plan.scale,1.0),MAX_PRINT_SCALE)**2))
+
+def iter_print_tiles(plan,user_data,tile_height=PRINT_TILE_HEIGHT):
+    """逐块产出按 plan.scale 缩放后的整图（RGB，自上而下，宽为整图宽）。
+    背景按块从原始母版重采样，静态元素与字段按模板顺序合成；字段贴图只光栅化一次，各块按相交部分贴入"""
+    values=UserValues(user_data)
+    check_render_cost(plan,values,print_budget(plan))
+    source=load_background(plan.background)
+    width,height=print_size(plan)
+    fy=source.height/height
+    empty=UserValues({})
+    layers=[(op,empty,_print_stamps(op,empty) if type(op) in _RASTERIZERS else None) for op in plan.static_ops]
+    layers+=[(op,values,_print_stamps(op,values)) for op in plan.ops]
+    for y0 in range(0,height,tile_height):
+        y1=min(y0+tile_height,height)
+        tile=source.resize((width,y1-y0),Image.LANCZOS,box=(0,y0*fy,source.width,y1*fy))
+        dr=ImageDraw.Draw(tile)
+        band=(0,y0,width,y1)
+        for op,vals,stamps in layers:
+            if stamps is None: _PAINTERS[type(op)](tile,dr,_shift_y(op,-y0),vals)
+            else:
+                for st in stamps:
+                    if _boxes_meet(_stamp_box(st),band): tile.paste(st.fill,(st.xy[0],st.xy[1]-y0),st.mask)
+        yield tile
+
+def export_print(user_data, template_json_path, template_dir, dpi=300, fmt='PNG', width_mm=PRINT_WIDTH_MM,
+                 tile_height=PRINT_TILE_HEIGHT):
+    """高分辨率打印导出：返回 (编码字节的迭代器, (宽, 高), 实际 DPI)。
+    整张画布按 width_mm 与 dpi 缩放（默认 87 mm、300 DPI 时为 1082 像素宽，比原图小；更高 DPI 时放大）；
+    字段语义与 render_ticket 相同；开销按 print_budget 检查；输出逐块编码产出，可直接作为流式响应体"""
+    fmt=str(fmt).upper()
+    if fmt not in PRINT_FORMATS: raise ValueError(f"打印导出不支持的格式: {fmt}")
+    plan=load_render_plan(template_json_path,template_dir,print_scale(template_json_path,template_dir,dpi,width_mm),cache=False)
+    check_render_cost(plan,user_data,print_budget(plan))
+    width,height=print_size(plan)
+    actual_dpi=width/(width_mm/25.4)
+    tiles=iter_print_tiles(plan,user_data,tile_height)
+    if fmt=='TIFF': return iter_tiff(width,height,'RGB',tiles,tile_height,actual_dpi),(width,height),actual_dpi
+    return iter_png(width,height,'RGB',tiles,dpi=actual_dpi),(width,height),actual_dpi
+
+# ------------------------------
+# 矢量 PDF 输出：背景按 JPEG 嵌入一次，文字写为子集化 TrueType 字体的真文本，线条/箭头/圆圈/二维码/条码为矢量路径
+# ------------------------------
+PDF_JPEG_QUALITY=85
+_SFNTS={}          # (字体文件, index) -> TrueTypeFont，不可嵌入时为 None
+_PDF_BACKGROUNDS=LRUCache(BACKGROUND_CACHE_SIZE)  # (背景路径, 缩放, 质量) -> (背景母版, JPEG 字节)
+
+def pdf_font(font):
+    """Pillow 字体对应的 TrueTypeFont；不是由注册表加载或不是 glyf 轮廓的字体返回 None（改为贴位图）"""
+    origin=_FONT_ORIGIN.get(font)
+    if origin is None: return None
+    sfnt=_SFNTS.get(origin,_MISSING)
+    if sfnt is _MISSING:
+        try: sfnt=TrueTypeFont(_font_bytes(origin[0]),origin[1])
+        except (OSError,ValueError,KeyError,struct.error): sfnt=None
+        _SFNTS[origin]=sfnt
+    return sfnt
+
+def _pdf_run_mask(doc,run):
+    """无法写成文本的字形串：按栅格结果贴纯色掩码"""
+    stamps=run_stamps(run)
+    if stamps is None:
+        pad=run.font.size
+        mask=Image.new('L',(int(math.ceil(max(run.width,0)))+2*pad,run.font.size+2*pad),0)
+        paint_run(ImageDraw.Draw(mask),run._replace(fill=255,x=pad+run.x%1,y=pad+run.y%1))
+        stamps=[Stamp(run.fill,(int(run.x)-pad,int(run.y)-pad),mask)]
+    for st in stamps: doc.mask(st.mask,st.xy,st.fill)
+
+def run_geometry(run):
+    """字形串在栅格排版（anchor='la'）中的 (起点 x, 基线 y, 逐字笔位前进量)；前进量为横向压缩前的像素，含字距"""
+    ascent=run.font.getmetrics()[0] if isinstance(run.font,ImageFont.FreeTypeFont) else run.font.size
+    if run.scale_x!=1.0: x,y,spacing=int(run.x),int(run.y),run.letter_spacing/run.scale_x
+    else: x,y,spacing=run.x,run.y,run.letter_spacing
+    return x,y+ascent,[glyph_advance(run.font,c)+spacing for c in run.text]
+
+def _pdf_runs(doc,runs):
+    """字形串写为 PDF 文本：起点、基线与逐字笔位取自 run_geometry，字距/压缩与位图一致"""
+    for run in runs:
+        if not run.text: continue
+        sfnt=pdf_font(run.font)
+        if sfnt is None:
+            _pdf_run_mask(doc,run)
+            continue
+        x,baseline,advances=run_geometry(run)
+        doc.text(sfnt,run.font.size,x,baseline,run.text,advances,run.fill,run.scale_x)
+
+def _module_edges(n,size):
+    """最近邻放大时各模块的起始像素（与 qr_mask 的 Image.NEAREST 取样一致）"""
+    return [max(0,math.ceil(j*size/n-0.5)) for j in range(n)]+[size]
+
+def _pdf_qr(doc,op,values):
+    modules=qr_modules(encode_ticket_data(values.fmt_map))
+    n=modules.width
+    edges=_module_edges(n,op.size)
+    x0,y0=op.x-op.size//2,op.y-op.size//2
+    px=modules.load()
+    boxes=[]
+    for j in range(n):
+        i=0
+        while i<n:
+            if not px[i,j]: i+=1; continue
+            k=i
+            while k<n and px[k,j]: k+=1
+            boxes.append((x0+edges[i],y0+edges[j],x0+edges[k],y0+edges[j+1]))
+            i=k
+    doc.rectangles(boxes,(0,0,0))
+
+def barcode_bars(op,values):
+    """条码各黑条的 (起点 x, 宽度)（画布坐标）；条码各行相同，取首行"""
+    row=barcode_mask(str(values.fmt_map.get('条码数据','demo')),op.width,op.height).crop((0,0,op.width,1)).tobytes()
+    bars=[];x=0
+    while x<len(row):
+        if not row[x]: x+=1; continue
+        k=x
+        while k<len(row) and row[k]: k+=1
+        bars.append((op.x+x,k-x))
+        x=k
+    return bars
+
+def _pdf_barcode(doc,op,values):
+    doc.rectangles([(x,op.y,x+w,op.y+op.height) for x,w in barcode_bars(op,values)],(0,0,0))
+
+def _pdf_circle_text(doc,op,values):
+    text=values.get(op.key)
+    if not text:
+        if op.fallback is not None: _PDF_EMITTERS[type(op.fallback)](doc,op.fallback,values)
+        return
+    for ch,r,cx,cy,f in circle_text_layout(text,op.x,op.y,op.font,op.anchor,op.spacing,op.radius,op.fallbacks):
+        doc.ellipse([cx-r,cy-r,cx+r,cy+r],outline=op.fill,fill=op.circle_fill,width=op.width)
+        adv=glyph_advance(f,ch)
+        _pdf_runs(doc,[GlyphRun(ch,f,op.fill,cx-adv/2,cy-f.size/2,0,1.0,adv)])
+
+# 与 _PAINTERS 一一对应：(doc, op, values)；线条/虚线框/箭头直接复用 ImageDraw 风格的绘制函数
+_PDF_EMITTERS={
+    LineOp:lambda doc,op,values: draw_line(doc,op.start,op.end,fill=op.fill,width=op.width),
+    DashedRectOp:lambda doc,op,values: draw_dashed_rectangle(doc,op.xy,op.dash_length,op.fill,op.width),
+    ArrowOp:lambda doc,op,values: draw_half_arrow(doc,op.xy,op.length,op.height,op.direction,op.fill),
+    OverlayOp:lambda doc,op,values: doc.image(op.image,op.xy),
+    CircleTextOp:_pdf_circle_text, QrOp:_pdf_qr, BarcodeOp:_pdf_barcode,
+    TextOp:lambda doc,op,values: _pdf_runs(doc,layout_text(op,values).runs),
+    SegmentsOp:lambda doc,op,values: _pdf_runs(doc,layout_segments(op,values).runs),
+}
+
+def _pdf_background(plan,quality):
+    master=load_background(plan.background,plan.scale)
+    key=(plan.background,plan.scale,quality)
+    entry=_PDF_BACKGROUNDS.get(key)
+    if entry is None or entry[0] is not master:
+        buf=BytesIO()
+        master.save(buf,format='JPEG',quality=quality)
+        entry=(master,buf.getvalue())
+        _PDF_BACKGROUNDS.put(key,entry)
+    return master,entry[1]
+
+def render_pdf(plan,user_data,width_mm=PRINT_WIDTH_MM,quality=None):
+    """按渲染计划输出单页 PDF 字节；页面宽 width_mm，坐标、锚点、字距与位图渲染一致。
+    背景（plan.scale 分辨率）按 JPEG 质量 quality 嵌入，字体按本张票用到的字形子集化"""
+    values=UserValues(user_data)
+    check_render_cost(plan,values)
+    master,jpeg=_pdf_background(plan,int(quality or PDF_JPEG_QUALITY))
+    doc=PdfDocument(master.width,master.height,width_mm/25.4*72)
+    doc.jpeg(jpeg,master.size,master.mode,(0,0))
+    empty=UserValues({})
+    for op in plan.static_ops: _PDF_EMITTERS[type(op)](doc,op,empty)
+    for op in plan.ops: _PDF_EMITTERS[type(op)](doc,op,values)
+    return doc.tobytes()
+
+def render_ticket_pdf(user_data, template_json_path, template_dir, width_mm=PRINT_WIDTH_MM, quality=None):
+    return render_pdf(load_render_plan(template_json_path,template_dir),user_data,width_mm,quality)
+
+# ------------------------------
+# 显示列表：服务端只做排版，客户端（小程序 canvas）按列表自行绘制；字体、背景、叠加图按内容哈希作为静态资源下发
+# ------------------------------
+DISPLAY_LIST_VERSION=1
+# 图片资源按 (图片文件, (mtime_ns, size), 缩放) 寻址，只缓存 PNG 字节、不持有 Image；缩放由请求决定，条目数有上限
+IMAGE_ASSET_CACHE_SIZE=2*BACKGROUND_CACHE_SIZE
+_ASSETS={}                                   # 字体资源 ID -> (MIME, 字节)
+_FONT_ASSETS={}                              # (字体文件, index) -> 资源 ID
+_IMAGE_ASSETS=LRUCache(IMAGE_ASSET_CACHE_SIZE)   # 图片来源 -> 资源 ID
+_IMAGE_DATA=LRUCache(IMAGE_ASSET_CACHE_SIZE)     # 图片资源 ID -> (MIME, 字节)
+
+def _asset_id(data): return hashlib.sha1(data).hexdigest()[:16]
+
+def font_asset(font):
+    """字体对应的资源 ID（按字体文件内容寻址）；不是由注册表加载的字体返回 None，客户端用系统字体"""
+    origin=_FONT_ORIGIN.get(font)
+    return None if origin is None else _origin_asset(origin)
+
+def _origin_asset(origin):
+    aid=_FONT_ASSETS.get(origin)
+    if aid is None:
+        data=_font_bytes(origin[0])
+        aid=_asset_id(data)
+        _ASSETS[aid]=('font/collection' if data[:4]==b'ttcf' else 'font/ttf',data)
+        _FONT_ASSETS[origin]=aid
+    return aid
+
+def image_asset(source,load):
+    """图片（背景母版、叠加图）对应的资源 ID；source 为 (图片文件, (mtime_ns, size), 缩放)，
+    同一来源只调用 load() 取图并 PNG 编码一次（字节被淘汰后再次登记时重新编码）"""
+    aid=_IMAGE_ASSETS.get(source)
+    if aid is None or _IMAGE_DATA.get(aid) is None:
+        data=encode_png(load())
+        aid=_asset_id(data)
+        _IMAGE_DATA.put(aid,('image/png',data))
+        _IMAGE_ASSETS.put(source,aid)
+    return aid
+
+def _overlay_asset(op): return image_asset(op.source,lambda: op.image)
+
+def _background_asset(plan):
+    st=os.stat(plan.background)
+    return image_asset((plan.background,(st.st_mtime_ns,st.st_size),plan.scale),lambda: load_background(plan.background,plan.scale))
+
+def display_asset(asset_id):
+    """(MIME, 字节)；未登记的 ID 返回 None"""
+    return _ASSETS.get(asset_id) or _IMAGE_DATA.get(asset_id)
+
+def _op_font_origins(op):
+    """op 可能用到的字体文件 (路径, index)：主字体与回退链"""
+    if isinstance(op,SegmentsOp): pairs=[(seg.font,seg.fallbacks) for seg in op.segments]
+    elif isinstance(op,(TextOp,CircleTextOp)): pairs=[(op.font,op.fallbacks)]
+    else: pairs=[]
+    for font,fallbacks in pairs:
+        if font in _FONT_ORIGIN: yield _FONT_ORIGIN[font]
+        yield from fallbacks
+    if isinstance(op,CircleTextOp) and op.fallback is not None: yield from _op_font_origins(op.fallback)
+
+def plan_assets(plan):
+    """登记渲染计划可能用到的全部资源（背景、叠加图、字体），返回 (背景资源 ID, {字体资源 ID: 说明})。
+    字体表覆盖主字体与回退链，与具体用户数据无关，客户端每种样式只需下载一次；
+    显示列表命中缓存时不再逐条生成，资源靠这里重新登记"""
+    fonts={}
+    for op in plan.static_ops+plan.ops:
+        if isinstance(op,OverlayOp): _overlay_asset(op)
+        for origin in _op_font_origins(op):
+            aid=_origin_asset(origin)
+            if aid not in fonts: fonts[aid]={"name":os.path.basename(origin[0]),"index":origin[1]}
+    return _background_asset(plan),fonts
+
+def plan_files(plan):
+    """渲染计划依赖的文件：背景、叠加图、字体（含回退链），去重后按路径排序"""
+    files={plan.background}
+    for op in plan.static_ops+plan.ops:
+        if isinstance(op,OverlayOp): files.add(op.source[0])
+        files.update(path for path,_ in _op_font_origins(op))
+    return sorted(files)
+
+def css_color(fill):
+    if fill is None: return None
+    rgb=ImageColor.getrgb(fill) if isinstance(fill,str) else tuple(fill)
+    return '#%02x%02x%02x'%tuple(rgb[:3])
+
+def _round(v): return round(float(v),3)
+
+def _display_runs(runs):
+    out=[]
+    for run in runs:
+        if not run.text: continue
+        x,baseline,advances=run_geometry(run)
+        out.append({"op":"text","text":run.text,"font":font_asset(run.font),"size":run.font.size,"fill":css_color(run.fill),
+                    "x":_round(x),"baseline":_round(baseline),"advances":[_round(a) for a in advances],
+                    "letter_spacing":_round(run.letter_spacing),"scale_x":_round(run.scale_x)})
+    return out
+
+def _display_circle_text(op,values):
+    text=values.get(op.key)
+    if not text: return _display_op(op.fallback,values) if op.fallback is not None else []
+    out=[]
+    for ch,r,cx,cy,f in circle_text_layout(text,op.x,op.y,op.font,op.anchor,op.spacing,op.radius,op.fallbacks):
+        out.append({"op":"circle","cx":_round(cx),"cy":_round(cy),"r":_round(r),"stroke":css_color(op.fill),
+                    "fill":css_color(op.circle_fill),"width":op.width})
+        adv=glyph_advance(f,ch)
+        out.extend(_display_runs([GlyphRun(ch,f,op.fill,cx-adv/2,cy-f.size/2,0,1.0,adv)]))
+    return out
+
+def _display_qr(op,values):
+    data_str=encode_ticket_data(values.fmt_map)
+    modules=qr_modules(data_str)
+    rows=modules.tobytes()
+    n=modules.width
+    info=qr_info(data_str)
+    return [{"op":"qr","x":op.x-op.size//2,"y":op.y-op.size//2,"size":op.size,
+             "modules":[''.join('1' if v else '0' for v in rows[i*n:(i+1)*n]) for i in range(n)],
+             "version":info["version"],"segments":[list(seg) for seg in info["segments"]]}]
+
+# 与 _PAINTERS 一一对应：(op, values) -> [绘制指令]；坐标均为画布像素（左上角为原点）
+_DISPLAY_OPS={
+    LineOp:lambda op,values: [{"op":"line","points":[list(op.start),list(op.end)],"stroke":css_color(op.fill),"width":op.width}],
+    DashedRectOp:lambda op,values: [{"op":"dashed_rect","rect":list(op.xy),"dash":op.dash_length,"stroke":css_color(op.fill),"width":op.width}],
+    ArrowOp:lambda op,values: [{"op":"polygon","points":[[_round(x),_round(y)] for x,y in half_arrow_points(op.xy,op.length,op.height,op.direction)],
+                                "fill":css_color(op.fill)}],
+    OverlayOp:lambda op,values: [{"op":"image","asset":_overlay_asset(op),"x":op.xy[0],"y":op.xy[1],"width":op.image.width,"height":op.image.height}],
+    CircleTextOp:_display_circle_text, QrOp:_display_qr,
+    BarcodeOp:lambda op,values: [{"op":"bars","y":op.y,"height":op.height,"bars":[list(b) for b in barcode_bars(op,values)]}],
+    TextOp:lambda op,values: _display_runs(layout_text(op,values).runs),
+    SegmentsOp:lambda op,values: _display_runs(layout_segments(op,values).runs),
+}
+
+def _display_op(op,values): return _DISPLAY_OPS[type(op)](op,values)
+
+def display_list(plan,user_data):
+    """排版结果的显示列表（可 JSON 序列化）：背景与字体以资源 ID 引用，ops 按绘制顺序排列，静态元素在前。
+    文本给出起点、基线与逐字笔位前进量（含字距、横向压缩前），客户端按笔位逐字绘制即与服务端位图对齐"""
+    values=UserValues(user_data)
+    check_render_cost(plan,values)
+    background,fonts=plan_assets(plan)
+    width,height=load_background(plan.background,plan.scale).size
+    empty=UserValues({})
+    ops=[item for op in plan.static_ops for item in _display_op(op,empty)]
+    ops+=[item for op in plan.ops for item in _display_op(op,values)]
+    return {"version":DISPLAY_LIST_VERSION,"width":width,"height":height,"scale":plan.scale,
+            "background":background,"fonts":fonts,"ops":ops}
+
+# ------------------------------
+# 批量渲染
+# ------------------------------
+RENDER_MANY_CHUNKSIZE=8
+# 进程池子进程内的渲染参数：(plan, fmt, quality, palette)，由 _init_render_worker 设置
+_WORKER_STATE=None
+
+def _render_one(plan,user_data,fmt,quality,palette):
+    if fmt is None: return render_plan(plan,user_data)
+    if fmt=='PDF': return render_pdf(plan,user_data,quality=quality)
+    image=render_plan(plan,user_data,pool=CANVAS_POOL)
+    try: return encode_image(image,fmt,quality,palette)
+    finally: CANVAS_POOL.release(image)
+
+def _init_render_worker(template_json_path,template_dir,scale,fmt,quality):
+    global _WORKER_STATE
+    plan=load_render_plan(template_json_path,template_dir,scale)
+    _WORKER_STATE=(plan,fmt,quality,load_palette(plan) if fmt=='PNG8' else None)
+
+def _render_in_worker(user_data):
+    plan,fmt,quality,palette=_WORKER_STATE
+    return _render_one(plan,user_data,fmt,quality,palette)
+
+def render_many(template_json_path, template_dir, user_data_iter, fmt=None, quality=None, scale=1.0, max_width=None,
+                processes=None, chunksize=RENDER_MANY_CHUNKSIZE):
+    """批量渲染：模板只编译一次，按输入顺序逐张产出结果（生成器）。
+    fmt 为空时产出 Image，否则产出编码后的字节（见 OUTPUT_FORMATS）；
+    processes > 1 时分块交给进程池，每个子进程只编译一次模板，结果仍按输入顺序返回"""
+    fmt=normalize_format(fmt) if fmt else None
+    scale=resolve_scale(template_json_path,template_dir,scale,max_width)
+    if processes and processes>1:
+        with multiprocessing.Pool(processes,_init_render_worker,(template_json_path,template_dir,scale,fmt,quality)) as pool:
+            yield from pool.imap(_render_in_worker,user_data_iter,chunksize)
+        return
+    plan=load_render_plan(template_json_path,template_dir,scale)
+    palette=load_palette(plan) if fmt=='PNG8' else None
+    for user_data in user_data_iter: yield _render_one(plan,user_data,fmt,quality,palette)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+流式 TIFF 编码
+
+基线 TIFF（小端、未压缩、按条带存储）：未压缩时各条带的字节数事先可知，
+IFD 与条带偏移表写在文件开头，像素数据随分块到达逐条带产出，不在内存中持有整张原始图。
+"""
+
+import struct
+
+# 模式 -> (每像素通道数, Photometric)
+_MODES = {"RGB": (3, 2), "L": (1, 1)}
+SHORT, LONG, RATIONAL = 3, 4, 5
+
+
+def _rational(value):
+    return round(value * 100), 100
+
+
+def tiff_size(width, height, mode, rows_per_strip):
+    """输出文件的总字节数（可作为 Content-Length）"""
+    return len(_header(width, height, mode, rows_per_strip, None)) + width * height * _MODES[mode][0]
+
+
+def _header(width, height, mode, rows_per_strip, dpi):
+    samples, photometric = _MODES[mode]
+    stride = width * samples
+    strips = [(y, min(rows_per_strip, height - y)) for y in range(0, height, rows_per_strip)]
+    entries = 13
+    ifd_size = 2 + entries * 12 + 4
+    extra = 8 + 6 + 8 + 8  # 头部 + BitsPerSample + X/YResolution
+    data_at = extra + ifd_size + 8 * len(strips)
+    bps_at, xres_at = 8 + ifd_size, 8 + ifd_size + 6
+    yres_at, offsets_at = xres_at + 8, xres_at + 16
+    counts_at = offsets_at + 4 * len(strips)
+    offsets, pos = [], data_at
+    for _, rows in strips:
+        offsets.append(pos)
+        pos += rows * stride
+    dpi = dpi or 72
+    tags = [
+        (256, LONG, 1, width),
+        (257, LONG, 1, height),
+        (258, SHORT, samples, bps_at if samples > 1 else 8),
+        (259, SHORT, 1, 1),
+        (262, SHORT, 1, photometric),
+        (273, LONG, len(strips), offsets_at if len(strips) > 1 else offsets[0]),
+        (277, SHORT, 1, samples),
+        (278, LONG, 1, rows_per_strip),
+        (279, LONG, len(strips), counts_at if len(strips) > 1 else strips[0][1] * stride),
+        (282, RATIONAL, 1, xres_at),
+        (283, RATIONAL, 1, yres_at),
+        (284, SHORT, 1, 1),
+        (296, SHORT, 1, 2),
+    ]
+    out = [b"II*\x00", struct.pack("<I", 8), struct.pack("<H", entries)]
+    for tag, typ, count, value in tags:
+        packed = struct.pack("<HH", value, 0) if typ == SHORT and count == 1 else struct.pack("<I", value)
+        out.append(struct.pack("<HHI", tag, typ, count) + packed)
+    out.append(struct.pack("<I", 0))
+    out.append(struct.pack("<3H", 8, 8, 8) if samples > 1 else b"\0" * 6)
+    out.append(struct.pack("<2I", *_rational(dpi)) * 2)
+    out.append(struct.pack("<%dI" % len(strips), *offsets))
+    out.append(struct.pack("<%dI" % len(strips), *(rows * stride for _, rows in strips)))
+    return b"".join(out)
+
+
+def iter_tiff(width, height, mode, tiles, rows_per_strip, dpi=None):
+    """tiles 依次产出宽为 width、除最后一块外高为 rows_per_strip 的分块图；dpi 写入分辨率标签"""
+    yield _header(width, height, mode, rows_per_strip, dpi)
+    rows = 0
+    for tile in tiles:
+        rows += tile.height
+        yield tile.tobytes()
+    if rows != height:
+        raise ValueError(f"分块总行数 {rows} 与图片高度 {height} 不一致")
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+TrueType（glyf 轮廓，含 TTC）解析与子集化
+
+cmap_mapping 供字符覆盖判断；TrueTypeFont.subset 供 PDF 嵌入：只保留用到的字形（连同组合字形引用的部件），
+字形按使用顺序重新编号，hmtx/loca/glyf/maxp/hhea 随之重建，并写入新编号的 Unicode cmap。
+"""
+
+import struct
+
+# 重建时原样保留的表（提示指令与度量），其余表（GSUB/GPOS/位图等）丢弃
+_KEEP_TABLES = (b"OS/2", b"cvt ", b"fpgm", b"gasp", b"name", b"prep")
+# 组合字形部件标志
+_ARG_WORDS, _HAS_SCALE, _MORE, _XY_SCALE, _TWO_BY_TWO = 0x1, 0x8, 0x20, 0x40, 0x80
+
+
+def _directory(data, index=0):
+    """返回 {表名: (偏移, 长度)}"""
+    base = 0
+    if data[:4] == b"ttcf":
+        num = struct.unpack_from(">I", data, 8)[0]
+        base = struct.unpack_from(">I", data, 12 + 4 * min(index, num - 1))[0]
+    tables = {}
+    for i in range(struct.unpack_from(">H", data, base + 4)[0]):
+        tag, _, offset, length = struct.unpack_from(">4sIII", data, base + 12 + 16 * i)
+        tables[tag] = (offset, length)
+    return tables
+
+
+def cmap_mapping(data, index=0):
+    """解析 cmap，返回 {Unicode 码位: 字形编号}（只含非空字形）"""
+    cmap = _directory(data, index).get(b"cmap")
+    if cmap is None:
+        return {}
+    cmap = cmap[0]
+    subtables = {}
+    for i in range(struct.unpack_from(">H", data, cmap + 2)[0]):
+        pid, eid, offset = struct.unpack_from(">HHI", data, cmap + 4 + 8 * i)
+        subtables[(pid, eid)] = cmap + offset
+    # 优先完整 Unicode（format 12），其次 BMP（format 4）
+    for key in ((3, 10), (0, 6), (0, 4), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0), (3, 0)):
+        off = subtables.get(key)
+        if off is None:
+            continue
+        fmt = struct.unpack_from(">H", data, off)[0]
+        if fmt == 12:
+            mapping = {}
+            for g in range(struct.unpack_from(">I", data, off + 12)[0]):
+                start, end, gid = struct.unpack_from(">III", data, off + 16 + 12 * g)
+                mapping.update(zip(range(start, end + 1), range(gid, gid + end - start + 1)))
+            return {c: g for c, g in mapping.items() if g}
+        if fmt == 4:
+            segx2 = struct.unpack_from(">H", data, off + 6)[0]
+            seg = segx2 // 2
+            ends = struct.unpack_from(">%dH" % seg, data, off + 14)
+            starts = struct.unpack_from(">%dH" % seg, data, off + 16 + segx2)
+            deltas = struct.unpack_from(">%dh" % seg, data, off + 16 + 2 * segx2)
+            range_base = off + 16 + 3 * segx2
+            ranges = struct.unpack_from(">%dH" % seg, data, range_base)
+            mapping = {}
+            for i in range(seg):
+                start, end, delta, ro = starts[i], ends[i], deltas[i], ranges[i]
+                if start == 0xFFFF:
+                    continue
+                if ro == 0:
+                    for c in range(start, end + 1):
+                        gid = (c + delta) & 0xFFFF
+                        if gid:
+                            mapping[c] = gid
+                else:
+                    gids = struct.unpack_from(">%dH" % (end - start + 1), data, range_base + 2 * i + ro)
+                    for c, gid in zip(range(start, end + 1), gids):
+                        if gid and (gid + delta) & 0xFFFF:
+                            mapping[c] = (gid + delta) & 0xFFFF
+            return mapping
+    return {}
+
+
+def _checksum(data):
+    data += b"\0" * (-len(data) % 4)
+    return sum(struct.unpack(">%dI" % (len(data) // 4), data)) & 0xFFFFFFFF
+
+
+def _pad4(data):
+    return data + b"\0" * (-len(data) % 4)
+
+
+class TrueTypeFont:
+    """只读的 glyf 轮廓字体；字形编号即原字体中的编号"""
+
+    def __init__(self, data, index=0):
+        self.data = data
+        self.tables = _directory(data, index)
+        if b"glyf" not in self.tables:
+            raise ValueError("只支持 TrueType 轮廓（glyf）字体")
+        head = self.table(b"head")
+        self.units_per_em = struct.unpack_from(">H", head, 18)[0]
+        self.bbox = struct.unpack_from(">4h", head, 36)
+        self.long_loca = struct.unpack_from(">h", head, 50)[0] == 1
+        self.num_glyphs = struct.unpack_from(">H", self.table(b"maxp"), 4)[0]
+        hhea = self.table(b"hhea")
+        self.ascender, self.descender = struct.unpack_from(">hh", hhea, 4)
+        self.num_hmetrics = struct.unpack_from(">H", hhea, 34)[0]
+        self.cmap = cmap_mapping(data, index)
+        self.postscript_name = self._postscript_name()
+
+    def table(self, tag):
+        offset, length = self.tables[tag]
+        return self.data[offset:offset + length]
+
+    def _postscript_name(self):
+        if b"name" not in self.tables:
+            return ""
+        offset = self.tables[b"name"][0]
+        count, strings = struct.unpack_from(">2xHH", self.data, offset)
+        for i in range(count):
+            pid, eid, lang, nid, length, at = struct.unpack_from(">6H", self.data, offset + 6 + 12 * i)
+            if nid != 6:
+                continue
+            raw = self.data[offset + strings + at:offset + strings + at + length]
+            name = raw.decode("utf-16-be", "ignore") if pid in (0, 3) else raw.decode("latin-1")
+            name = "".join(c for c in name if c.isascii() and (c.isalnum() or c in "-_"))
+            if name:
+                return name
+        return ""
+
+    def metrics(self, gid):
+        """(前进宽度, 左侧空白)，字体单位"""
+        hmtx = self.tables[b"hmtx"][0]
+        if gid < self.num_hmetrics:
+            return struct.unpack_from(">Hh", self.data, hmtx + 4 * gid)
+        advance = struct.unpack_from(">H", self.data, hmtx + 4 * (self.num_hmetrics - 1))[0]
+        return advance, struct.unpack_from(">h", self.data, hmtx + 4 * self.num_hmetrics + 2 * (gid - self.num_hmetrics))[0]
+
+    def advance(self, gid):
+        return self.metrics(gid)[0]
+
+    def glyph(self, gid):
+        loca = self.tables[b"loca"][0]
+        if self.long_loca:
+            start, end = struct.unpack_from(">II", self.data, loca + 4 * gid)
+        else:
+            start, end = (2 * v for v in struct.unpack_from(">HH", self.data, loca + 2 * gid))
+        glyf = self.tables[b"glyf"][0]
+        return self.data[glyf + start:glyf + end]
+
+    @staticmethod
+    def _components(glyph):
+        """组合字形各部件：[(部件编号在字形数据中的偏移, 部件字形编号)]；简单字形返回 []"""
+        if len(glyph) < 10 or struct.unpack_from(">h", glyph, 0)[0] >= 0:
+            return []
+        out, pos = [], 10
+        while True:
+            flags, gid = struct.unpack_from(">HH", glyph, pos)
+            out.append((pos + 2, gid))
+            pos += 4 + (4 if flags & _ARG_WORDS else 2)
+            pos += 2 if flags & _HAS_SCALE else 4 if flags & _XY_SCALE else 8 if flags & _TWO_BY_TWO else 0
+            if not flags & _MORE:
+                return out
+
+    def subset(self, gids, unicodes=None):
+        """按 gids 的顺序重新编号（gids[0] 应为 0 号 .notdef），组合字形引用的部件追加在末尾；
+        unicodes 为 {新编号: 字符}，写入 format 12 cmap。返回 (字体字节, [原编号...])"""
+        order = list(gids)
+        new_ids = {gid: i for i, gid in enumerate(order)}
+        glyphs = []
+        i = 0
+        while i < len(order):
+            glyph = self.glyph(order[i])
+            for _, part in self._components(glyph):
+                if part not in new_ids:
+                    new_ids[part] = len(order)
+                    order.append(part)
+            glyphs.append(glyph)
+            i += 1
+        glyf, loca, hmtx = [], [0], []
+        for gid, glyph in zip(order, glyphs):
+            comps = self._components(glyph)
+            if comps:
+                glyph = bytearray(glyph)
+                for at, part in comps:
+                    struct.pack_into(">H", glyph, at, new_ids[part])
+                glyph = bytes(glyph)
+            glyf.append(_pad4(glyph))
+            loca.append(loca[-1] + len(glyf[-1]))
+            hmtx.append(struct.pack(">Hh", *self.metrics(gid)))
+        n = len(order)
+        head = bytearray(self.table(b"head")[:54])
+        struct.pack_into(">I", head, 8, 0)
+        struct.pack_into(">h", head, 50, 1)
+        hhea = bytearray(self.table(b"hhea")[:36])
+        struct.pack_into(">H", hhea, 34, n)
+        maxp = bytearray(self.table(b"maxp"))
+        struct.pack_into(">H", maxp, 4, n)
+        post = bytearray(self.table(b"post")[:32]) if b"post" in self.tables else bytearray(32)
+        struct.pack_into(">I", post, 0, 0x00030000)
+        tables = {
+            b"head": bytes(head), b"hhea": bytes(hhea), b"maxp": bytes(maxp), b"post": bytes(post),
+            b"hmtx": b"".join(hmtx), b"loca": struct.pack(">%dI" % len(loca), *loca), b"glyf": b"".join(glyf),
+            b"cmap": _cmap12(unicodes or {}),
+        }
+        for tag in _KEEP_TABLES:
+            if tag in self.tables:
+                tables[tag] = self.table(tag)
+        return _sfnt(tables), order
+
+
+def _cmap12(unicodes):
+    groups = sorted((ord(ch), gid) for gid, ch in unicodes.items())
+    body = b"".join(struct.pack(">III", c, c, gid) for c, gid in groups)
+    sub = struct.pack(">HHIII", 12, 0, 16 + len(body), 0, len(groups)) + body
+    return struct.pack(">HHHHI", 0, 1, 3, 10, 12) + sub
+
+
+def _sfnt(tables):
+    tags = sorted(tables)
+    num = len(tags)
+    entry = 1 << (num.bit_length() - 1)
+    header = struct.pack(">IHHHH", 0x00010000, num, entry * 16, entry.bit_length() - 1, num * 16 - entry * 16)
+    offset = 12 + 16 * num
+    records, body = [], []
+    for tag in tags:
+        data = tables[tag]
+        records.append(struct.pack(">4sIII", tag, _checksum(data), offset, len(data)))
+        body.append(_pad4(data))
+        offset += len(body[-1])
+    font = bytearray(header + b"".join(records) + b"".join(body))
+    head_at = struct.unpack_from(">I", font, 12 + 16 * tags.index(b"head") + 8)[0]
+    struct.pack_into(">I", font, head_at + 8, (0xB1B0AFBA - _checksum(bytes(font))) & 0xFFFFFFFF)
+    return bytes(font)
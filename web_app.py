@@ -1,7 +1,7 @@
 from flask import Flask, render_template_string, request, send_file, url_for, session, jsonify
-from ticket import render_ticket
+from ticket import render_ticket, encode_image
+from render_cache import render_ticket_bytes
 import os, json
-from io import BytesIO
 import base64
 import uuid
 import shutil
@@ -1674,11 +1674,10 @@ def index():
             data = request.get_json(force=True)
             style = data.get('style', selected_style)
             user_data = data.get('user_data', {})
-            img = render_ticket(user_data, get_template_json(style), TEMPLATE_DIR)
-            buf = BytesIO()
-            img.save(buf, format='PNG')
-            buf.seek(0)
-            b64 = base64.b64encode(buf.read()).decode('ascii')
+            # 预览可按 max_width / scale 降低分辨率，正式生成仍为原始分辨率
+            image_bytes = render_ticket_bytes(user_data, get_template_json(style), TEMPLATE_DIR,
+                                              scale=float(data.get('scale') or 1.0), max_width=data.get('max_width'))
+            b64 = base64.b64encode(image_bytes).decode('ascii')
             return jsonify({'success': True, 'image_base64': b64})
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)})
@@ -1698,7 +1697,8 @@ def index():
         try:
             img = render_ticket(user_data, get_template_json(selected_style), TEMPLATE_DIR)
             ticket_path = get_user_ticket_path(user_id)
-            img.save(ticket_path, format="PNG")
+            with open(ticket_path, "wb") as f:
+                f.write(encode_image(img))
             ticket_url = url_for("get_user_ticket", user_id=user_id)
         except Exception as e:
             return f"生成失败: {e}"